@@ -1,16 +1,31 @@
+from app import startup
 import os
 from flask import Flask
 from flask_cors import CORS
 
 from app.api import (
-    AuthResource, UserResource, RoleResource, RefreshResource, TOTPResource
+    AuthResource, UserResource, BulkUserResource, RoleResource, RefreshResource, TOTPResource, JWKSResource,
+    StatsResource, MetricsResource, ExportResource, register_stats, init_principal_cache, init_token_cache,
+    init_keys, init_qr_cache
 )
-from app.utils import db, RedisBlacklist
+from app.api.schemas import ResultErrorSchema
+from app.blacklist import BlacklistFull
+from app.commands import register_commands
+from app.encoder import fast_json
+from app.hashing import hashing, HashingUnavailable
+from app.metrics import metrics
+from app.redis_client import redis_client
+from app.utils import db
 from app.config import ProductionConfig, DevelopmentConfig
+from app.migrations import check_schema
+from app.queries import query_counter
 from app.views import default
 
+startup.imported()
+
 
 def create_app(testing_config=None) -> Flask:
+    report = startup.StartupReport()
     app = Flask(__name__)
     CORS(app)
 
@@ -23,33 +38,105 @@ def create_app(testing_config=None) -> Flask:
             app.config.from_object(ProductionConfig)
     else:
         app.config.from_object(testing_config)
+    report.mark('config')
+
+    # initialize the json encoder of the responses
+    fast_json.init_app(app)
 
     # initialize database
     db.init_app(app)
     register_models()
 
-    # initialize redis blacklist
-    if isinstance(app.config.get('BLACKLIST'), RedisBlacklist):
-        app.config.get('BLACKLIST').blacklist.init_app(app)
+    # record the duration of the requests and their stages
+    metrics.init_app(app)
+    # count the statements of each request, the db stage is timed by the counter
+    query_counter.init_app(app)
+
+    # initialize the shared redis client
+    if app.config.get('REDIS_URL'):
+        redis_client.init_app(app)
+        register_stats(app, 'redis', redis_client.stats)
+
+    # initialize the refresh token blacklist
+    app.config.get('BLACKLIST').init_app(app)
+    app.register_error_handler(BlacklistFull, blacklist_full)
+    register_stats(app, 'blacklist', app.config.get('BLACKLIST').stats)
+
+    # initialize the login throttle
+    app.config.get('THROTTLE').init_app(app)
+    register_stats(app, 'throttle', app.config.get('THROTTLE').stats)
+
+    # initialize the password hashing pool
+    hashing.init_app(app)
+    app.register_error_handler(HashingUnavailable, hashing_unavailable)
+    register_stats(app, 'hashing', hashing.stats)
+
+    # initialize the cache of authenticated users
+    register_stats(app, 'principals', init_principal_cache(app).stats)
+
+    # load the keys to sign tokens
+    init_keys(app)
 
-    with app.app_context():
-        # create tables
-        db.create_all()
+    # initialize the cache of verified tokens
+    register_stats(app, 'tokens', init_token_cache(app).stats)
+
+    # initialize the cache of rendered qr codes
+    register_stats(app, 'qr_codes', init_qr_cache(app).stats)
+    report.mark('extensions')
+
+    # the tables are created and upgraded by `flask db upgrade`, a worker only checks the version
+    check_schema(app)
+    db.warmup(app)
+    register_stats(app, 'database', lambda: db.pool_stats(app))
+    report.mark('database')
 
     # register resources
     register_resource(app, AuthResource, 'auth_api', '/api/auth', get=False, put=False, delete=False)
+    register_resource(app, JWKSResource, 'jwks_api', '/.well-known/jwks.json', pk=None,
+                      get=False, post=False, put=False, delete=False)
     register_resource(app, RefreshResource, 'refresh_api', '/api/auth/refresh', pk='token', pk_type='string',
                       get=False, get_all=False, put=False)
     register_resource(app, RoleResource, 'role_api', '/api/roles', pk='name', pk_type='string')
     register_resource(app, UserResource, 'user_api', '/api/users', pk='guid', pk_type='string')
+    register_resource(app, BulkUserResource, 'user_bulk_api', '/api/users/bulk', pk=None,
+                      get=False, get_all=False, put=False, delete=False)
     register_resource(app, TOTPResource, 'two_factor_api', '/api/users/2fa', pk=None, get=False, put=False)
+    register_resource(app, StatsResource, 'stats_api', '/api/stats', pk='name', pk_type='string',
+                      post=False, put=False, delete=False)
+    register_resource(app, MetricsResource, 'metrics_api', '/metrics', pk=None,
+                      get=False, post=False, put=False, delete=False)
+    register_resource(app, ExportResource, 'export_api', '/api/export', pk='name', pk_type='string',
+                      get_all=False, post=False, put=False, delete=False)
 
     # register views
     app.register_blueprint(default)
 
+    # register cli commands
+    register_commands(app)
+    report.mark('routes')
+
+    app.extensions['startup'] = report
+    register_stats(app, 'startup', report.stats)
+    report.log(app)
     return app
 
 
+def hashing_unavailable(error: HashingUnavailable):
+    return ResultErrorSchema(
+        message='Server is busy, try again later',
+        status_code=503,
+        headers={'Retry-After': str(error.retry_after)}
+    ).jsonify()
+
+
+def blacklist_full(error: BlacklistFull):
+    return ResultErrorSchema(
+        message='Unable to blacklist the token, try again later',
+        status_code=503,
+        headers={'Retry-After': str(error.retry_after)}
+    ).jsonify()
+
+
 def register_models():
     # noinspection PyUnresolvedReferences
     from .api import User, Role
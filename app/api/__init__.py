@@ -1,4 +1,9 @@
-from .user import User, UserResource
-from .totp import TOTPResource
+from .user import User, UserResource, BulkUserResource
+from .totp import TOTPResource, init_qr_cache
 from .role import Role, RoleResource
-from .authentication import AuthResource, RefreshResource, require_admin, require_token
+from .authentication import (
+    AuthResource, RefreshResource, JWKSResource, require_admin, require_token, init_principal_cache,
+    invalidate_principal, init_token_cache, init_keys
+)
+from .stats import StatsResource, MetricsResource, register_stats
+from .export import ExportResource
@@ -1,2 +1,6 @@
-from .resources import AuthResource, RefreshResource
-from .utils import require_token, require_admin
+from .resources import AuthResource, RefreshResource, JWKSResource
+from .utils import (
+    require_token, require_admin, init_principal_cache, invalidate_principal, throttle_limits, throttled
+)
+from .tokens import init_token_cache
+from .keys import init_keys
@@ -0,0 +1,164 @@
+from flask import current_app, json
+from jwt.algorithms import get_default_algorithms
+from base64 import urlsafe_b64encode
+from datetime import datetime, timezone
+from hashlib import sha256
+from typing import Dict, Union
+import os
+import time
+import jwt
+
+# asymmetric algorithms, the public keys are published as jwks
+ALGORITHMS = ['RS256', 'ES256']
+
+
+def generate_private_key(algorithm: str) -> bytes:
+    """
+    Requires the optional cryptography package
+    """
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ec, rsa
+    if algorithm == 'RS256':
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048, backend=default_backend())
+    else:
+        key = ec.generate_private_key(ec.SECP256R1(), default_backend())
+    return key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption()
+    )
+
+
+def to_jwk(algorithm: str, public_key) -> dict:
+    if algorithm == 'RS256':
+        return json.loads(get_default_algorithms()[algorithm].to_jwk(public_key))
+    # pyjwt can't serialize elliptic curve keys
+    numbers = public_key.public_numbers()
+    return {
+        'kty': 'EC',
+        'crv': 'P-256',
+        'x': urlsafe_b64encode(numbers.x.to_bytes(32, 'big')).decode().rstrip('='),
+        'y': urlsafe_b64encode(numbers.y.to_bytes(32, 'big')).decode().rstrip('=')
+    }
+
+
+class KeySet:
+    """
+    Keys used to sign and verify tokens, identified by the kid header of the token.
+    The signing key is used for new tokens, all other keys are only used to verify
+    tokens issued before a key rotation.
+    """
+    def __init__(self, algorithm: str = 'HS256', legacy_until: Union[datetime, str] = None) -> "KeySet":
+        self.algorithm = algorithm
+        self.legacy_until = to_timestamp(legacy_until) if legacy_until else None
+        self.signing_kid = None
+        self.private_keys = {}
+        self.public_keys = {}
+        self.fingerprint = b''
+        self._jwks = {'keys': []}
+
+    @property
+    def asymmetric(self) -> bool:
+        return self.algorithm in ALGORITHMS
+
+    def load(self, keys: Dict[str, bytes], signing_kid: str = None):
+        """
+        Load PEM encoded keys, public keys can be used to keep verifying tokens of a retired key
+        """
+        try:
+            from cryptography.hazmat.backends import default_backend
+            from cryptography.hazmat.primitives import serialization
+        except ImportError:
+            raise RuntimeError(f'The {self.algorithm} algorithm requires the cryptography package')
+        for kid, pem in sorted(keys.items()):
+            try:
+                private_key = serialization.load_pem_private_key(pem, password=None, backend=default_backend())
+            except ValueError:
+                self.public_keys[kid] = serialization.load_pem_public_key(pem, backend=default_backend())
+            else:
+                self.private_keys[kid] = private_key
+                self.public_keys[kid] = private_key.public_key()
+        if not self.private_keys:
+            raise RuntimeError(f'No private key found to sign {self.algorithm} tokens')
+        self.signing_kid = signing_kid or sorted(self.private_keys)[-1]
+        if self.signing_kid not in self.private_keys:
+            raise RuntimeError(f'The signing key {self.signing_kid} does not exist')
+        self._jwks = {'keys': [
+            dict(to_jwk(self.algorithm, public_key), kid=kid, alg=self.algorithm, use='sig')
+            for kid, public_key in sorted(self.public_keys.items())
+        ]}
+        self.fingerprint = sha256(json.dumps(self._jwks, sort_keys=True).encode()).digest()[:8]
+
+    def load_directory(self, path: str, signing_kid: str = None):
+        """
+        Load all <kid>.pem files of a directory
+        """
+        keys = {}
+        for name in os.listdir(path):
+            if name.endswith('.pem'):
+                with open(os.path.join(path, name), 'rb') as f:
+                    keys[name[:-4]] = f.read()
+        self.load(keys, signing_kid)
+
+    def signing_key(self) -> tuple:
+        """
+        The key and headers used to sign a new token
+        """
+        if not self.asymmetric:
+            return current_app.config['SECRET_KEY'], None
+        return self.private_keys[self.signing_kid], {'kid': self.signing_kid}
+
+    def verification_key(self, token: str) -> tuple:
+        """
+        The key and algorithm to verify the token, tokens without kid have been signed
+        with SECRET_KEY. With asymmetric signing they are only accepted until `legacy_until`,
+        if they expire before it (tokens issued before asymmetric signing has been enabled).
+        """
+        kid = jwt.get_unverified_header(token).get('kid')
+        if kid is None:
+            if self.asymmetric and not self.accepts_legacy(token):
+                raise jwt.exceptions.InvalidSignatureError('Missing key id')
+            return current_app.config['SECRET_KEY'], 'HS256'
+        if not self.asymmetric or kid not in self.public_keys:
+            raise jwt.exceptions.InvalidSignatureError('Unknown key')
+        return self.public_keys[kid], self.algorithm
+
+    def accepts_legacy(self, token: str) -> bool:
+        if self.legacy_until is None or time.time() >= self.legacy_until:
+            return False
+        # the expiry is verified with the signature afterwards
+        expires = jwt.decode(token, verify=False).get('exp')
+        return isinstance(expires, (int, float)) and expires <= self.legacy_until
+
+    def jwks(self) -> dict:
+        """
+        The public keys as json web key set
+        """
+        return self._jwks
+
+
+def to_timestamp(value: Union[datetime, str]) -> float:
+    """
+    Seconds since the epoch of a datetime or an iso 8601 string, utc if it has no time zone
+    """
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def init_keys(app) -> KeySet:
+    keys = KeySet(app.config.get('JWT_ALGORITHM', 'HS256'), app.config.get('JWT_LEGACY_UNTIL'))
+    if keys.asymmetric:
+        if app.config.get('JWT_PRIVATE_KEYS'):
+            keys.load(app.config['JWT_PRIVATE_KEYS'], app.config.get('JWT_SIGNING_KEY'))
+        else:
+            keys.load_directory(app.config['JWT_KEYS_PATH'], app.config.get('JWT_SIGNING_KEY'))
+    app.extensions['jwt_keys'] = keys
+    return keys
+
+
+def get_keys() -> KeySet:
+    return current_app.extensions.get('jwt_keys') or KeySet()
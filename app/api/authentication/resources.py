@@ -1,15 +1,18 @@
 from flask.views import MethodView
-from flask import request, current_app
+from flask import request, current_app, jsonify
 import jwt
-from datetime import datetime, timedelta
+from datetime import datetime
 from typing import Union
 from marshmallow.exceptions import ValidationError
 
+from app.metrics import metrics
 from app.utils import db
 from app.api.user import User
 from ..schemas import ResultSchema, ResultErrorSchema
-from .utils import require_token
-from .schemas import AuthSchema, AuthResultSchema, TokenRefreshSchema
+from .utils import require_token, invalidate_principal, throttle_limits, throttled
+from .tokens import create_access_token, create_refresh_token, decode_token, evict_token
+from .keys import get_keys
+from .schemas import AuthResultSchema, auth_schema, token_refresh_schema
 
 
 class AuthResource(MethodView):
@@ -23,21 +26,28 @@ class AuthResource(MethodView):
         """
         Login using username, password (and 2fa token)
         """
-        schema = AuthSchema()
         data = request.get_json() or {}
         try:
-            data = schema.load(data)
+            data = auth_schema.load(data)
         except ValidationError as errors:
+            metrics.logins.inc('invalid_payload')
             return AuthResultSchema(
                 message='Payload is invalid',
                 errors=errors.messages,
                 status_code=400
             ).jsonify()
 
+        # limit the password guesses before spending any time on hashing
+        retry_after = current_app.config.get('THROTTLE').acquire(throttle_limits('login', data.get('username')))
+        if retry_after:
+            metrics.logins.inc('throttled')
+            return throttled(retry_after)
+
         # Get the user object by the submitted username
         user = User.query.filter_by(username=data.get('username')).first()
         # Check if the user exists, if the submitted password is correct
         if not user or not user.verify_password(data.get('password')):
+            metrics.logins.inc('invalid_credentials')
             return AuthResultSchema(
                 message='Invalid credentials',
                 status_code=401
@@ -48,40 +58,32 @@ class AuthResource(MethodView):
             if 'token' in data:
                 # check if submitted 2fa token is valid
                 if not user.verify_totp(data.get('token')):
+                    metrics.logins.inc('invalid_2fa')
                     # @Security: (read next note first): this message could be exchanged through 2fa token invalid
                     return AuthResultSchema(
                         message='Invalid credentials',
                         status_code=401
                     ).jsonify()
             else:
+                metrics.logins.inc('missing_2fa')
                 # @Security: Could an attacker use this error message to validate username and password
                 return AuthResultSchema(
                     message='Missing 2fa token',
                     status_code=401
                 ).jsonify()
 
+        user.renew_hash(data.get('password'))
+
         # set the last_login attribute in the user object to the current time
         user.last_login = datetime.now()
         db.session.commit()
-
-        access_token_data = {
-            "exp": datetime.utcnow() + timedelta(minutes=current_app.config['ACCESS_TOKEN_VALIDITY']),
-            "username": user.username
-        }
-
-        access_token = jwt.encode(access_token_data, current_app.config["SECRET_KEY"]).decode()
-
-        refresh_token_data = {
-            "exp": datetime.utcnow() + timedelta(minutes=current_app.config['REFRESH_TOKEN_VALIDITY']),
-            "username": user.username
-        }
-
-        refresh_token = jwt.encode(refresh_token_data, current_app.config["SECRET_KEY"]).decode()
+        invalidate_principal(user.username)
+        metrics.logins.inc('success')
 
         return AuthResultSchema(
             message='Authentication was successfully',
-            access_token=access_token,
-            refresh_token=refresh_token
+            access_token=create_access_token(user),
+            refresh_token=create_refresh_token(user)
         ).jsonify()
 
 
@@ -90,10 +92,9 @@ class RefreshResource(MethodView):
         """
         Generate a new access token, using a - not blacklisted - refresh token
         """
-        schema = TokenRefreshSchema()
         data = request.get_json() or {}
         try:
-            data = schema.load(data)
+            data = token_refresh_schema.load(data)
         except ValidationError as errors:
             return AuthResultSchema(
                 message='Payload is invalid',
@@ -101,34 +102,40 @@ class RefreshResource(MethodView):
                 status_code=400
             ).jsonify()
 
+        retry_after = current_app.config.get('THROTTLE').acquire(throttle_limits('refresh'))
+        if retry_after:
+            return throttled(retry_after)
+
         try:
             refresh_token = data['refreshToken']
 
             # check if refresh token has been blacklisted
             if current_app.config.get('BLACKLIST').check(refresh_token):
+                metrics.blacklist_hits.inc()
                 return ResultSchema(
                     data='Invalid refresh token',
                     status_code=401
                 ).jsonify()
 
-            refresh_token_data = jwt.decode(refresh_token, current_app.config['SECRET_KEY'], algorithms='HS256')
+            refresh_token_data = decode_token(refresh_token)
 
             # check if the user still exists (could have been delete in the meantime)
-            if not User.query.filter_by(username=refresh_token_data.get('username')).first():
+            user = User.query.filter_by(username=refresh_token_data.get('username')).first()
+            if not user:
                 return ResultErrorSchema(
                     message='User does not exist!'
                 ).jsonify()
 
-            # generate new access token
-            access_token_data = {
-                "exp": datetime.now() + timedelta(minutes=current_app.config['ACCESS_TOKEN_VALIDITY']),
-                "username": refresh_token_data['username']
-            }
-            new_access_token = jwt.encode(access_token_data, current_app.config["SECRET_KEY"]).decode()
+            # tokens issued before e.g. a role or password change have been revoked
+            if refresh_token_data.get('gen', user.token_generation or 0) != (user.token_generation or 0):
+                return ResultErrorSchema(
+                    message='Invalid refresh token',
+                    status_code=401
+                ).jsonify()
 
             return AuthResultSchema(
                 message='Token refresh was successful',
-                access_token=new_access_token
+                access_token=create_access_token(user)
             ).jsonify()
         except (jwt.exceptions.DecodeError, jwt.ExpiredSignatureError, jwt.exceptions.InvalidSignatureError):
             return ResultErrorSchema(
@@ -144,8 +151,9 @@ class RefreshResource(MethodView):
         if not blacklist.check(token):
             try:
                 # check if the token is valid (could be a way to spam the blacklist)
-                jwt.decode(token, current_app.config['SECRET_KEY'], algorithms='HS256')
+                decode_token(token)
                 blacklist.add(token)
+                evict_token(token)
                 return ResultSchema(
                     data='Successfully blacklisted token',
                     status_code=200
@@ -160,3 +168,15 @@ class RefreshResource(MethodView):
                 data='Successfully blacklisted token',
                 status_code=200
             ).jsonify()
+
+
+class JWKSResource(MethodView):
+    def get(self):
+        """
+        Public keys to verify the tokens without calling this service, cacheable until the next key rotation
+        """
+        resp = jsonify(get_keys().jwks())
+        resp.cache_control.public = True
+        resp.cache_control.max_age = current_app.config.get('JWKS_MAX_AGE', 3600)
+        resp.add_etag()
+        return resp.make_conditional(request)
@@ -1,7 +1,8 @@
 from marshmallow import Schema, fields, validate
-from flask import jsonify
 
+from app.encoder import fast_json
 from ..schemas import validate_spaces
+from ..validation import CompiledSchema
 
 
 class AuthSchema(Schema):
@@ -25,6 +26,11 @@ class TokenRefreshSchema(Schema):
     )
 
 
+# compiled once, they are used by every login and token refresh
+auth_schema = CompiledSchema(AuthSchema)
+token_refresh_schema = CompiledSchema(TokenRefreshSchema)
+
+
 class AuthResultSchema:
     __slots__ = ['message', 'errors', 'access_token', 'refresh_token', 'status_code']
 
@@ -36,9 +42,9 @@ class AuthResultSchema:
         self.status_code = status_code
 
     def jsonify(self):
-        return jsonify({
+        return fast_json.response(fast_json.dumps({
             'message': self.message,
             'errors': self.errors,
             'accessToken': self.access_token,
             'refreshToken': self.refresh_token
-        }), self.status_code
+        })), self.status_code
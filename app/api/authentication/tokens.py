@@ -0,0 +1,93 @@
+from flask import current_app
+from datetime import datetime, timedelta
+from functools import lru_cache
+from hashlib import sha256
+import time
+import jwt
+
+from app.blacklist import token_digest
+from app.cache import TTLCache
+from app.metrics import timed
+from .keys import get_keys
+
+
+def encode_token(data: dict, validity: int) -> str:
+    """
+    Sign the data as jwt, which expires after `validity` minutes
+    """
+    data['exp'] = datetime.utcnow() + timedelta(minutes=validity)
+    keys = get_keys()
+    key, headers = keys.signing_key()
+    with timed('jwt'):
+        return jwt.encode(data, key, algorithm=keys.algorithm, headers=headers).decode()
+
+
+def init_token_cache(app) -> TTLCache:
+    cache = TTLCache(maxsize=app.config.get('TOKEN_CACHE_SIZE', 0), ttl=0)
+    app.extensions['tokens'] = cache
+    return cache
+
+
+@lru_cache(maxsize=8)
+def key_fingerprint(key) -> bytes:
+    return sha256(key if isinstance(key, bytes) else key.encode('utf-8')).digest()[:8]
+
+
+def _cache_key(token: str) -> bytes:
+    # tokens verified with a previous key are not found after a key change
+    return key_fingerprint(current_app.config['SECRET_KEY']) + get_keys().fingerprint + token_digest(token)
+
+
+def _decode(token: str) -> dict:
+    key, algorithm = get_keys().verification_key(token)
+    with timed('jwt'):
+        return jwt.decode(token, key, algorithms=[algorithm])
+
+
+def decode_token(token: str) -> dict:
+    """
+    Verify the token and return its claims, tokens which have been verified before
+    are taken from the cache until they expire
+    """
+    cache = current_app.extensions.get('tokens')
+    if cache is None or cache.maxsize <= 0:
+        return _decode(token)
+    key = _cache_key(token)
+    claims = cache.get(key)
+    if claims is None:
+        claims = _decode(token)
+        if 'exp' in claims:
+            cache.set(key, claims, ttl=claims['exp'] - time.time())
+    return dict(claims)
+
+
+def evict_token(token: str):
+    """
+    Remove a token from the cache of verified tokens, e.g. after it has been blacklisted
+    """
+    cache = current_app.extensions.get('tokens')
+    if cache is not None:
+        cache.pop(_cache_key(token))
+
+
+def token_claims(user) -> dict:
+    """
+    Claims that describe the user, if ACCESS_TOKEN_CLAIMS is enabled the access token can be
+    used for authorization without querying the database
+    """
+    data = {'username': user.username}
+    if current_app.config.get('ACCESS_TOKEN_CLAIMS'):
+        data.update({
+            'guid': user.guid,
+            'role': user.role.name,
+            'gen': user.token_generation or 0
+        })
+    return data
+
+
+def create_access_token(user) -> str:
+    return encode_token(token_claims(user), current_app.config['ACCESS_TOKEN_VALIDITY'])
+
+
+def create_refresh_token(user) -> str:
+    return encode_token(token_claims(user), current_app.config['REFRESH_TOKEN_VALIDITY'])
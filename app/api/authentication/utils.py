@@ -1,8 +1,156 @@
 from flask import request, current_app
+from sqlalchemy.orm import joinedload
 import jwt
-from typing import Union
+from typing import List, Union
+import math
+
+from app.cache import TTLCache
+from app.utils import db
 from ..user import User
 from ..schemas import ResultErrorSchema
+from .tokens import decode_token
+
+
+def init_principal_cache(app) -> TTLCache:
+    cache = TTLCache(
+        maxsize=app.config.get('PRINCIPAL_CACHE_SIZE', 0),
+        ttl=app.config.get('PRINCIPAL_CACHE_TTL', 0)
+    )
+    app.extensions['principals'] = cache
+    # last known token generation of each user, used to validate self-contained access tokens
+    app.extensions['token_generations'] = TTLCache(
+        maxsize=app.config.get('PRINCIPAL_CACHE_SIZE', 0),
+        ttl=app.config.get('PRINCIPAL_CACHE_TTL', 0)
+    )
+    return cache
+
+
+def load_principal(username: str) -> Union[User, None]:
+    """
+    Get the user (including the role) by the username, without querying
+    the database if the user has been resolved recently
+    """
+    cache = current_app.extensions.get('principals')
+    principal = cache.get(username) if cache is not None else None
+    if principal is None:
+        user = User.query.options(joinedload(User.role)).filter_by(username=username).first()
+        if user is None or cache is None or cache.maxsize <= 0:
+            return user
+        # keep a detached copy in the cache, which is never modified by a session
+        db.session.expunge(user)
+        db.session.expunge(user.role)
+        cache.set(username, user)
+        principal = user
+    user = db.session.merge(principal, load=False)
+    # the user count of the cached role changes often, it's reloaded if a view needs it
+    db.session.expire(user.role, ['user_count'])
+    return user
+
+
+def invalidate_principal(*usernames: str):
+    """
+    Remove the given users from the principal cache, all users if no username has been passed
+    """
+    for name in ['principals', 'token_generations']:
+        cache = current_app.extensions.get(name)
+        if cache is None:
+            continue
+        if not usernames:
+            cache.clear()
+        for username in usernames:
+            cache.pop(username)
+
+
+def check_token_generation(username: str, generation: int) -> bool:
+    """
+    Check if the token generation of a self-contained access token is still valid,
+    the database is only queried if the generation is unknown or has changed
+    """
+    cache = current_app.extensions.get('token_generations')
+    known = cache.get(username) if cache is not None else None
+    if known != generation:
+        known = db.session.query(User.token_generation).filter_by(username=username).scalar()
+        if known is None:
+            return False
+        if cache is not None:
+            cache.set(username, known)
+    return known == generation
+
+
+class TokenPrincipal:
+    """
+    The user described by the claims of a self-contained access token,
+    the user object is only loaded if a view accesses anything else than the claims
+    """
+    __slots__ = ['_claims', '_user']
+
+    def __init__(self, claims: dict) -> "TokenPrincipal":
+        object.__setattr__(self, '_claims', claims)
+        object.__setattr__(self, '_user', None)
+
+    @property
+    def username(self) -> str:
+        return self._user.username if self._user is not None else self._claims['username']
+
+    @property
+    def guid(self) -> str:
+        return self._user.guid if self._user is not None else self._claims['guid']
+
+    @property
+    def role_name(self) -> str:
+        return self._user.role_name if self._user is not None else self._claims['role']
+
+    def _resolve(self) -> User:
+        if self._user is None:
+            user = load_principal(self._claims['username'])
+            if user is None:
+                raise AttributeError('The user of this token does not exist anymore')
+            object.__setattr__(self, '_user', user)
+        return self._user
+
+    def __getattr__(self, name: str):
+        return getattr(self._resolve(), name)
+
+    def __setattr__(self, name: str, value):
+        setattr(self._resolve(), name, value)
+
+
+def client_address() -> str:
+    """
+    The address of the client. Behind TRUSTED_PROXIES reverse proxies it's the address appended
+    to X-Forwarded-For by the outermost of them, like werkzeug's ProxyFix does.
+    """
+    proxies = current_app.config.get('TRUSTED_PROXIES')
+    if proxies:
+        forwarded = [address.strip() for address in request.headers.get('X-Forwarded-For', '').split(',')]
+        # the client can send any X-Forwarded-For, only the addresses added by the proxies are trusted
+        if len(forwarded) >= proxies and forwarded[-proxies]:
+            return forwarded[-proxies]
+    return request.remote_addr
+
+
+def throttle_limits(endpoint: str, username: str = None) -> List[tuple]:
+    """
+    The token buckets of the client address and the username, e.g. LOGIN_THROTTLE_CLIENT
+    and LOGIN_THROTTLE_USERNAME, as (capacity, tokens per second) or None if disabled
+    """
+    limits = []
+    client = current_app.config.get(f'{endpoint.upper()}_THROTTLE_CLIENT')
+    if client:
+        limits.append((f'{endpoint}:client:{client_address()}', *client))
+    user = current_app.config.get(f'{endpoint.upper()}_THROTTLE_USERNAME')
+    if user and username is not None:
+        # usernames are compared case insensitive by the database
+        limits.append((f'{endpoint}:username:{username.lower()}', *user))
+    return limits
+
+
+def throttled(retry_after: float) -> tuple:
+    return ResultErrorSchema(
+        message='Too many attempts, try again later',
+        status_code=429,
+        headers={'Retry-After': str(math.ceil(retry_after))}
+    ).jsonify()
 
 
 def require_token(view_func: callable) -> callable:
@@ -15,8 +163,16 @@ def require_token(view_func: callable) -> callable:
             ).jsonify()
         try:
             access_token = access_token.split(" ")[1]
-            token = jwt.decode(access_token, current_app.config['SECRET_KEY'], algorithms='HS256')
-            user = User.query.filter_by(username=token.get('username')).first()
+            token = decode_token(access_token)
+            if current_app.config.get('ACCESS_TOKEN_CLAIMS') and 'gen' in token:
+                if not check_token_generation(token.get('username'), token.get('gen')):
+                    return ResultErrorSchema(
+                        message='Invalid access token',
+                        status_code=401
+                    ).jsonify()
+                user = TokenPrincipal(token)
+            else:
+                user = load_principal(token.get('username'))
             return view_func(*args, **kwargs, user=user)
         except (jwt.exceptions.DecodeError, jwt.ExpiredSignatureError, jwt.exceptions.InvalidSignatureError):
             return ResultErrorSchema(
@@ -32,7 +188,7 @@ def require_admin(view_func: callable) -> callable:
         if not user:
             raise AttributeError('Missing user attribute, please use @require_token before!')
         # check if the user has the role admin
-        if user.role.name != 'admin':
+        if user.role_name != 'admin':
             return ResultErrorSchema(message='Access Denied!', status_code=403).jsonify()
         return view_func(*args, **kwargs)
     return wrapper
@@ -0,0 +1,124 @@
+from flask.views import MethodView
+from flask import request, current_app
+from datetime import datetime, timezone
+from typing import Union
+
+from app.utils import db
+from ..authentication import require_token, require_admin
+from ..schemas import ResultExportSchema, ResultErrorSchema
+from ..role import Role
+from ..user import User
+
+
+def _isoformat(value) -> Union[str, None]:
+    return value.isoformat() if value is not None else None
+
+
+def _parse_datetime(value: str) -> datetime:
+    """
+    Parse an iso 8601 value, values with an offset are converted to utc like the stored timestamps.
+    Raises ValueError if the value is invalid.
+    """
+    # only the exports need dateutil, so it's not imported with the other modules
+    from dateutil.parser import isoparse
+    value = isoparse(value)
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+class UserExport:
+    columns = ['guid', 'username', 'displayName', 'email', 'role', '2fa', 'created', 'lastLogin']
+
+    @staticmethod
+    def query(args: dict):
+        """
+        Only the exported columns are selected, filtered by role names and created/lastLogin ranges
+        """
+        query = db.session.query(
+            User.guid, User.username, User.displayName, User.email, Role.name,
+            User.totp_enabled, User.created, User.last_login
+        ).join(User.role)
+        if args.getlist('role'):
+            query = query.filter(Role.name.in_(args.getlist('role')))
+        for arg, column, after in [('createdAfter', User.created, True),
+                                   ('createdBefore', User.created, False),
+                                   ('lastLoginAfter', User.last_login, True),
+                                   ('lastLoginBefore', User.last_login, False)]:
+            if args.get(arg):
+                value = _parse_datetime(args[arg])
+                query = query.filter(column >= value if after else column < value)
+        return query.order_by(User.id)
+
+    @staticmethod
+    def row(row: tuple) -> dict:
+        guid, username, display_name, email, role, totp_enabled, created, last_login = row
+        return {
+            'guid': guid,
+            'username': username,
+            'displayName': display_name if display_name else username,
+            'email': email,
+            'role': role,
+            '2fa': totp_enabled,
+            'created': _isoformat(created),
+            'lastLogin': _isoformat(last_login)
+        }
+
+
+class RoleExport:
+    columns = ['name', 'description', 'userCount']
+
+    @staticmethod
+    def query(_: dict):
+        return db.session.query(Role.name, Role.description, Role.user_count).order_by(Role.id)
+
+    @staticmethod
+    def row(row: tuple) -> dict:
+        return dict(zip(RoleExport.columns, row))
+
+
+EXPORTS = {
+    'users': UserExport,
+    'roles': RoleExport
+}
+
+
+class ExportResource(MethodView):
+    @require_token
+    @require_admin
+    def get(self, name: str, **_: dict) -> Union[ResultExportSchema, ResultErrorSchema]:
+        """
+        Stream all users or roles as newline delimited json (default) or csv (?format=csv or Accept: text/csv),
+        gzip compressed if the client accepts it
+        """
+        export = EXPORTS.get(name)
+        if export is None:
+            return ResultErrorSchema(
+                message='Export does not exist!',
+                status_code=404
+            ).jsonify()
+        fmt = request.args.get('format')
+        if fmt is None:
+            best = request.accept_mimetypes.best_match(['application/x-ndjson', 'text/csv'])
+            fmt = 'csv' if best == 'text/csv' else 'ndjson'
+        try:
+            if fmt not in ['ndjson', 'csv']:
+                raise ValueError(fmt)
+            query = export.query(request.args)
+        except ValueError:
+            return ResultErrorSchema(
+                message='Invalid export parameters',
+                status_code=400
+            ).jsonify()
+
+        # server side cursor, the rows are fetched in batches while the response is written
+        batch_size = current_app.config['STREAM_BATCH_SIZE']
+        rows = query.execution_options(stream_results=True).yield_per(batch_size)
+        return ResultExportSchema(
+            rows=(export.row(row) for row in rows),
+            columns=export.columns,
+            filename=name,
+            csv=fmt == 'csv',
+            gzip='gzip' in request.accept_encodings,
+            batch_size=batch_size
+        ).jsonify()
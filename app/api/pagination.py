@@ -0,0 +1,96 @@
+from flask import request, current_app
+from sqlalchemy import func
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from typing import Union
+
+from .schemas import ResultPageSchema, ResultErrorSchema, ResultStreamSchema
+
+NDJSON_MIMETYPES = ['application/x-ndjson', 'application/ndjson']
+
+
+def encode_cursor(value: int) -> str:
+    return urlsafe_b64encode(str(value).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> int:
+    return int(urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode())
+
+
+def page_arguments() -> tuple:
+    """
+    The limit, the cursor and if the total number of rows has been requested,
+    raises a ValueError if the arguments are invalid
+    """
+    limit = int(request.args.get('limit', current_app.config['PAGINATION_DEFAULT_LIMIT']))
+    after = decode_cursor(request.args['after']) if request.args.get('after') else None
+    limit = max(1, min(limit, current_app.config['PAGINATION_MAX_LIMIT']))
+    return limit, after, request.args.get('count', '').lower() in ['1', 'true']
+
+
+def page(rows: list, limit: int, key: str, total: int = None) -> ResultPageSchema:
+    """
+    Page of the first `limit` rows, with one more row the cursor of the next page is included
+    """
+    cursor = encode_cursor(getattr(rows[limit - 1], key)) if len(rows) > limit else None
+    return ResultPageSchema(
+        data=[row.jsonify() for row in rows[:limit]],
+        next=cursor,
+        total=total
+    )
+
+
+def paginate(query, column, options: list = None) -> Union[ResultPageSchema, ResultErrorSchema]:
+    """
+    Keyset pagination of a query over a unique, ascending column (e.g. the primary key)
+    using the request arguments limit, after (the cursor of the previous page) and count,
+    the loader options (e.g. joinedload) are only applied to the rows of the page
+    """
+    try:
+        limit, after, count = page_arguments()
+    except ValueError:
+        return ResultErrorSchema(
+            message='Invalid pagination parameters',
+            status_code=400
+        )
+
+    total = None
+    if count:
+        # count the primary keys without wrapping the query in a subquery
+        total = query.with_entities(func.count(column)).order_by(None).scalar()
+
+    if after is not None:
+        query = query.filter(column > after)
+    # fetch one more row to know if there is another page
+    rows = query.options(*(options or [])).order_by(column).limit(limit + 1).all()
+    return page(rows, limit, column.key, total)
+
+
+def wants_stream() -> bool:
+    return request.args.get('stream', '').lower() in ['1', 'true'] or wants_ndjson()
+
+
+def wants_ndjson() -> bool:
+    return request.accept_mimetypes.best_match(['application/json'] + NDJSON_MIMETYPES) in NDJSON_MIMETYPES
+
+
+def stream(query, column, options: list = None) -> ResultStreamSchema:
+    """
+    Stream all rows of the query, fetched in batches using a server side cursor
+    """
+    batch_size = current_app.config['STREAM_BATCH_SIZE']
+    rows = query.options(*(options or [])).order_by(column) \
+        .execution_options(stream_results=True).yield_per(batch_size)
+    return ResultStreamSchema(
+        rows=(row.jsonify() for row in rows),
+        ndjson=wants_ndjson(),
+        batch_size=batch_size
+    )
+
+
+def collection(query, column, options: list = None) -> Union[ResultPageSchema, ResultStreamSchema, ResultErrorSchema]:
+    """
+    Get a collection either streamed (?stream=true or Accept: application/x-ndjson) or paginated
+    """
+    if wants_stream():
+        return stream(query, column, options)
+    return paginate(query, column, options)
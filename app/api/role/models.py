@@ -8,9 +8,14 @@ class Role(db.Model):
     id: int = Column('id', Integer, primary_key=True)
     name: str = Column('name', String(80), unique=True, nullable=False)
     description: str = Column('description', String(80), nullable=False)
+    # number of users with this role, maintained by the events of the user model
+    user_count: int = Column('userCount', Integer, nullable=False, default=0)
 
-    def jsonify(self) -> dict:
-        return {
+    def jsonify(self, user_count: bool = True) -> dict:
+        ret = {
             'name': self.name,
             'description': self.description
         }
+        if user_count:
+            ret['userCount'] = self.user_count or 0
+        return ret
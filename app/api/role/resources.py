@@ -5,10 +5,11 @@ from marshmallow.exceptions import ValidationError
 
 from app.utils import db
 from ..user import User
-from ..authentication import require_token, require_admin
+from ..authentication import require_token, require_admin, invalidate_principal
 from ..schemas import ResultSchema, ResultErrorSchema
+from ..pagination import collection
 from .models import Role
-from .schemas import DaoCreateRoleSchema, DaoUpdateRoleSchema
+from .schemas import create_role_schema, update_role_schema
 
 
 class RoleResource(MethodView):
@@ -16,9 +17,7 @@ class RoleResource(MethodView):
     def get(self, name: str, **_: dict) -> Union[ResultSchema, ResultErrorSchema]:
         if name is None:
             # get all roles
-            return ResultSchema(
-                data=[d.jsonify() for d in Role.query.all()]
-            ).jsonify()
+            return collection(Role.query, Role.id).jsonify()
         else:
             # get a role by the name in the resource (url)
             data = Role.query.filter_by(name=name).first()
@@ -34,10 +33,9 @@ class RoleResource(MethodView):
     @require_token
     @require_admin
     def post(self, **_: dict) -> Union[ResultSchema, ResultErrorSchema]:
-        schema = DaoCreateRoleSchema()
         data = request.get_json() or {}
         try:
-            data = schema.load(data)
+            data = create_role_schema.load(data)
         except ValidationError as errors:
             return ResultErrorSchema(
                 message='Payload is invalid',
@@ -65,10 +63,9 @@ class RoleResource(MethodView):
     @require_token
     @require_admin
     def put(self, name: str, **_: dict) -> Union[ResultSchema, ResultErrorSchema]:
-        schema = DaoUpdateRoleSchema()
         data = request.get_json() or {}
         try:
-            data = schema.load(data)
+            data = update_role_schema.load(data)
         except ValidationError as errors:
             return ResultErrorSchema(
                 message='Payload is invalid',
@@ -85,6 +82,8 @@ class RoleResource(MethodView):
 
         role.description = data.get('description')
         db.session.commit()
+        # the role is part of every cached user
+        invalidate_principal()
 
         return ResultSchema(
             data=role.jsonify()
@@ -109,14 +108,15 @@ class RoleResource(MethodView):
                 message='Role does not exist!',
                 status_code=404
             ).jsonify()
-        for user in User.query.all():
-            if user.role == role:
-                return ResultErrorSchema(
-                    message='Role is in use!',
-                    status_code=422
-                ).jsonify()
+        # indexed lookup for any user with this role
+        if db.session.query(User.query.filter_by(role_id=role.id).exists()).scalar():
+            return ResultErrorSchema(
+                message='Role is in use!',
+                status_code=422
+            ).jsonify()
         db.session.delete(role)
         db.session.commit()
+        invalidate_principal()
         return ResultSchema(
             data='Successfully deleted role!',
             status_code=200
@@ -1,6 +1,7 @@
 from marshmallow import Schema, fields, validate
 
 from ..schemas import validate_spaces
+from ..validation import CompiledSchema
 
 
 class DaoCreateRoleSchema(Schema):
@@ -19,3 +20,7 @@ class DaoUpdateRoleSchema(Schema):
         required=True,
         validate=[validate.Length(min=1, max=150)]
     )
+
+
+create_role_schema = CompiledSchema(DaoCreateRoleSchema)
+update_role_schema = CompiledSchema(DaoUpdateRoleSchema)
@@ -1,6 +1,11 @@
-from flask import jsonify
+from flask import Response, stream_with_context
 from marshmallow import ValidationError
-from typing import Union
+from typing import Union, Iterable, List
+import csv
+import io
+import zlib
+
+from app.encoder import fast_json, message_body
 
 
 def validate_spaces(text: str):
@@ -9,24 +14,23 @@ def validate_spaces(text: str):
 
 
 class ResultErrorSchema:
-    __slots__ = ['message', 'errors', 'data', 'status_code']
+    __slots__ = ['message', 'errors', 'data', 'status_code', 'headers']
 
-    def __init__(self, message, errors=None, status_code=400):
+    def __init__(self, message, errors=None, status_code=400, headers=None):
         self.message = message
         self.errors = errors
         self.status_code = status_code
+        self.headers = headers or {}
 
     def jsonify(self):
         if self.errors:
-            ret = {
+            body = fast_json.dumps({
                 'errors': self.errors,
                 'message': self.message
-            }
+            })
         else:
-            ret = {
-                'message': self.message
-            }
-        return jsonify(ret), self.status_code
+            body = message_body(self.message)
+        return fast_json.response(body), self.status_code, self.headers
 
 
 class ResultSchema:
@@ -37,6 +41,130 @@ class ResultSchema:
         self.status_code = status_code
 
     def jsonify(self):
-        return jsonify({
+        return fast_json.response(fast_json.dumps({
             'data': self.data
-        }), self.status_code
+        })), self.status_code
+
+
+class ResultPageSchema(ResultSchema):
+    __slots__ = ['next', 'total']
+
+    def __init__(self, data: list, next: str = None, total: int = None, status_code: int = 200):
+        super().__init__(data=data, status_code=status_code)
+        self.next = next
+        self.total = total
+
+    def jsonify(self):
+        ret = {
+            'data': self.data,
+            'next': self.next
+        }
+        if self.total is not None:
+            ret['total'] = self.total
+        return fast_json.response(fast_json.dumps(ret)), self.status_code
+
+
+class ResultStreamSchema:
+    """
+    Writes the rows incrementally, either as json array in the data envelope or as
+    newline delimited json, so the memory usage doesn't grow with the number of rows
+    """
+    __slots__ = ['rows', 'ndjson', 'batch_size', 'status_code']
+
+    def __init__(self, rows: Iterable[dict], ndjson: bool = False, batch_size: int = 500, status_code: int = 200):
+        self.rows = rows
+        self.ndjson = ndjson
+        self.batch_size = batch_size
+        self.status_code = status_code
+
+    def generate(self):
+        separator = b'\n' if self.ndjson else b','
+        if not self.ndjson:
+            yield b'{"data":['
+        chunk = []
+        first = True
+        for row in self.rows:
+            chunk.append(fast_json.dumps(row))
+            if len(chunk) >= self.batch_size:
+                yield (b'' if first else separator) + separator.join(chunk)
+                first = False
+                chunk = []
+        if chunk:
+            yield (b'' if first else separator) + separator.join(chunk)
+            first = False
+        if self.ndjson:
+            yield b'' if first else b'\n'
+        else:
+            yield b']}'
+
+    def jsonify(self):
+        return Response(
+            stream_with_context(self.generate()),
+            status=self.status_code,
+            mimetype='application/x-ndjson' if self.ndjson else 'application/json'
+        )
+
+
+class ResultExportSchema:
+    """
+    Writes the rows incrementally as newline delimited json or csv file,
+    which is optionally compressed on the fly
+    """
+    __slots__ = ['rows', 'columns', 'filename', 'csv', 'gzip', 'batch_size']
+
+    def __init__(self, rows: Iterable[dict], columns: List[str], filename: str, csv: bool = False,
+                 gzip: bool = False, batch_size: int = 500):
+        self.rows = rows
+        self.columns = columns
+        self.filename = filename
+        self.csv = csv
+        self.gzip = gzip
+        self.batch_size = batch_size
+
+    def generate_ndjson(self):
+        chunk = []
+        for row in self.rows:
+            chunk.append(fast_json.dumps(row))
+            if len(chunk) >= self.batch_size:
+                yield b'\n'.join(chunk) + b'\n'
+                chunk = []
+        if chunk:
+            yield b'\n'.join(chunk) + b'\n'
+
+    def generate_csv(self):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(self.columns)
+        for i, row in enumerate(self.rows, 1):
+            writer.writerow([row.get(column) for column in self.columns])
+            if i % self.batch_size == 0:
+                yield buffer.getvalue().encode('utf-8')
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue().encode('utf-8')
+
+    def generate(self):
+        chunks = self.generate_csv() if self.csv else self.generate_ndjson()
+        if not self.gzip:
+            yield from chunks
+            return
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+
+    def jsonify(self):
+        extension = 'csv' if self.csv else 'ndjson'
+        headers = {
+            'Content-Disposition': f'attachment; filename={self.filename}.{extension}',
+            'Vary': 'Accept-Encoding'
+        }
+        if self.gzip:
+            headers['Content-Encoding'] = 'gzip'
+        return Response(
+            stream_with_context(self.generate()),
+            mimetype='text/csv' if self.csv else 'application/x-ndjson',
+            headers=headers
+        )
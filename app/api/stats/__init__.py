@@ -0,0 +1 @@
+from .resources import StatsResource, MetricsResource, register_stats
@@ -0,0 +1,54 @@
+from flask.views import MethodView
+from flask import abort, current_app, request
+from typing import Union
+import hmac
+
+from app.metrics import metrics
+
+from ..authentication import require_token, require_admin
+from ..schemas import ResultSchema, ResultErrorSchema
+
+
+def register_stats(app, name: str, provider: callable):
+    """
+    Register a callable, which returns a dict of runtime statistics, under a name in /api/stats
+    """
+    app.extensions.setdefault('stats', {})[name] = provider
+
+
+class StatsResource(MethodView):
+    @require_token
+    @require_admin
+    def get(self, name: str, **_: dict) -> Union[ResultSchema, ResultErrorSchema]:
+        providers = current_app.extensions.get('stats', {})
+        if name is None:
+            return ResultSchema(
+                data={key: provider() for key, provider in providers.items()}
+            ).jsonify()
+        if name not in providers:
+            return ResultErrorSchema(
+                message='Statistic does not exist!',
+                status_code=404
+            ).jsonify()
+        return ResultSchema(
+            data=providers[name]()
+        ).jsonify()
+
+
+class MetricsResource(MethodView):
+    def get(self):
+        """
+        Metrics of all workers in the prometheus text format, scrapers authenticate using METRICS_TOKEN
+        (tokens of users expire too fast). Without it the endpoint is hidden, unless METRICS_PUBLIC is set
+        because the endpoint is protected by the load balancer.
+        """
+        token = current_app.config.get('METRICS_TOKEN')
+        if not token and not current_app.config.get('METRICS_PUBLIC'):
+            # like an unknown url
+            abort(404)
+        if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return ResultErrorSchema(
+                message='Access Denied!',
+                status_code=403
+            ).jsonify()
+        return current_app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
@@ -1 +1,2 @@
 from .resources import TOTPResource
+from .qr import init_qr_cache
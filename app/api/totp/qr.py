@@ -0,0 +1,110 @@
+from flask import current_app
+from hashlib import sha256
+from typing import List
+import struct
+import zlib
+
+from app.cache import TTLCache
+
+MIMETYPES = {'svg': 'image/svg+xml', 'png': 'image/png'}
+
+
+def render_svg(code: List[List[int]], scale: int, quiet_zone: int = 4) -> bytes:
+    """
+    The dark modules of each row as horizontal lines of a single path, in module units
+    """
+    size = len(code) + 2 * quiet_zone
+    path = []
+    for y, row in enumerate(code):
+        x = 0
+        cursor = None
+        while x < len(row):
+            if not row[x]:
+                x += 1
+                continue
+            start = x
+            while x < len(row) and row[x]:
+                x += 1
+            if cursor is None:
+                path.append(f'M{start + quiet_zone} {y + quiet_zone}.5h{x - start}')
+            else:
+                path.append(f'm{start - cursor} 0h{x - start}')
+            cursor = x
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{size * scale}" height="{size * scale}" '
+        f'viewBox="0 0 {size} {size}"><path stroke="#000" d="{"".join(path)}"/></svg>'
+    ).encode()
+
+
+def render_png(code: List[List[int]], scale: int, quiet_zone: int = 4) -> bytes:
+    """
+    Black and white png with one bit per pixel
+    """
+    size = (len(code) + 2 * quiet_zone) * scale
+    blank = bytes([0]) + bytes([0xff]) * ((size + 7) // 8)
+    rows = [blank] * (quiet_zone * scale)
+    for row in code:
+        bits = '1' * (quiet_zone * scale) + ''.join(('0' if module else '1') * scale for module in row)
+        bits = bits.ljust(-(-size // 8) * 8, '1')
+        rows += [bytes([0]) + int(bits, 2).to_bytes(len(bits) // 8, 'big')] * scale
+    rows += [blank] * (quiet_zone * scale)
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    return b''.join([
+        b'\x89PNG\r\n\x1a\n',
+        chunk(b'IHDR', struct.pack('>IIBBBBB', size, size, 1, 0, 0, 0, 0)),
+        chunk(b'IDAT', zlib.compress(b''.join(rows), 9)),
+        chunk(b'IEND', b'')
+    ])
+
+
+def init_qr_cache(app) -> TTLCache:
+    cache = TTLCache(maxsize=app.config.get('QR_CACHE_SIZE', 0), ttl=app.config.get('QR_CACHE_TTL', 900))
+    app.extensions['qr_codes'] = cache
+    return cache
+
+
+def _cache_key(uri: str) -> bytes:
+    # the secret is part of the uri, so it's not kept as plain text in the keys
+    return sha256(uri.encode()).digest()
+
+
+def render(uri: str) -> dict:
+    """
+    Encoding the uri is the expensive part, so all formats are rendered at once
+    """
+    # imported on demand, most workers never render a qr code
+    import pyqrcode
+    code = pyqrcode.create(uri, error=current_app.config.get('QR_ERROR_LEVEL', 'M')).code
+    scale = current_app.config['QR_SCALE']
+    return {'svg': render_svg(code, scale), 'png': render_png(code, scale)}
+
+
+def qr_code(uri: str, image_format: str = 'svg') -> bytes:
+    """
+    The rendered qr code of the uri, taken from the cache if it has been rendered before
+    """
+    cache = current_app.extensions.get('qr_codes')
+    if cache is None:
+        return render(uri)[image_format]
+    key = _cache_key(uri)
+    images = cache.get(key)
+    if images is None:
+        images = render(uri)
+        cache.set(key, images)
+    return images[image_format]
+
+
+def prepare_qr_code(uri: str):
+    """
+    Render the qr code of a new secret, so the setup page gets it without delay
+    """
+    qr_code(uri)
+
+
+def evict_qr_code(uri: str):
+    cache = current_app.extensions.get('qr_codes')
+    if cache is not None:
+        cache.pop(_cache_key(uri))
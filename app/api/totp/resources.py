@@ -1,25 +1,31 @@
 from flask.views import MethodView
-from flask import request, current_app
+from flask import request
 from marshmallow.exceptions import ValidationError
-from io import BytesIO
-import pyqrcode
 
 from app.utils import db
 from ..schemas import ResultSchema, ResultErrorSchema
-from ..authentication import require_token
-from .schemas import DaoTokenSchema
+from ..authentication import require_token, invalidate_principal
+from .schemas import token_schema
+from .qr import MIMETYPES, qr_code, evict_qr_code
 
 
 class TOTPResource(MethodView):
     @require_token
     def get(self, user):
+        """
+        QR code of the secret as svg or png (?format=png or Accept: image/png)
+        """
         if user.totp_secret and not user.totp_enabled:
             db.session.commit()
-            url = pyqrcode.create(user.get_totp_uri())
-            stream = BytesIO()
-            url.svg(stream, scale=current_app.config['QR_SCALE'])
-            return stream.getvalue(), 200, {
-                'Content-Type': 'image/svg+xml',
+            image_format = request.args.get('format') or \
+                ('png' if request.accept_mimetypes.best_match(['image/svg+xml', 'image/png']) == 'image/png' else 'svg')
+            if image_format not in MIMETYPES:
+                return ResultErrorSchema(
+                    message='Unsupported format, use svg or png',
+                    status_code=400
+                ).jsonify()
+            return qr_code(user.get_totp_uri(), image_format), 200, {
+                'Content-Type': MIMETYPES[image_format],
                 'Cache-Control': 'no-cache, no-store, must-revalidate',
                 'Pragma': 'no-cache',
                 'Expires': '0'
@@ -31,10 +37,9 @@ class TOTPResource(MethodView):
         """
         Activate 2FA with a valid token
         """
-        schema = DaoTokenSchema()
         data = request.get_json() or {}
         try:
-            data = schema.load(data)
+            data = token_schema.load(data)
         except ValidationError as errors:
             return ResultErrorSchema(
                 message='Payload is invalid',
@@ -50,6 +55,9 @@ class TOTPResource(MethodView):
         if user.verify_totp(data['token']):
             user.totp_enabled = True
             db.session.commit()
+            # the qr code is only shown during the setup
+            evict_qr_code(user.get_totp_uri())
+            invalidate_principal(user.username)
             # TODO why ResultErrorSchema
             return ResultErrorSchema(
                 message='2fa has been enabled',
@@ -71,8 +79,11 @@ class TOTPResource(MethodView):
                 message='2fa is not in setup state, this can\'t be aborted!'
             ).jsonify()
 
+        if user.totp_secret:
+            evict_qr_code(user.get_totp_uri())
         user.totp_secret = None
         db.session.commit()
+        invalidate_principal(user.username)
         return ResultSchema(
             data='2fa secret has been disabled'
         ).jsonify()
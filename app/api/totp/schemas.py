@@ -1,8 +1,13 @@
 from marshmallow import Schema, fields, validate
 
+from ..validation import CompiledSchema
+
 
 class DaoTokenSchema(Schema):
     token = fields.Str(
         required=True,
         validate=[validate.Length(min=6, max=6)]
     )
+
+
+token_schema = CompiledSchema(DaoTokenSchema)
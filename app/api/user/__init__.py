@@ -1,2 +1,3 @@
 from .models import User
 from .resources import UserResource
+from .bulk import BulkUserResource
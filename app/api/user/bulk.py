@@ -0,0 +1,146 @@
+from flask.views import MethodView
+from flask import request, current_app, json
+from marshmallow.exceptions import ValidationError
+from sqlalchemy.exc import IntegrityError
+from collections import Counter
+from datetime import datetime
+from typing import Iterable, Tuple, Union
+from uuid import uuid4
+import csv
+
+from app.utils import db
+from app.hashing import hashing
+from ..schemas import ResultStreamSchema, ResultErrorSchema
+from ..pagination import NDJSON_MIMETYPES
+from ..authentication import require_token, require_admin
+from ..role import Role
+from .models import User, update_user_count
+from .schemas import create_user_schema
+
+
+def parse_ndjson(stream) -> Iterable[Tuple[int, Union[dict, None]]]:
+    for line, data in enumerate(stream, 1):
+        if not data.strip():
+            continue
+        try:
+            data = json.loads(data.decode('utf-8'))
+        except ValueError:
+            data = None
+        yield line, data if isinstance(data, dict) else None
+
+
+def parse_csv(stream) -> Iterable[Tuple[int, dict]]:
+    """
+    Rows of a csv file with the header username,email,password,role
+    """
+    reader = csv.DictReader(line.decode('utf-8-sig') for line in stream)
+    for row in reader:
+        # values without column are ignored
+        yield reader.line_num, {key: value for key, value in row.items() if key is not None}
+
+
+class BulkUserResource(MethodView):
+    @require_token
+    @require_admin
+    def post(self, **_: dict) -> Union[ResultStreamSchema, ResultErrorSchema]:
+        """
+        Create many user accounts from newline delimited json or csv, the result of each row
+        is returned as newline delimited json while the request body is still being read
+        """
+        if request.mimetype in NDJSON_MIMETYPES:
+            rows = parse_ndjson(request.stream)
+        elif request.mimetype == 'text/csv':
+            rows = parse_csv(request.stream)
+        else:
+            return ResultErrorSchema(
+                message='Unsupported content type, use application/x-ndjson or text/csv',
+                status_code=415
+            ).jsonify()
+        batch_size = current_app.config.get('BULK_BATCH_SIZE', 500)
+        return ResultStreamSchema(import_users(rows, batch_size), ndjson=True, batch_size=batch_size).jsonify()
+
+
+def import_users(rows: Iterable[Tuple[int, dict]], batch_size: int) -> Iterable[dict]:
+    # resolve all roles once instead of once per user
+    roles = dict(db.session.query(Role.name, Role.id).all())
+    usernames = set()
+    batch = []
+    for line, data in rows:
+        if data is None:
+            yield {'line': line, 'status': 400, 'message': 'Invalid row'}
+            continue
+        try:
+            data = create_user_schema.load(data)
+        except ValidationError as errors:
+            yield {'line': line, 'status': 400, 'message': 'Payload is invalid', 'errors': errors.messages}
+            continue
+        if data['role'] not in roles:
+            yield {'line': line, 'status': 404, 'message': 'Role does not exist!'}
+            continue
+        if data['username'] in usernames:
+            yield {'line': line, 'status': 422, 'message': 'Username already in use!'}
+            continue
+        usernames.add(data['username'])
+        data['role_id'] = roles[data['role']]
+        batch.append((line, data))
+        if len(batch) >= batch_size:
+            yield from insert_users(batch)
+            batch = []
+    if batch:
+        yield from insert_users(batch)
+
+
+def insert_users(batch: list) -> Iterable[dict]:
+    """
+    Insert a batch of validated users in a single transaction
+    """
+    existing = {username for username, in db.session.query(User.username).filter(
+        User.username.in_([data['username'] for _, data in batch])
+    )}
+    for line, data in batch:
+        if data['username'] in existing:
+            yield {'line': line, 'status': 422, 'message': 'Username already in use!'}
+    batch = [(line, data) for line, data in batch if data['username'] not in existing]
+    if not batch:
+        return
+
+    hashes = hashing.generate_many(
+        [data['password'] for _, data in batch],
+        method=current_app.config.get('HASH_METHOD')
+    )
+    created = datetime.utcnow()
+    mappings = [{
+        'guid': str(uuid4()),
+        'username': data['username'],
+        'email': data['email'],
+        '_password': pwhash,
+        'password_policy': current_app.config.get('HASH_POLICY_VERSION'),
+        'role_id': data['role_id'],
+        'created': created
+    } for (_, data), pwhash in zip(batch, hashes)]
+
+    try:
+        _insert(mappings)
+    except IntegrityError:
+        # a username has been taken in the meantime, insert the users of this batch one by one
+        db.session.rollback()
+        for (line, data), mapping in zip(batch, mappings):
+            try:
+                _insert([mapping])
+            except IntegrityError:
+                db.session.rollback()
+                yield {'line': line, 'status': 422, 'message': 'Username already in use!'}
+            else:
+                yield {'line': line, 'status': 201, 'guid': mapping['guid'], 'username': mapping['username']}
+        return
+    for (line, _), mapping in zip(batch, mappings):
+        yield {'line': line, 'status': 201, 'guid': mapping['guid'], 'username': mapping['username']}
+
+
+def _insert(mappings: list):
+    db.session.bulk_insert_mappings(User, mappings)
+    # bulk inserts don't emit the events which maintain the user count of the roles
+    connection = db.session.connection()
+    for role_id, count in Counter(mapping['role_id'] for mapping in mappings).items():
+        update_user_count(connection, role_id, count)
+    db.session.commit()
@@ -1,11 +1,10 @@
-from sqlalchemy import Column, String, Boolean, DateTime, ForeignKey, Integer
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import Column, String, Boolean, DateTime, ForeignKey, Integer, event, inspect
 from flask import current_app
 from uuid import uuid4
 from datetime import datetime
-import onetimepass
 
 from app.utils import db
+from app.hashing import hashing, needs_rehash, POOL_ERRORS
 
 
 class User(db.Model):
@@ -16,17 +15,21 @@ class User(db.Model):
     displayName: str = Column('displayName', String(128), unique=True, nullable=True)
     email: str = Column('email', String(64), nullable=False)
     _password: str = Column('password', String(512), nullable=False)
+    # version of the hash policy (HASH_POLICY_VERSION) the password has been hashed with
+    password_policy: int = Column('passwordPolicy', Integer, nullable=True)
     created: datetime = Column('created', DateTime, nullable=False, default=datetime.utcnow())
     last_login: datetime = Column('lastLogin', DateTime)
 
-    role_id: int = Column('role', Integer, ForeignKey('role.id'), nullable=False)
-    role = db.relationship('Role', backref=db.backref('users', lazy=True))
+    role_id: int = Column('role', Integer, ForeignKey('role.id'), nullable=False, index=True)
+    role = db.relationship('Role', backref=db.backref('users', lazy=True), active_history=True)
 
     totp_enabled: bool = Column('2fa_enabled', Boolean, nullable=False, default=False)
     totp_secret: str = Column('2fa_secret', String(128), nullable=True, default=None)
 
+    # incremented to revoke all issued tokens, which contain the claims of the user
+    token_generation: int = Column('tokenGeneration', Integer, nullable=False, default=0)
+
     def __init__(self, *args: list, **kwargs: dict) -> "User":
-        kwargs['_password']: str = generate_password_hash(kwargs['password'], method='sha512')
         super().__init__(*args, **kwargs, guid=str(uuid4()))
 
     def jsonify(self) -> dict:
@@ -35,14 +38,40 @@ class User(db.Model):
             'username': self.username,
             'displayName': self.displayName if self.displayName else self.username,
             'email': self.email,
-            'created': self.created.isoformat(),
-            'lastLogin': self.last_login.isoformat()if self.last_login else None,
-            'role': self.role.jsonify(),
+            # dates are encoded by the json encoder
+            'created': self.created,
+            'lastLogin': self.last_login,
+            'role': self.role.jsonify(user_count=False),
             '2fa': self.totp_enabled
         }
 
     def verify_password(self, password: str) -> bool:
-        return check_password_hash(self._password, password)
+        return hashing.verify(self._password, password)
+
+    @property
+    def role_name(self) -> str:
+        return self.role.name
+
+    def revoke_tokens(self):
+        self.token_generation = (self.token_generation or 0) + 1
+
+    def needs_rehash(self) -> bool:
+        """
+        Check if the password hash has been created with another policy than the active one
+        """
+        return self.password_policy != current_app.config.get('HASH_POLICY_VERSION') or \
+            needs_rehash(self._password, current_app.config.get('HASH_METHOD'))
+
+    def renew_hash(self, password: str):
+        """
+        Renew the password hash if it doesn't match the active hash policy, if the pool is busy
+        the old hash is kept and renewed on a later login, the password has been verified already
+        """
+        if self.needs_rehash():
+            try:
+                self.password = password
+            except POOL_ERRORS:
+                pass
 
     def get_totp_uri(self) -> str:
         return f'otpauth://totp/PythonFlaskLogin:{self.username}?secret={self.totp_secret}&issuer=PythonFlaskLogin'
@@ -54,6 +83,7 @@ class User(db.Model):
         """
         ret = True
         if self.totp_secret:
+            import onetimepass
             ret = onetimepass.valid_totp(token, self.totp_secret)
         return ret
 
@@ -63,4 +93,44 @@ class User(db.Model):
 
     @password.setter
     def password(self, password: str):
-        self._password = generate_password_hash(password, method=current_app.config.get('HASH_METHOD'))
+        self._password = hashing.generate(password, method=current_app.config.get('HASH_METHOD'))
+        self.password_policy = current_app.config.get('HASH_POLICY_VERSION')
+
+
+def update_user_count(connection, role_id: int, delta: int):
+    role = User.role.property.mapper.local_table
+    connection.execute(
+        role.update().where(role.c.id == role_id).values({role.c.userCount: role.c.userCount + delta})
+    )
+
+
+@event.listens_for(User, 'after_insert')
+def _user_inserted(_, connection, target: User):
+    update_user_count(connection, target.role_id, 1)
+
+
+@event.listens_for(User, 'after_delete')
+def _user_deleted(_, connection, target: User):
+    update_user_count(connection, target.role_id, -1)
+
+
+@event.listens_for(User, 'after_update')
+def _user_updated(_, connection, target: User):
+    # the role is changed using the relationship or by assigning role_id directly
+    old_id, new_id = _changed_role(inspect(target).attrs)
+    if old_id != new_id:
+        if old_id is not None:
+            update_user_count(connection, old_id, -1)
+        if new_id is not None:
+            update_user_count(connection, new_id, 1)
+
+
+def _changed_role(attrs) -> tuple:
+    history = attrs.role_id.history
+    if history.added and history.deleted:
+        return history.deleted[0], history.added[0]
+    history = attrs.role.history
+    if history.added and history.deleted:
+        old, new = history.deleted[0], history.added[0]
+        return old and old.id, new and new.id
+    return None, None
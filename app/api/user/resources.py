@@ -4,6 +4,7 @@ from itsdangerous import (
     URLSafeTimedSerializer, SignatureExpired,
     BadTimeSignature, BadSignature
 )
+from sqlalchemy.orm import joinedload
 from typing import Union
 from marshmallow.exceptions import ValidationError
 from string import digits, ascii_letters
@@ -13,13 +14,12 @@ import random
 
 from app.utils import db
 from ..schemas import ResultSchema, ResultErrorSchema
-from ..authentication import require_token, require_admin
+from ..pagination import collection
+from ..authentication import require_token, require_admin, invalidate_principal
 from ..role import Role
+from ..totp.qr import prepare_qr_code, evict_qr_code
 from ..user.models import User
-from .schemas import (
-    DaoCreateUserSchema, DaoUpdateUserSchema,
-    DaoRequestPasswordResetSchema
-)
+from .schemas import create_user_schema, update_user_schema
 
 
 def random_string(length=16):
@@ -31,11 +31,10 @@ class UserResource(MethodView):
     @require_admin
     def get(self, guid: str, **_: dict) -> Union[ResultSchema, ResultErrorSchema]:
         if guid is None:
-            return ResultSchema(
-                data=[d.jsonify() for d in User.query.all()]
-            ).jsonify()
+            return collection(User.query, User.id, options=[joinedload(User.role)]).jsonify()
         else:
-            data = User.query.filter_by(guid=guid).first()
+            # the role is part of the response, loading it lazily would take another query
+            data = User.query.options(joinedload(User.role)).filter_by(guid=guid).first()
             if not data:
                 return ResultErrorSchema(
                     message='User does not exist!',
@@ -51,10 +50,9 @@ class UserResource(MethodView):
         """
         Create an new user account
         """
-        schema = DaoCreateUserSchema()
         data = request.get_json() or {}
         try:
-            data = schema.load(data)
+            data = create_user_schema.load(data)
         except ValidationError as errors:
             return ResultErrorSchema(
                 message='Payload is invalid',
@@ -93,10 +91,9 @@ class UserResource(MethodView):
         Modify an existing user account
         """
         if guid == 'me':
-            schema = DaoUpdateUserSchema()
             data = request.get_json() or {}
             try:
-                data = schema.load(data)
+                data = update_user_schema.load(data)
             except ValidationError as errors:
                 return ResultErrorSchema(
                     message='Payload is invalid',
@@ -110,6 +107,8 @@ class UserResource(MethodView):
                     status_code=403
                 ).jsonify()
 
+            username = user.username
+            totp_uri = user.get_totp_uri() if user.totp_secret else None
             totp_secret = None
             totp_deactivation_token = None
             if 'totp_token' in data:
@@ -141,13 +140,19 @@ class UserResource(MethodView):
                     if user.gpg_enabled and not val:
                         user.gpg_enabled = False
                 else:
+                    if key in ['username', 'password']:
+                        user.revoke_tokens()
                     setattr(user, key, val)
 
             db.session.commit()
+            invalidate_principal(username, user.username)
+            if totp_uri and (not user.totp_secret or user.get_totp_uri() != totp_uri):
+                evict_qr_code(totp_uri)
             # if a new secret has been created, add it to the data for 2fa activation process
             data = user.jsonify()
             if totp_secret:
                 data['2fa_secret'] = totp_secret
+                prepare_qr_code(user.get_totp_uri())
             return ResultSchema(data=data).jsonify()
         else:
             target = User.query.filter_by(guid=guid).first()
@@ -172,16 +177,18 @@ class UserResource(MethodView):
             ).jsonify()
         db.session.delete(user)
         db.session.commit()
+        invalidate_principal(user.username)
+        if user.totp_secret:
+            evict_qr_code(user.get_totp_uri())
         return ResultSchema(
             data='Successfully deleted user!',
             status_code=200
         ).jsonify()
 
     def _update_user_as_admin(self, target: User, **_: dict) -> Union[ResultSchema, ResultErrorSchema]:
-        schema = DaoUpdateUserSchema()
         data = request.get_json() or {}
         try:
-            data = schema.load(data)
+            data = update_user_schema.load(data)
         except ValidationError as errors:
             return ResultErrorSchema(
                 message='Payload is invalid',
@@ -189,6 +196,8 @@ class UserResource(MethodView):
                 status_code=400
             ).jsonify()
 
+        username = target.username
+        totp_uri = target.get_totp_uri() if target.totp_secret else None
         for key, val in data.items():
             if key == 'role':
                 role = Role.query.filter_by(name=val).first()
@@ -198,6 +207,8 @@ class UserResource(MethodView):
                         status_code=400
                     ).jsonify()
                 else:
+                    if target.role != role:
+                        target.revoke_tokens()
                     target.role = role
             elif key == 'totp_enabled':
                 if not val:
@@ -220,8 +231,13 @@ class UserResource(MethodView):
                             message='You are not allowed to enable GPG.'
                         ).jsonify()
             else:
+                if key in ['username', 'password']:
+                    target.revoke_tokens()
                 setattr(target, key, val)
         db.session.commit()
+        invalidate_principal(username, target.username)
+        if totp_uri and (not target.totp_secret or target.get_totp_uri() != totp_uri):
+            evict_qr_code(totp_uri)
         data = target.jsonify()
         return ResultSchema(data=data).jsonify()
 
@@ -1,6 +1,7 @@
 from marshmallow import Schema, fields, validate
 
 from ..schemas import validate_spaces
+from ..validation import CompiledSchema
 
 
 class DaoCreateUserSchema(Schema):
@@ -36,3 +37,7 @@ class DaoUpdateUserSchema(Schema):
 
 class DaoRequestPasswordResetSchema(Schema):
     email = fields.Email([validate_spaces], required=True)
+
+
+create_user_schema = CompiledSchema(DaoCreateUserSchema)
+update_user_schema = CompiledSchema(DaoUpdateUserSchema)
@@ -0,0 +1,139 @@
+from collections.abc import Mapping
+from marshmallow import RAISE, fields, validate
+from marshmallow.exceptions import ValidationError
+from marshmallow.utils import missing
+from typing import Callable, List, Union
+
+# field types deserialized without the field machinery, all others are passed to marshmallow
+STRING_FIELDS = (fields.String, fields.Email)
+
+
+def _compile_length(validator: validate.Length) -> Callable:
+    # the default messages don't depend on the input, so they are formatted once
+    lower, upper, equal = validator.min, validator.max, validator.equal
+    message_equal = validator._format_error(None, validator.message_equal)
+    message_min = validator._format_error(None, validator.message_min if upper is None else validator.message_all)
+    message_max = validator._format_error(None, validator.message_max if lower is None else validator.message_all)
+
+    def check(value: str) -> Union[List[str], None]:
+        length = len(value)
+        if equal is not None:
+            return [message_equal] if length != equal else None
+        if lower is not None and length < lower:
+            return [message_min]
+        if upper is not None and length > upper:
+            return [message_max]
+        return None
+    return check
+
+
+def _compile_validator(validator: Callable, failed: str) -> Callable:
+    if type(validator) is validate.Length and validator.error is None:
+        return _compile_length(validator)
+
+    def check(value: str) -> Union[List[str], None]:
+        try:
+            result = validator(value)
+        except ValidationError as error:
+            return [error.messages] if isinstance(error.messages, dict) else error.messages
+        if not isinstance(validator, validate.Validator) and result is False:
+            return [failed]
+        return None
+    return check
+
+
+def compile_field(field: fields.Field) -> Callable:
+    """
+    Function which deserializes and validates a raw value of the field like Field.deserialize
+    """
+    if type(field) not in STRING_FIELDS or field.missing is not missing:
+        return field.deserialize
+
+    required = field.required
+    allow_none = field.allow_none
+    message_required = field.error_messages['required']
+    message_null = field.error_messages['null']
+    message_invalid = field.error_messages['invalid']
+    checks = [_compile_validator(validator, field.error_messages['validator_failed']) for validator in field.validators]
+
+    def deserialize(value):
+        if value is missing:
+            if required:
+                raise ValidationError(message_required)
+            return missing
+        if value is None:
+            if allow_none:
+                return None
+            raise ValidationError(message_null)
+        if not isinstance(value, str):
+            if isinstance(value, bytes):
+                return field.deserialize(value)
+            raise ValidationError(message_invalid)
+        errors = None
+        for check in checks:
+            messages = check(value)
+            if messages:
+                errors = (errors or []) + messages
+        if errors:
+            raise ValidationError(errors)
+        return value
+    return deserialize
+
+
+class CompiledSchema:
+    """
+    A marshmallow schema compiled into one validation function per field, which returns the same
+    data and raises the same errors as Schema.load. Schemas with hooks (e.g. @validates_schema),
+    nested fields or other unknown field handling than RAISE are loaded by marshmallow.
+    The schema is compiled on its first use, so workers only compile the schemas they need.
+    """
+    def __init__(self, schema_class: type) -> "CompiledSchema":
+        self.schema_class = schema_class
+        self.schema = None
+
+    def _compile(self):
+        schema = self.schema_class()
+        self._compiled = schema.opts.unknown == RAISE and not any(schema._hooks.values()) and not any(
+            isinstance(field, fields.Nested) for field in schema.fields.values()
+        )
+        self.fields = [
+            (field.data_key or name, field.attribute or name, compile_field(field))
+            for name, field in schema.fields.items() if not field.dump_only
+        ]
+        self.keys = frozenset(key for key, _, _ in self.fields)
+        self.message_type = schema.error_messages['type']
+        self.message_unknown = schema.error_messages['unknown']
+        # set last, concurrent first calls compile the schema twice but never see it half compiled
+        self.schema = schema
+
+    @property
+    def compiled(self) -> bool:
+        """
+        False if the schema is loaded by marshmallow
+        """
+        if self.schema is None:
+            self._compile()
+        return self._compiled
+
+    def load(self, data) -> dict:
+        if self.schema is None:
+            self._compile()
+        if not self._compiled:
+            return self.schema.load(data)
+        if not isinstance(data, Mapping):
+            raise ValidationError({'_schema': [self.message_type]}, data=data, valid_data={})
+        result = {}
+        errors = {}
+        for key, attribute, deserialize in self.fields:
+            try:
+                value = deserialize(data.get(key, missing))
+            except ValidationError as error:
+                errors[key] = error.messages
+                continue
+            if value is not missing:
+                result[attribute] = value
+        for key in data.keys() - self.keys:
+            errors[key] = [self.message_unknown]
+        if errors:
+            raise ValidationError(errors, data=data, valid_data=result)
+        return result
@@ -0,0 +1,643 @@
+"""
+Optional asyncio serving mode, e.g. `uvicorn asgi:application`.
+Authentication and reading users and roles are handled by coroutines using asyncio database
+(aiomysql, aiosqlite) and redis (redis.asyncio) drivers, so a worker keeps serving other requests
+while it waits for the database. All other requests are passed to the flask application in a
+thread pool, both modes share the schemas and therefore have the same api.
+"""
+from flask import Flask, Response, request
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import datetime
+from tempfile import SpooledTemporaryFile
+from typing import Union
+from marshmallow.exceptions import ValidationError
+from sqlalchemy import select, func
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.orm.attributes import set_committed_value
+from werkzeug.exceptions import BadRequest
+import asyncio
+import re
+import sys
+import time
+import jwt
+
+from app import create_app, blacklist_full, hashing_unavailable
+from app.api import User, Role
+from app.api.schemas import ResultSchema, ResultErrorSchema
+from app.api.pagination import page_arguments, page, wants_stream
+from app.api.authentication.schemas import AuthResultSchema, auth_schema, token_refresh_schema
+from app.api.authentication.tokens import create_access_token, create_refresh_token, decode_token, evict_token
+from app.api.authentication.utils import invalidate_principal, throttle_limits, throttled
+from app.blacklist import BlacklistFull
+from app.hashing import hashing, HashingUnavailable, POOL_ERRORS
+from app.metrics import metrics
+
+TOKEN_ERRORS = (jwt.exceptions.DecodeError, jwt.ExpiredSignatureError, jwt.exceptions.InvalidSignatureError)
+USERS = User.__table__
+ROLES = Role.__table__
+
+
+class AsyncDatabase:
+    """
+    Executes sqlalchemy core statements with an asyncio driver,
+    in memory sqlite databases can't be shared and are not supported
+    """
+    def __init__(self, url: str, pool_size: int = 10) -> "AsyncDatabase":
+        self.url = make_url(url)
+        dialect = self.url.get_dialect()
+        # the asyncio drivers use the paramstyle of their synchronous counterparts
+        self.dialect = dialect(dbapi=dialect.dbapi())
+        self.pool_size = pool_size
+        self._pool = None
+
+    async def connect(self):
+        backend = self.url.get_backend_name()
+        if backend == 'sqlite':
+            import aiosqlite
+            self._pool = asyncio.Queue()
+            for _ in range(self.pool_size):
+                self._pool.put_nowait(await aiosqlite.connect(self.url.database, isolation_level=None))
+        elif backend == 'mysql':
+            import aiomysql
+            self._pool = await aiomysql.create_pool(
+                host=self.url.host,
+                port=int(self.url.port or 3306),
+                user=self.url.username,
+                password=self.url.password or '',
+                db=self.url.database,
+                charset=self.url.query.get('charset', 'utf8mb4'),
+                autocommit=True,
+                maxsize=self.pool_size
+            )
+        else:
+            raise RuntimeError(f'There is no asyncio driver for {backend}')
+
+    async def close(self):
+        if isinstance(self._pool, asyncio.Queue):
+            while not self._pool.empty():
+                await self._pool.get_nowait().close()
+        elif self._pool is not None:
+            self._pool.close()
+            await self._pool.wait_closed()
+        self._pool = None
+
+    @asynccontextmanager
+    async def _cursor(self):
+        if isinstance(self._pool, asyncio.Queue):
+            connection = await self._pool.get()
+            try:
+                yield connection
+            finally:
+                self._pool.put_nowait(connection)
+        else:
+            async with self._pool.acquire() as connection:
+                async with connection.cursor() as cursor:
+                    yield cursor
+
+    def _compile(self, statement) -> tuple:
+        compiled = statement.compile(dialect=self.dialect)
+        processors = compiled._bind_processors
+        params = {
+            key: processors[key](value) if key in processors else value
+            for key, value in compiled.params.items()
+        }
+        if compiled.positional:
+            params = tuple(params[key] for key in compiled.positiontup)
+        return str(compiled), params
+
+    async def _execute(self, statement, fetch: bool) -> Union[list, None]:
+        sql, params = self._compile(statement)
+        async with self._cursor() as cursor:
+            if isinstance(self._pool, asyncio.Queue):
+                # aiosqlite executes statements on the connection
+                async with cursor.execute(sql, params) as result:
+                    return await result.fetchall() if fetch else None
+            await cursor.execute(sql, params)
+            return await cursor.fetchall() if fetch else None
+
+    async def fetch_all(self, statement) -> list:
+        """
+        The rows of a select statement as dicts of the column (label) names
+        """
+        rows = await self._execute(statement, fetch=True)
+        columns = [
+            (column.name, column.type.dialect_impl(self.dialect).result_processor(self.dialect, None))
+            for column in statement.inner_columns
+        ]
+        return [
+            {name: processor(value) if processor else value for (name, processor), value in zip(columns, row)}
+            for row in rows
+        ]
+
+    async def fetch_one(self, statement) -> Union[dict, None]:
+        rows = await self.fetch_all(statement.limit(1))
+        return rows[0] if rows else None
+
+    async def scalar(self, statement):
+        row = await self.fetch_one(statement)
+        return next(iter(row.values())) if row else None
+
+    async def execute(self, statement):
+        await self._execute(statement, fetch=False)
+
+
+def _load(model, table, row: dict, prefix: str):
+    """
+    Detached model instance with the values of a row, e.g. to use its jsonify method
+    """
+    mapper = model.__mapper__
+    instance = mapper.class_manager.new_instance()
+    for column in table.columns:
+        set_committed_value(instance, mapper.get_property_by_column(column).key, row[prefix + column.name])
+    return instance
+
+
+def user_query():
+    return select(
+        [column.label(f'u_{column.name}') for column in USERS.columns] +
+        [column.label(f'r_{column.name}') for column in ROLES.columns]
+    ).select_from(USERS.join(ROLES, USERS.c.role == ROLES.c.id))
+
+
+def role_query():
+    return select([column.label(f'r_{column.name}') for column in ROLES.columns])
+
+
+def load_user(row: dict) -> User:
+    user = _load(User, USERS, row, 'u_')
+    set_committed_value(user, 'role', _load(Role, ROLES, row, 'r_'))
+    return user
+
+
+def build_environ(scope: dict, body) -> dict:
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f'HTTP/{scope.get("http_version", "1.1")}',
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False
+    }
+    for name, value in scope.get('headers', []):
+        name, value = name.decode('latin-1'), value.decode('latin-1')
+        if name == 'content-type':
+            environ['CONTENT_TYPE'] = value
+        elif name == 'content-length':
+            environ['CONTENT_LENGTH'] = value
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+def wsgi_message(message: tuple) -> dict:
+    """
+    The asgi message of a part of the response of the flask application
+    """
+    if message[0] == 'start':
+        return {
+            'type': 'http.response.start',
+            'status': message[1],
+            'headers': [(key.lower().encode('latin-1'), value.encode('latin-1')) for key, value in message[2]]
+        }
+    return {'type': 'http.response.body', 'body': message[1], 'more_body': True}
+
+
+class AsyncApplication:
+    """
+    ASGI application, which serves the hot paths of the api with coroutines
+    and everything else with the flask application
+    """
+    def __init__(self, app: Flask) -> "AsyncApplication":
+        self.app = app
+        self.database = AsyncDatabase(
+            app.config['SQLALCHEMY_DATABASE_URI'],
+            app.config.get('ASGI_DATABASE_POOL_SIZE', 10)
+        )
+        self.executor = ThreadPoolExecutor(app.config.get('ASGI_WSGI_THREADS', 8))
+        self.redis = None
+        self._started = False
+        self.routes = [
+            ('GET', re.compile(r'/api/auth'), self.get_auth),
+            ('POST', re.compile(r'/api/auth'), self.login),
+            ('POST', re.compile(r'/api/auth/refresh'), self.refresh),
+            ('DELETE', re.compile(r'/api/auth/refresh/([^/]+)'), self.blacklist),
+            ('GET', re.compile(r'/api/users'), self.get_users),
+            # the fixed paths below /api/users belong to other resources of flask
+            ('GET', re.compile(r'/api/users/(?!(?:2fa|bulk)$)([^/]+)'), self.get_user),
+            ('GET', re.compile(r'/api/roles'), self.get_roles),
+            ('GET', re.compile(r'/api/roles/([^/]+)'), self.get_role)
+        ]
+
+    async def __call__(self, scope: dict, receive: callable, send: callable):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            return
+        await self.startup()
+
+        body = await self.read_body(receive)
+        environ = build_environ(scope, body)
+        # the body has been read completely, even if it has been sent without content length
+        environ['CONTENT_LENGTH'] = str(body.tell())
+        body.seek(0)
+
+        response = await self.dispatch(scope, environ)
+        if response is None:
+            # handled by flask
+            body.seek(0)
+            return await self.call_wsgi(environ, send)
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': [(key.lower().encode('latin-1'), value.encode('latin-1')) for key, value in response.headers]
+        })
+        await send({'type': 'http.response.body', 'body': response.get_data()})
+
+    async def read_body(self, receive: callable) -> SpooledTemporaryFile:
+        body = SpooledTemporaryFile(max_size=self.app.config.get('ASGI_BODY_MEMORY', 1024 * 1024))
+        while True:
+            message = await receive()
+            body.write(message.get('body', b''))
+            if not message.get('more_body'):
+                return body
+
+    async def dispatch(self, scope: dict, environ: dict) -> Union[Response, None]:
+        """
+        The response of the coroutine serving the request, None if it's passed to flask
+        """
+        for method, pattern, handler in self.routes:
+            match = pattern.fullmatch(scope['path'])
+            if method == scope['method'] and match:
+                break
+        else:
+            return None
+        started = time.perf_counter()
+        try:
+            response = await handler(environ, *match.groups())
+        except HashingUnavailable as e:
+            exc = e
+            response = self.respond(environ, lambda: hashing_unavailable(exc))
+        except BlacklistFull as e:
+            full = e
+            response = self.respond(environ, lambda: blacklist_full(full))
+        if response is not None:
+            # served without flask, the stages aren't broken down
+            metrics.requests.observe(time.perf_counter() - started, f'asgi.{handler.__name__}', method)
+            metrics.responses.inc(f'asgi.{handler.__name__}', str(response.status_code))
+        return response
+
+    async def lifespan(self, receive: callable, send: callable):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await self.startup()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def startup(self):
+        if self._started:
+            return
+        self._started = True
+        await self.database.connect()
+        if self.app.config.get('REDIS_URL'):
+            try:
+                import redis.asyncio
+            except ImportError:
+                self.app.logger.warning('redis.asyncio is not available, the blacklist is used synchronously')
+            else:
+                self.redis = redis.asyncio.Redis.from_url(
+                    self.app.config['REDIS_URL'],
+                    max_connections=self.app.config.get('REDIS_MAX_CONNECTIONS', 16),
+                    socket_timeout=self.app.config.get('REDIS_SOCKET_TIMEOUT', 0.5),
+                    socket_connect_timeout=self.app.config.get('REDIS_CONNECT_TIMEOUT', 0.5)
+                )
+                self.app.config['BLACKLIST'].init_async(self.redis)
+                self.app.config['THROTTLE'].init_async(self.redis)
+
+    async def shutdown(self):
+        await self.database.close()
+        if self.redis is not None:
+            await self.redis.close()
+        self.executor.shutdown(wait=False)
+        self._started = False
+
+    def respond(self, environ: dict, view: callable) -> Response:
+        """
+        Create the response of the view like flask, including the after request handlers (e.g. cors)
+        """
+        with self.app.request_context(environ):
+            return self.app.process_response(self.app.make_response(view()))
+
+    async def call_wsgi(self, environ: dict, send: callable):
+        """
+        Run the flask application in the thread pool, the response is sent while it's generated
+        """
+        loop = asyncio.get_event_loop()
+        queue = asyncio.Queue(maxsize=8)
+
+        def put(message: tuple):
+            asyncio.run_coroutine_threadsafe(queue.put(message), loop).result()
+
+        future = loop.run_in_executor(self.executor, self.run_wsgi, environ, put)
+        started = disconnected = False
+        while True:
+            message = await queue.get()
+            if message[0] == 'end':
+                break
+            if disconnected:
+                # keep reading until the response is complete, so the thread isn't blocked
+                continue
+            started = started or message[0] == 'start'
+            try:
+                await send(wsgi_message(message))
+            except OSError:
+                disconnected = True
+        await future
+        if not disconnected:
+            if not started:
+                await send({'type': 'http.response.start', 'status': 500, 'headers': []})
+            await send({'type': 'http.response.body', 'body': b''})
+
+    def run_wsgi(self, environ: dict, put: callable):
+        """
+        Call the flask application in a thread and put the parts of the response into the queue
+        """
+        def start_response(status: str, headers: list, exc_info=None) -> callable:
+            put(('start', int(status.split(' ', 1)[0]), headers))
+            return lambda data: put(('body', data))
+
+        try:
+            result = self.app(environ, start_response)
+            try:
+                for chunk in result:
+                    if chunk:
+                        put(('body', chunk))
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+        finally:
+            put(('end',))
+
+    async def fetch_user(self, *criteria) -> Union[User, None]:
+        row = await self.database.fetch_one(user_query().where(*criteria))
+        return load_user(row) if row else None
+
+    async def authenticate(self, environ: dict, admin: bool = False) -> Union[User, Response]:
+        """
+        Same as @require_token (and @require_admin), returns the user or an error response
+        """
+        access_token = environ.get('HTTP_AUTHORIZATION')
+        if not access_token or not access_token.startswith('Bearer '):
+            return self.respond(environ, lambda: ResultErrorSchema(
+                message='Missing access token',
+                status_code=401
+            ).jsonify())
+        invalid = lambda: ResultErrorSchema(message='Invalid access token', status_code=401).jsonify()  # noqa: E731
+        with self.app.app_context():
+            try:
+                claims = decode_token(access_token.split(' ')[1])
+            except TOKEN_ERRORS:
+                claims = None
+        if claims is None:
+            return self.respond(environ, invalid)
+
+        user = await self.fetch_user(USERS.c.username == claims.get('username'))
+        # the claims of self-contained tokens are checked against the current token generation
+        if user is None or (self.app.config.get('ACCESS_TOKEN_CLAIMS') and 'gen' in claims and
+                            claims['gen'] != (user.token_generation or 0)):
+            return self.respond(environ, invalid)
+        if admin and user.role_name != 'admin':
+            return self.respond(environ, lambda: ResultErrorSchema(message='Access Denied!', status_code=403).jsonify())
+        return user
+
+    async def get_auth(self, environ: dict) -> Response:
+        user = await self.authenticate(environ)
+        if isinstance(user, Response):
+            return user
+        return self.respond(environ, lambda: ResultSchema(data=user.jsonify()).jsonify())
+
+    async def load_payload(self, environ: dict, schema, endpoint: str) -> Union[tuple, Response, None]:
+        """
+        The validated payload and the throttle limits of the request, or the error response.
+        None if the body isn't json, flask answers those requests.
+        """
+        with self.app.request_context(environ):
+            try:
+                data = request.get_json() or {}
+            except BadRequest:
+                return None
+            try:
+                data = schema.load(data)
+            except ValidationError as errors:
+                messages = errors.messages
+                if endpoint == 'login':
+                    metrics.logins.inc('invalid_payload')
+                return self.respond(environ, lambda: AuthResultSchema(
+                    message='Payload is invalid',
+                    errors=messages,
+                    status_code=400
+                ).jsonify())
+            limits = throttle_limits(endpoint, data.get('username'))
+
+        retry_after = await self.app.config.get('THROTTLE').acquire_async(limits)
+        if retry_after:
+            if endpoint == 'login':
+                metrics.logins.inc('throttled')
+            return self.respond(environ, lambda: throttled(retry_after))
+        return data, limits
+
+    async def login(self, environ: dict) -> Union[Response, None]:
+        payload = await self.load_payload(environ, auth_schema, 'login')
+        if not isinstance(payload, tuple):
+            return payload
+        data, _ = payload
+
+        user = await self.fetch_user(USERS.c.username == data.get('username'))
+        if not user or not await hashing.verify_async(user._password, data.get('password')):
+            metrics.logins.inc('invalid_credentials')
+            return self.respond(environ, lambda: AuthResultSchema(
+                message='Invalid credentials',
+                status_code=401
+            ).jsonify())
+        failed = self.check_totp(environ, user, data)
+        if failed is not None:
+            return failed
+
+        values = {USERS.c.lastLogin: datetime.now()}
+        values.update(await self.renew_hash(user, data.get('password')))
+        await self.database.execute(USERS.update().where(USERS.c.id == user.id).values(values))
+
+        def view():
+            invalidate_principal(user.username)
+            metrics.logins.inc('success')
+            return AuthResultSchema(
+                message='Authentication was successfully',
+                access_token=create_access_token(user),
+                refresh_token=create_refresh_token(user)
+            ).jsonify()
+        return self.respond(environ, view)
+
+    def check_totp(self, environ: dict, user: User, data: dict) -> Union[Response, None]:
+        """
+        The error response if the user has enabled 2fa and the token is missing or invalid
+        """
+        if not user.totp_enabled:
+            return None
+        if 'token' not in data:
+            metrics.logins.inc('missing_2fa')
+            return self.respond(environ, lambda: AuthResultSchema(
+                message='Missing 2fa token',
+                status_code=401
+            ).jsonify())
+        if not user.verify_totp(data.get('token')):
+            metrics.logins.inc('invalid_2fa')
+            return self.respond(environ, lambda: AuthResultSchema(
+                message='Invalid credentials',
+                status_code=401
+            ).jsonify())
+        return None
+
+    async def renew_hash(self, user: User, password: str) -> dict:
+        """
+        The new hash if it doesn't match the active hash policy, skipped if the pool is busy
+        """
+        with self.app.app_context():
+            if not user.needs_rehash():
+                return {}
+        try:
+            return {
+                USERS.c.password: await hashing.generate_async(password, self.app.config.get('HASH_METHOD')),
+                USERS.c.passwordPolicy: self.app.config.get('HASH_POLICY_VERSION')
+            }
+        except POOL_ERRORS:
+            return {}
+
+    async def refresh(self, environ: dict) -> Union[Response, None]:
+        payload = await self.load_payload(environ, token_refresh_schema, 'refresh')
+        if not isinstance(payload, tuple):
+            return payload
+        refresh_token = payload[0]['refreshToken']
+
+        invalid = lambda: ResultErrorSchema(message='Invalid refresh token', status_code=401).jsonify()  # noqa: E731
+        if await self.app.config.get('BLACKLIST').check_async(refresh_token):
+            metrics.blacklist_hits.inc()
+            return self.respond(environ, lambda: ResultSchema(data='Invalid refresh token', status_code=401).jsonify())
+        with self.app.app_context():
+            try:
+                claims = decode_token(refresh_token)
+            except TOKEN_ERRORS:
+                claims = None
+        if claims is None:
+            return self.respond(environ, invalid)
+
+        user = await self.fetch_user(USERS.c.username == claims.get('username'))
+        if not user:
+            return self.respond(environ, lambda: ResultErrorSchema(message='User does not exist!').jsonify())
+        # tokens issued before e.g. a role or password change have been revoked
+        if claims.get('gen', user.token_generation or 0) != (user.token_generation or 0):
+            return self.respond(environ, invalid)
+        return self.respond(environ, lambda: AuthResultSchema(
+            message='Token refresh was successful',
+            access_token=create_access_token(user)
+        ).jsonify())
+
+    async def blacklist(self, environ: dict, token: str) -> Response:
+        blacklist = self.app.config.get('BLACKLIST')
+        if not await blacklist.check_async(token):
+            with self.app.app_context():
+                try:
+                    # check if the token is valid (could be a way to spam the blacklist)
+                    decode_token(token)
+                except TOKEN_ERRORS:
+                    return self.respond(environ, lambda: ResultErrorSchema(
+                        message='Invalid refresh token',
+                        status_code=401
+                    ).jsonify())
+            await blacklist.add_async(token)
+            with self.app.app_context():
+                evict_token(token)
+        return self.respond(environ, lambda: ResultSchema(
+            data='Successfully blacklisted token',
+            status_code=200
+        ).jsonify())
+
+    async def get_user(self, environ: dict, guid: str) -> Response:
+        user = await self.authenticate(environ, admin=True)
+        if isinstance(user, Response):
+            return user
+        data = await self.fetch_user(USERS.c.guid == guid)
+        if not data:
+            return self.respond(environ, lambda: ResultErrorSchema(
+                message='User does not exist!',
+                status_code=404
+            ).jsonify())
+        return self.respond(environ, lambda: ResultSchema(data=data.jsonify()).jsonify())
+
+    async def get_role(self, environ: dict, name: str) -> Response:
+        user = await self.authenticate(environ)
+        if isinstance(user, Response):
+            return user
+        row = await self.database.fetch_one(role_query().where(ROLES.c.name == name))
+        if not row:
+            return self.respond(environ, lambda: ResultErrorSchema(
+                message='Role does not exist!',
+                status_code=404
+            ).jsonify())
+        role = _load(Role, ROLES, row, 'r_')
+        return self.respond(environ, lambda: ResultSchema(data=role.jsonify() or None).jsonify())
+
+    async def get_users(self, environ: dict) -> Union[Response, None]:
+        user = await self.authenticate(environ, admin=True)
+        if isinstance(user, Response):
+            return user
+        return await self.paginate(environ, user_query(), USERS.c.id, load_user)
+
+    async def get_roles(self, environ: dict) -> Union[Response, None]:
+        user = await self.authenticate(environ)
+        if isinstance(user, Response):
+            return user
+        return await self.paginate(environ, role_query(), ROLES.c.id, lambda row: _load(Role, ROLES, row, 'r_'))
+
+    async def paginate(self, environ: dict, query, column, load: callable) -> Union[Response, None]:
+        """
+        Same as app.api.pagination.paginate, streamed collections are served by flask
+        """
+        with self.app.request_context(environ):
+            if wants_stream():
+                return None
+            try:
+                limit, after, count = page_arguments()
+            except ValueError:
+                return self.respond(environ, lambda: ResultErrorSchema(
+                    message='Invalid pagination parameters',
+                    status_code=400
+                ).jsonify())
+
+        total = None
+        if count:
+            total = await self.database.scalar(select([func.count(column)]))
+        if after is not None:
+            query = query.where(column > after)
+        rows = [load(row) for row in await self.database.fetch_all(query.order_by(column).limit(limit + 1))]
+        return self.respond(environ, lambda: page(rows, limit, column.key, total).jsonify())
+
+
+def create_asgi_app(config=None) -> AsyncApplication:
+    return AsyncApplication(create_app(config))
@@ -0,0 +1,636 @@
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from hashlib import sha256
+from typing import Iterable, List, Union
+import asyncio
+import fcntl
+import math
+import mmap
+import struct
+import threading
+import time
+import jwt
+
+from .redis_client import RedisClient, redis_client
+from .shared_memory import SharedMemoryFile
+
+
+def token_digest(token: str) -> bytes:
+    """
+    Fixed size fingerprint of a token, stored instead of the token itself
+    """
+    return sha256(token.encode('utf-8')).digest()[:16]
+
+
+class BlacklistFull(Exception):
+    """
+    Raised if a token can't be blacklisted, because all entries belong to tokens which are still valid.
+    The first of them expires after `retry_after` seconds.
+    """
+    def __init__(self, retry_after: int):
+        super().__init__(f'The blacklist is full, retry after {retry_after}s')
+        self.retry_after = retry_after
+
+
+class Blacklist:
+    def __init__(self) -> "Blacklist":
+        # lifetime of tokens without expiration date, in seconds
+        self.default_ttl = 0
+
+    def init_app(self, app):
+        self.default_ttl = app.config.get('REFRESH_TOKEN_VALIDITY', 0) * 60
+
+    def ttl(self, token: str) -> int:
+        """
+        Remaining lifetime of the token in seconds, the blacklist entry is not needed afterwards
+        """
+        try:
+            exp = jwt.decode(token, verify=False).get('exp')
+        except jwt.exceptions.DecodeError:
+            exp = None
+        if exp is None:
+            return self.default_ttl
+        return int(exp - time.time())
+
+    def add(self, token: str):
+        raise NotImplementedError()
+
+    def check(self, token: str) -> bool:
+        raise NotImplementedError()
+
+    def add_many(self, tokens: Iterable[str]):
+        for token in tokens:
+            self.add(token)
+
+    def check_many(self, tokens: Iterable[str]) -> List[bool]:
+        return [self.check(token) for token in tokens]
+
+    def digests(self) -> Iterable[bytes]:
+        """
+        The digests of all blacklisted tokens
+        """
+        raise NotImplementedError()
+
+    def shared_filter(self, name: str) -> Union[bytes, None]:
+        """
+        The bits of the bloom filter `name` published for all workers (see BloomFilteredBlacklist),
+        None if it hasn't been published or the blacklist can't share it
+        """
+        return None
+
+    def share_bits(self, name: str, positions: List[int]):
+        """
+        Set the bits of blacklisted tokens in the published bloom filter
+        """
+
+    def lock_filter(self, name: str, ttl: int) -> bool:
+        """
+        Reserve the rebuild of the published bloom filter for `ttl` seconds,
+        if the filter isn't shared each worker rebuilds its own
+        """
+        return True
+
+    def publish_filter(self, name: str, bits: bytes):
+        """
+        Replace the published bloom filter by a rebuilt one
+        """
+
+    def init_async(self, client):
+        """
+        Use an asyncio redis client in add_async and check_async, blacklists in memory don't need one
+        """
+
+    async def add_async(self, token: str):
+        self.add(token)
+
+    async def check_async(self, token: str) -> bool:
+        return self.check(token)
+
+    def stats(self) -> dict:
+        return {}
+
+
+class RedisBlacklist(Blacklist):
+    """
+    Each token is stored as digest in its own key, which expires together with the token
+    """
+    prefix = 'blacklist:'
+    # set of full tokens used by previous versions
+    legacy_key = 'blacklist'
+    # bitmaps of the bloom filters, not matched by the scan of the digests
+    filter_prefix = 'blacklist-bloom:'
+
+    def __init__(self, client=None) -> "RedisBlacklist":
+        super().__init__()
+        # the shared client of the application is used by default
+        if client is None:
+            client = redis_client
+        self.blacklist = client if isinstance(client, RedisClient) else RedisClient(client)
+        self.async_client = None
+
+    def key(self, token: str) -> str:
+        return self.prefix + urlsafe_b64encode(token_digest(token)).decode().rstrip('=')
+
+    def add(self, token: str):
+        self.add_many([token])
+
+    def check(self, token: str) -> bool:
+        return bool(self.blacklist.exists(self.key(token)))
+
+    def add_many(self, tokens: Iterable[str]):
+        # expired tokens are invalid anyway
+        self.blacklist.batch(
+            ('setex', self.key(token), ttl, 1) for token, ttl in ((token, self.ttl(token)) for token in tokens)
+            if ttl > 0
+        )
+
+    def check_many(self, tokens: Iterable[str]) -> List[bool]:
+        return [bool(result) for result in self.blacklist.batch(('exists', self.key(token)) for token in tokens)]
+
+    def init_async(self, client):
+        self.async_client = client
+
+    async def add_async(self, token: str):
+        if self.async_client is None:
+            # without redis.asyncio the synchronous client mustn't block the event loop
+            return await asyncio.get_event_loop().run_in_executor(None, self.add, token)
+        ttl = self.ttl(token)
+        if ttl > 0:
+            await self.async_client.set(self.key(token), 1, ex=ttl)
+
+    async def check_async(self, token: str) -> bool:
+        if self.async_client is None:
+            return await asyncio.get_event_loop().run_in_executor(None, self.check, token)
+        return bool(await self.async_client.exists(self.key(token)))
+
+    def stats(self) -> dict:
+        return self.blacklist.stats()
+
+    def digests(self) -> Iterable[bytes]:
+        for key in self.blacklist.scan_iter(match=self.prefix + '*'):
+            key = key.decode() if isinstance(key, bytes) else key
+            encoded = key[len(self.prefix):]
+            yield urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4))
+
+    def shared_filter(self, name: str) -> Union[bytes, None]:
+        key = self.filter_prefix + name
+        # the bitmap is created by the first blacklisted token, it's incomplete until it has been published
+        published, bits = self.blacklist.batch([('exists', key + ':published'), ('get', key)])
+        return (bits or b'') if published else None
+
+    def share_bits(self, name: str, positions: List[int]):
+        key = self.filter_prefix + name
+        # tokens blacklisted while the filter is rebuilt are added to the new one as well
+        self.blacklist.batch(('setbit', bitmap, position, 1) for bitmap in [key, key + ':next'] for position in positions)
+
+    def lock_filter(self, name: str, ttl: int) -> bool:
+        key = self.filter_prefix + name
+        if not self.blacklist.set(key + ':lock', 1, nx=True, ex=max(1, int(ttl))):
+            return False
+        # tokens blacklisted from now on might be missed by the scan
+        self.blacklist.delete(key + ':next')
+        return True
+
+    def publish_filter(self, name: str, bits: bytes):
+        key = self.filter_prefix + name
+        self.blacklist.batch([
+            ('set', key + ':new', bits),
+            ('bitop', 'OR', key, key + ':new', key + ':next'),
+            ('delete', key + ':new'),
+            ('set', key + ':published', 1)
+        ])
+
+    def migrate_legacy(self, batch_size: int = 1000) -> int:
+        """
+        Move the tokens of the legacy blacklist set into expiring keys
+        """
+        migrated = 0
+        while True:
+            tokens = self.blacklist.srandmember(self.legacy_key, batch_size)
+            if not tokens:
+                break
+            tokens = [token.decode() if isinstance(token, bytes) else token for token in tokens]
+            self.add_many(tokens)
+            self.blacklist.srem(self.legacy_key, *tokens)
+            migrated += len(tokens)
+        return migrated
+
+
+class SetBlacklist(Blacklist):
+    def __init__(self) -> "SetBlacklist":
+        super().__init__()
+        self.blacklist = set()
+
+    def add(self, token: str):
+        self.blacklist.add(token_digest(token))
+
+    def check(self, token: str) -> bool:
+        return token_digest(token) in self.blacklist
+
+    def digests(self) -> Iterable[bytes]:
+        return list(self.blacklist)
+
+
+class SharedMemoryBlacklist(Blacklist):
+    """
+    Blacklist in a memory mapped file, which is shared by all workers on this host.
+    The file contains a hash table of token digests and their expiration time, and
+    a min heap ordered by expiration time, used to evict expired tokens.
+    Tokens which are still valid are never evicted, if the blacklist is full BlacklistFull is raised.
+    """
+    magic = b'PFLB'
+    header = struct.Struct('<4sIII')  # magic, capacity, number of entries, number of tombstones
+    slot = struct.Struct('<16sq')  # digest, expiration time (0 = empty, -1 = deleted)
+    heap_entry = struct.Struct('<qI')  # expiration time, slot index
+
+    def __init__(self, path: str = None, capacity: int = 65536) -> "SharedMemoryBlacklist":
+        super().__init__()
+        self.path = path
+        self.capacity = capacity
+        self.rejected = 0
+        self._memory = SharedMemoryFile('pythonflasklogin-blacklist')
+
+    def init_app(self, app):
+        super().init_app(app)
+        self.path = app.config.get('BLACKLIST_PATH') or self.path
+        self.capacity = app.config.get('BLACKLIST_CAPACITY') or self.capacity
+
+    @property
+    def slots(self) -> int:
+        # the hash table is at most half full
+        return 1 << (2 * self.capacity - 1).bit_length()
+
+    def add(self, token: str):
+        self.add_many([token])
+
+    def check(self, token: str) -> bool:
+        return self.check_many([token])[0]
+
+    def add_many(self, tokens: Iterable[str]):
+        now = int(time.time())
+        entries = [(token_digest(token), now + self.ttl(token)) for token in tokens]
+        with self._locked(fcntl.LOCK_EX):
+            self._evict(now)
+            for digest, exp in entries:
+                if exp > now:
+                    self._insert(digest, exp)
+
+    def check_many(self, tokens: Iterable[str]) -> List[bool]:
+        now = int(time.time())
+        digests = [token_digest(token) for token in tokens]
+        with self._locked(fcntl.LOCK_SH):
+            return [self._lookup(digest) > now for digest in digests]
+
+    def digests(self) -> Iterable[bytes]:
+        now = int(time.time())
+        with self._locked(fcntl.LOCK_SH):
+            size = self.header.unpack_from(self._mmap, 0)[2]
+            entries = [self.heap_entry.unpack_from(self._mmap, self._heap_offset(i)) for i in range(size)]
+            slots = [self.slot.unpack_from(self._mmap, self._slot_offset(index)) for exp, index in entries if exp > now]
+        return [digest for digest, _ in slots]
+
+    def stats(self) -> dict:
+        with self._locked(fcntl.LOCK_SH):
+            _, capacity, size, tombstones = self.header.unpack_from(self._mmap, 0)
+        return {
+            'capacity': capacity,
+            'size': size,
+            'tombstones': tombstones,
+            'rejected': self.rejected
+        }
+
+    def _locked(self, operation: int):
+        size = self.header.size + self.slots * self.slot.size + self.capacity * self.heap_entry.size
+        header = self.header.pack(self.magic, self.capacity, 0, 0)
+        # the number of entries and tombstones change, the file is reused if it has the same capacity
+        return self._memory.locked(self.path, size, header, header[:8], operation)
+
+    @property
+    def _mmap(self) -> mmap.mmap:
+        return self._memory.mmap
+
+    def _slot_offset(self, index: int) -> int:
+        return self.header.size + index * self.slot.size
+
+    def _heap_offset(self, index: int) -> int:
+        return self.header.size + self.slots * self.slot.size + index * self.heap_entry.size
+
+    def _probe(self, digest: bytes):
+        mask = self.slots - 1
+        index = int.from_bytes(digest[:8], 'little') & mask
+        for _ in range(self.slots):
+            yield index
+            index = (index + 1) & mask
+
+    def _lookup(self, digest: bytes) -> int:
+        for index in self._probe(digest):
+            stored, exp = self.slot.unpack_from(self._mmap, self._slot_offset(index))
+            if exp == 0:
+                return 0
+            if exp > 0 and stored == digest:
+                return exp
+        return 0
+
+    def _insert(self, digest: bytes, exp: int):
+        if self._lookup(digest):
+            return
+        magic, capacity, size, tombstones = self.header.unpack_from(self._mmap, 0)
+        if size >= capacity:
+            # the expired tokens have been evicted already, evicting a valid one would undo its revocation
+            self.rejected += 1
+            first = self.heap_entry.unpack_from(self._mmap, self._heap_offset(0))[0]
+            raise BlacklistFull(retry_after=max(1, first - int(time.time())))
+        if tombstones > self.slots // 4:
+            self._rebuild()
+            size, tombstones = self.header.unpack_from(self._mmap, 0)[2:]
+        for index in self._probe(digest):
+            stored_exp = self.slot.unpack_from(self._mmap, self._slot_offset(index))[1]
+            if stored_exp <= 0:
+                if stored_exp < 0:
+                    tombstones -= 1
+                self.slot.pack_into(self._mmap, self._slot_offset(index), digest, exp)
+                self._push(size, exp, index)
+                self.header.pack_into(self._mmap, 0, magic, capacity, size + 1, tombstones)
+                return
+
+    def _evict(self, now: int):
+        while True:
+            size = self.header.unpack_from(self._mmap, 0)[2]
+            if not size or self.heap_entry.unpack_from(self._mmap, self._heap_offset(0))[0] > now:
+                return
+            self._pop()
+
+    def _pop(self):
+        # remove the token, which expires first (only called once it has expired)
+        magic, capacity, size, tombstones = self.header.unpack_from(self._mmap, 0)
+        _, index = self.heap_entry.unpack_from(self._mmap, self._heap_offset(0))
+        self.slot.pack_into(self._mmap, self._slot_offset(index), bytes(16), -1)
+        last = self.heap_entry.unpack_from(self._mmap, self._heap_offset(size - 1))
+        size -= 1
+        self.header.pack_into(self._mmap, 0, magic, capacity, size, tombstones + 1)
+        if size:
+            self._sift_down(size, 0, last)
+
+    def _push(self, size: int, exp: int, index: int):
+        position = size
+        while position > 0:
+            parent = (position - 1) // 2
+            entry = self.heap_entry.unpack_from(self._mmap, self._heap_offset(parent))
+            if entry[0] <= exp:
+                break
+            self.heap_entry.pack_into(self._mmap, self._heap_offset(position), *entry)
+            position = parent
+        self.heap_entry.pack_into(self._mmap, self._heap_offset(position), exp, index)
+
+    def _sift_down(self, size: int, position: int, entry: tuple):
+        while True:
+            child = 2 * position + 1
+            if child >= size:
+                break
+            child_entry = self.heap_entry.unpack_from(self._mmap, self._heap_offset(child))
+            if child + 1 < size:
+                right = self.heap_entry.unpack_from(self._mmap, self._heap_offset(child + 1))
+                if right[0] < child_entry[0]:
+                    child, child_entry = child + 1, right
+            if entry[0] <= child_entry[0]:
+                break
+            self.heap_entry.pack_into(self._mmap, self._heap_offset(position), *child_entry)
+            position = child
+        self.heap_entry.pack_into(self._mmap, self._heap_offset(position), *entry)
+
+    def _rebuild(self):
+        # remove the tombstones, which slow down the lookups
+        magic, capacity, size, _ = self.header.unpack_from(self._mmap, 0)
+        entries = []
+        for position in range(size):
+            index = self.heap_entry.unpack_from(self._mmap, self._heap_offset(position))[1]
+            entries.append(self.slot.unpack_from(self._mmap, self._slot_offset(index)))
+        self._mmap[self.header.size:self._heap_offset(0)] = bytes(self.slots * self.slot.size)
+        self.header.pack_into(self._mmap, 0, magic, capacity, 0, 0)
+        for digest, exp in entries:
+            self._insert(digest, exp)
+
+
+class BloomFilter:
+    """
+    The bits are ordered like a redis bitmap (most significant bit first), so the filter can be shared using redis
+    """
+    def __init__(self, capacity: int, error_rate: float) -> "BloomFilter":
+        # optimal number of bits and hash functions for the expected number of entries
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    @property
+    def name(self) -> str:
+        # filters with other parameters can't be merged
+        return f'{self.size}:{self.hashes}'
+
+    def positions(self, digest: bytes) -> Iterable[int]:
+        # double hashing, the digest is already uniformly distributed
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:16], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, digest: bytes):
+        for position in self.positions(digest):
+            self.bits[position >> 3] |= 0x80 >> (position & 7)
+
+    def __contains__(self, digest: bytes) -> bool:
+        return all(self.bits[position >> 3] & (0x80 >> (position & 7)) for position in self.positions(digest))
+
+    def load(self, bits: bytes):
+        # redis bitmaps end with the last bit which has been set
+        self.bits[:len(bits)] = bits[:len(self.bits)]
+
+    def estimated_error_rate(self) -> float:
+        """
+        The false positive rate of the filter, it grows with the expired tokens which are still in it
+        """
+        return (bin(int.from_bytes(self.bits, 'big')).count('1') / self.size) ** self.hashes
+
+
+class BloomFilteredBlacklist(Blacklist):
+    """
+    Local bloom filter of the blacklisted tokens in front of another blacklist (e.g. redis),
+    tokens which are definitely not blacklisted don't need a request to the backend.
+    The filter of each worker is synced every `sync_interval` seconds in a background thread, tokens
+    blacklisted by another worker in the meantime are only detected after the next sync.
+    Redis shares the filter between all workers, a sync only reads its bits. The filter is rebuilt from
+    the blacklisted tokens if it hasn't been published yet or the expired tokens in it raise the error rate
+    above twice the configured one, by a single worker at most every `rebuild_interval` seconds.
+    Other backends are read by each worker on every sync.
+    """
+    def __init__(self, backend: Blacklist, capacity: int = 100000, error_rate: float = 0.001,
+                 sync_interval: float = 30, rebuild_interval: int = 3600) -> "BloomFilteredBlacklist":
+        super().__init__()
+        self.backend = backend
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.sync_interval = sync_interval
+        self.rebuild_interval = rebuild_interval
+        self.skipped = 0
+        self.forwarded = 0
+        self.false_positives = 0
+        self.syncs = 0
+        self.rebuilds = 0
+        self.sync_errors = 0
+        self.logger = None
+        self._filter = None
+        self._synced = 0.0
+        # digests added while the filter is rebuilt, they are added to the new filter as well
+        self._added = None
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+
+    def init_app(self, app):
+        super().init_app(app)
+        self.backend.init_app(app)
+        self.capacity = app.config.get('BLACKLIST_BLOOM_CAPACITY', self.capacity)
+        self.error_rate = app.config.get('BLACKLIST_BLOOM_ERROR_RATE', self.error_rate)
+        self.sync_interval = app.config.get('BLACKLIST_BLOOM_SYNC_INTERVAL', self.sync_interval)
+        self.rebuild_interval = app.config.get('BLACKLIST_BLOOM_REBUILD_INTERVAL', self.rebuild_interval)
+        self.logger = app.logger
+        self._filter = None
+
+    def sync(self):
+        with self._sync_lock:
+            self._rebuild()
+
+    def _rebuild(self):
+        with self._lock:
+            self._added = []
+        try:
+            bloom = self._read()
+        except Exception:
+            with self._lock:
+                self._added = None
+            raise
+        with self._lock:
+            for digest in self._added:
+                bloom.add(digest)
+            self._added = None
+            self._filter = bloom
+            self._synced = time.monotonic()
+            self.syncs += 1
+
+    def _read(self) -> BloomFilter:
+        bloom = BloomFilter(self.capacity, self.error_rate)
+        bits = self.backend.shared_filter(bloom.name)
+        if bits is not None:
+            bloom.load(bits)
+            if bloom.estimated_error_rate() <= 2 * self.error_rate:
+                return bloom
+        # until a filter has been published, it's retried after the next interval
+        locked = self.backend.lock_filter(bloom.name, self.rebuild_interval if bits is not None else self.sync_interval)
+        if bits is not None and not locked:
+            # it's being rebuilt by another worker or it has been rebuilt recently
+            return bloom
+        bloom = BloomFilter(self.capacity, self.error_rate)
+        for digest in self.backend.digests():
+            bloom.add(digest)
+        if locked:
+            self.backend.publish_filter(bloom.name, bytes(bloom.bits))
+        with self._lock:
+            self.rebuilds += 1
+        return bloom
+
+    def _sync_in_background(self):
+        # at most one sync at a time, the requests keep using the current filter in the meantime
+        if not self._sync_lock.acquire(blocking=False):
+            return
+
+        def run():
+            try:
+                self._rebuild()
+            except Exception as e:
+                with self._lock:
+                    # retried after the next interval
+                    self._synced = time.monotonic()
+                    self.sync_errors += 1
+                if self.logger is not None:
+                    self.logger.warning(f'Unable to sync the bloom filter of the blacklist: {e}')
+            finally:
+                self._sync_lock.release()
+        threading.Thread(target=run, name='blacklist-sync', daemon=True).start()
+
+    def _bloom_filter(self) -> BloomFilter:
+        if self._filter is None:
+            # the first filter is needed to answer the request
+            with self._sync_lock:
+                if self._filter is None:
+                    self._rebuild()
+        elif time.monotonic() - self._synced > self.sync_interval:
+            self._sync_in_background()
+        return self._filter
+
+    def _add_digests(self, digests: List[bytes]):
+        bloom = self._bloom_filter()
+        # the other workers load the bits with their next sync
+        self.backend.share_bits(bloom.name, [position for digest in digests for position in bloom.positions(digest)])
+        with self._lock:
+            # the filter may have been replaced in the meantime
+            for digest in digests:
+                self._filter.add(digest)
+            if self._added is not None:
+                self._added.extend(digests)
+
+    def add(self, token: str):
+        self.add_many([token])
+
+    def check(self, token: str) -> bool:
+        return self.check_many([token])[0]
+
+    def add_many(self, tokens: Iterable[str]):
+        tokens = list(tokens)
+        self.backend.add_many(tokens)
+        self._add_digests([token_digest(token) for token in tokens])
+
+    def check_many(self, tokens: Iterable[str]) -> List[bool]:
+        tokens = list(tokens)
+        bloom = self._bloom_filter()
+        candidates = [token for token in tokens if token_digest(token) in bloom]
+        results = dict(zip(candidates, self.backend.check_many(candidates) if candidates else []))
+        with self._lock:
+            self.skipped += len(tokens) - len(candidates)
+            self.forwarded += len(candidates)
+            self.false_positives += sum(not result for result in results.values())
+        return [results.get(token, False) for token in tokens]
+
+    def init_async(self, client):
+        self.backend.init_async(client)
+
+    async def _bloom_filter_async(self) -> BloomFilter:
+        if self._filter is None:
+            # reading all digests from the backend would block the event loop
+            await asyncio.get_event_loop().run_in_executor(None, self._bloom_filter)
+        return self._bloom_filter()
+
+    async def add_async(self, token: str):
+        await self.backend.add_async(token)
+        await self._bloom_filter_async()
+        await asyncio.get_event_loop().run_in_executor(None, self._add_digests, [token_digest(token)])
+
+    async def check_async(self, token: str) -> bool:
+        if token_digest(token) not in await self._bloom_filter_async():
+            with self._lock:
+                self.skipped += 1
+            return False
+        result = await self.backend.check_async(token)
+        with self._lock:
+            self.forwarded += 1
+            self.false_positives += not result
+        return result
+
+    def digests(self) -> Iterable[bytes]:
+        return self.backend.digests()
+
+    def stats(self) -> dict:
+        return {
+            'skipped': self.skipped,
+            'forwarded': self.forwarded,
+            'falsePositives': self.false_positives,
+            'syncs': self.syncs,
+            'rebuilds': self.rebuilds,
+            'syncErrors': self.sync_errors,
+            'backend': self.backend.stats()
+        }
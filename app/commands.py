@@ -0,0 +1,137 @@
+import click
+import os
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import select, func
+
+from app.utils import db
+from app.hashing import calibrate, get_hasher
+from app.api import User, Role
+from app.api.authentication.keys import generate_private_key, ALGORITHMS
+from app.migrations import LATEST_VERSION, current_version, pending_migrations, upgrade
+from app.startup import measure
+
+hash_cli = AppGroup('hash', help='Manage the password hash policy.')
+role_cli = AppGroup('roles', help='Manage the roles.')
+blacklist_cli = AppGroup('blacklist', help='Manage the refresh token blacklist.')
+keys_cli = AppGroup('keys', help='Manage the keys to sign tokens.')
+db_cli = AppGroup('db', help='Manage the database schema.')
+startup_cli = AppGroup('startup', help='Measure the start of a worker.')
+
+
+@hash_cli.command('calibrate')
+@click.option('--method', default=None, help='Hash method to calibrate, defaults to HASH_METHOD.')
+@click.option('--target', default=250, show_default=True, help='Target duration of a single hash in ms.')
+def calibrate_command(method: str, target: int):
+    """
+    Find the hash parameters, which match the target duration on this host
+    """
+    active = current_app.config.get('HASH_METHOD')
+    method, duration = calibrate(method or active, target / 1000)
+    click.echo(f"HASH_METHOD = '{method}'  # {duration * 1000:.1f} ms per hash")
+    if method != get_hasher(active).normalize(active):
+        version = current_app.config.get('HASH_POLICY_VERSION')
+        click.echo(f'HASH_POLICY_VERSION = {version + 1}')
+
+
+@role_cli.command('recount')
+def recount_command():
+    """
+    Recalculate the number of users of each role
+    """
+    count = select([func.count(User.id)]).where(User.role_id == Role.id).as_scalar()
+    db.session.query(Role).update({Role.user_count: count}, synchronize_session=False)
+    db.session.commit()
+    for role in Role.query.order_by(Role.id):
+        click.echo(f'{role.name}: {role.user_count}')
+
+
+@blacklist_cli.command('migrate')
+def migrate_blacklist_command():
+    """
+    Move the tokens of the legacy blacklist set into expiring keys
+    """
+    blacklist = current_app.config.get('BLACKLIST')
+    if not hasattr(blacklist, 'migrate_legacy'):
+        raise click.ClickException('The configured blacklist has no legacy data to migrate')
+    click.echo(f'Migrated {blacklist.migrate_legacy()} tokens')
+
+
+@keys_cli.command('generate')
+@click.argument('kid')
+@click.option('--algorithm', default=None, help='RS256 or ES256, defaults to JWT_ALGORITHM.')
+def generate_key_command(kid: str, algorithm: str):
+    """
+    Create a new private key in JWT_KEYS_PATH, it's used for new tokens after a restart
+    if it's the last key in alphabetical order or configured as JWT_SIGNING_KEY
+    """
+    algorithm = algorithm or current_app.config.get('JWT_ALGORITHM')
+    path = current_app.config.get('JWT_KEYS_PATH')
+    if algorithm not in ALGORITHMS:
+        raise click.ClickException(f'Keys can only be generated for {", ".join(ALGORITHMS)}')
+    if not path:
+        raise click.ClickException('JWT_KEYS_PATH is not configured')
+    filename = os.path.join(path, f'{kid}.pem')
+    if os.path.exists(filename):
+        raise click.ClickException(f'The key {kid} already exists')
+    with os.fdopen(os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'wb') as f:
+        f.write(generate_private_key(algorithm))
+    click.echo(f'Created {filename}')
+
+
+@db_cli.command('upgrade')
+def upgrade_command():
+    """
+    Create the tables or apply the pending migrations, run once per deployment before the workers are started
+    """
+    applied = upgrade(db.get_engine())
+    for migration in applied:
+        click.echo(f'Applied {migration.version}: {migration.description}')
+    click.echo(f'The schema is at version {LATEST_VERSION}')
+
+
+@db_cli.command('version')
+def version_command():
+    """
+    Show the version of the schema and the pending migrations
+    """
+    with db.get_engine().connect() as connection:
+        click.echo(f'Version {current_version(connection)} of {LATEST_VERSION}')
+    for migration in pending_migrations(db.get_engine()):
+        click.echo(f'Pending {migration.version}: {migration.description}')
+
+
+@startup_cli.command('measure')
+@click.option('--repeat', default=3, show_default=True, help='Number of starts, the fastest one is reported.')
+@click.option('--budget', default=None, type=float, help='Max. seconds of a start, defaults to STARTUP_BUDGET.')
+@click.option('--imports', is_flag=True, help='Show the import time of each package.')
+def measure_command(repeat: int, budget: float, imports: bool):
+    """
+    Start the app in new processes like a worker, fails if the start takes longer than the budget
+    """
+    budget = budget or current_app.config.get('STARTUP_BUDGET')
+    try:
+        reports = [measure(imports=imports) for _ in range(max(1, repeat))]
+    except RuntimeError as e:
+        raise click.ClickException(f'The app could not be started: {e}')
+    report = min(reports, key=lambda r: r['wall'])
+    click.echo(f"process {report['wall'] * 1000:.0f} ms, app {report['total'] * 1000:.0f} ms, "
+               f"{report['modules']} modules")
+    for phase, duration in report['phases'].items():
+        click.echo(f'  {phase}: {duration * 1000:.1f} ms')
+    if imports:
+        click.echo('imports:')
+        for package, duration in list(report['imports'].items())[:15]:
+            click.echo(f'  {package}: {duration * 1000:.1f} ms')
+    if budget and report['wall'] > budget:
+        raise click.ClickException(f"The start took {report['wall'] * 1000:.0f} ms, "
+                                   f"the budget is {budget * 1000:.0f} ms")
+
+
+def register_commands(app):
+    app.cli.add_command(hash_cli)
+    app.cli.add_command(role_cli)
+    app.cli.add_command(blacklist_cli)
+    app.cli.add_command(keys_cli)
+    app.cli.add_command(db_cli)
+    app.cli.add_command(startup_cli)
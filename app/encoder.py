@@ -0,0 +1,95 @@
+from datetime import date
+from flask import current_app, Response
+from flask.json import JSONEncoder as FlaskJSONEncoder
+from functools import lru_cache
+from typing import Callable, Tuple
+from uuid import UUID
+import json
+
+from app.metrics import timed
+
+
+def _default(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, UUID):
+        return str(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+class JSONEncoder(FlaskJSONEncoder):
+    """
+    Encodes dates as ISO 8601 like the fast encoders do, instead of http dates
+    """
+    def default(self, o):
+        if isinstance(o, date):
+            return o.isoformat()
+        return super().default(o)
+
+
+def _orjson() -> Callable:
+    import orjson
+    return lambda obj: orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+def _ujson() -> Callable:
+    import ujson
+    # ujson before 5.0 doesn't support a default function
+    ujson.dumps(date.min, default=_default)
+    return lambda obj: ujson.dumps(obj, default=_default, ensure_ascii=False, escape_forward_slashes=False).encode()
+
+
+def _stdlib() -> Callable:
+    encoder = json.JSONEncoder(separators=(',', ':'), default=_default)
+    return lambda obj: encoder.encode(obj).encode()
+
+
+BACKENDS = {'orjson': _orjson, 'ujson': _ujson, 'json': _stdlib}
+
+
+def select_backend(name: str = 'auto') -> Tuple[str, Callable]:
+    """
+    The name and the dumps function of the backend, auto uses the fastest installed one
+    """
+    if name != 'auto':
+        try:
+            return name, BACKENDS[name]()
+        except (KeyError, ImportError, TypeError):
+            raise RuntimeError(f'The json backend {name} is not available')
+    for name in BACKENDS:
+        try:
+            return name, BACKENDS[name]()
+        except (ImportError, TypeError):
+            continue
+
+
+class FastJSON:
+    """
+    Serializes the result envelopes to utf-8 encoded json, using orjson or ujson if available
+    """
+    def __init__(self) -> "FastJSON":
+        self.name, self._dumps = select_backend('json')
+
+    def init_app(self, app):
+        self.name, self._dumps = select_backend(app.config.get('JSON_BACKEND', 'auto'))
+        message_body.cache_clear()
+        # views which still use flask.jsonify encode dates the same way
+        app.json_encoder = JSONEncoder
+
+    def dumps(self, obj) -> bytes:
+        with timed('serialize'):
+            return self._dumps(obj)
+
+    def response(self, body: bytes, status: int = 200, headers: dict = None) -> Response:
+        return current_app.response_class(body, status=status, headers=headers, mimetype='application/json')
+
+
+fast_json = FastJSON()
+
+
+@lru_cache(maxsize=256)
+def message_body(message: str) -> bytes:
+    """
+    Body of a response with just a message, most of them are constant (e.g. 'Missing access token')
+    """
+    return fast_json.dumps({'message': message})
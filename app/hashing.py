@@ -0,0 +1,436 @@
+import asyncio
+import hashlib
+import hmac
+import math
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import BrokenExecutor, Future, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import List
+from werkzeug.security import gen_salt, DEFAULT_PBKDF2_ITERATIONS
+from werkzeug import security
+
+from app.metrics import timed
+
+
+class Hasher:
+    """
+    A password hashing algorithm. The method string (e.g. pbkdf2:sha512:20000) names
+    the algorithm in the first segment and its parameters in the remaining ones,
+    it's stored as first part (before the first $) of every hash.
+    """
+    name = None
+
+    def normalize(self, method: str) -> str:
+        """
+        Fill in the default parameters of a method string
+        """
+        return method
+
+    def generate(self, password: str, method: str) -> str:
+        raise NotImplementedError()
+
+    def verify(self, pwhash: str, password: str) -> bool:
+        raise NotImplementedError()
+
+    def with_cost(self, method: str, factor: float) -> str:
+        """
+        Scale the cost parameter of a method string by the given factor
+        """
+        raise NotImplementedError()
+
+
+class PBKDF2Hasher(Hasher):
+    name = 'pbkdf2'
+
+    def normalize(self, method: str) -> str:
+        parts = method.split(':')
+        hash_name = parts[1] if len(parts) > 1 else 'sha256'
+        iterations = int(parts[2]) if len(parts) > 2 else DEFAULT_PBKDF2_ITERATIONS
+        return f'pbkdf2:{hash_name}:{iterations}'
+
+    def generate(self, password: str, method: str) -> str:
+        return security.generate_password_hash(password, method=self.normalize(method))
+
+    def verify(self, pwhash: str, password: str) -> bool:
+        return security.check_password_hash(pwhash, password)
+
+    def with_cost(self, method: str, factor: float) -> str:
+        _, hash_name, iterations = self.normalize(method).split(':')
+        return f'pbkdf2:{hash_name}:{max(1000, int(int(iterations) * factor))}'
+
+
+class ScryptHasher(Hasher):
+    name = 'scrypt'
+
+    def normalize(self, method: str) -> str:
+        parts = method.split(':')
+        n = int(parts[1]) if len(parts) > 1 else 2 ** 15
+        r = int(parts[2]) if len(parts) > 2 else 8
+        p = int(parts[3]) if len(parts) > 3 else 1
+        return f'scrypt:{n}:{r}:{p}'
+
+    def generate(self, password: str, method: str) -> str:
+        method = self.normalize(method)
+        salt = gen_salt(16)
+        return f'{method}${salt}${self._derive(password, salt, method)}'
+
+    def verify(self, pwhash: str, password: str) -> bool:
+        if pwhash.count('$') != 2:
+            return False
+        method, salt, hashval = pwhash.split('$')
+        return hmac.compare_digest(self._derive(password, salt, method), hashval)
+
+    def with_cost(self, method: str, factor: float) -> str:
+        _, n, r, p = self.normalize(method).split(':')
+        # n has to be a power of two
+        n = 2 ** max(10, round(math.log2(int(n) * factor)))
+        return f'scrypt:{n}:{r}:{p}'
+
+    @staticmethod
+    def _derive(password: str, salt: str, method: str) -> str:
+        n, r, p = (int(x) for x in method.split(':')[1:])
+        return hashlib.scrypt(
+            password.encode('utf-8'), salt=salt.encode('utf-8'),
+            n=n, r=r, p=p, maxmem=n * r * 256
+        ).hex()
+
+
+class Argon2Hasher(Hasher):
+    """
+    Requires the optional argon2-cffi package
+    """
+    name = 'argon2'
+
+    def normalize(self, method: str) -> str:
+        parts = method.split(':')
+        time_cost = int(parts[1]) if len(parts) > 1 else 3
+        memory_cost = int(parts[2]) if len(parts) > 2 else 65536
+        parallelism = int(parts[3]) if len(parts) > 3 else 4
+        return f'argon2:{time_cost}:{memory_cost}:{parallelism}'
+
+    def generate(self, password: str, method: str) -> str:
+        method = self.normalize(method)
+        return f'{method}${self._hasher(method).hash(password)}'
+
+    def verify(self, pwhash: str, password: str) -> bool:
+        from argon2.exceptions import VerificationError, InvalidHash
+        method, encoded = pwhash.split('$', 1)
+        try:
+            return self._hasher(method).verify(encoded, password)
+        except (VerificationError, InvalidHash):
+            return False
+
+    def with_cost(self, method: str, factor: float) -> str:
+        _, time_cost, memory_cost, parallelism = self.normalize(method).split(':')
+        return f'argon2:{max(1, round(int(time_cost) * factor))}:{memory_cost}:{parallelism}'
+
+    @staticmethod
+    def _hasher(method: str):
+        try:
+            from argon2 import PasswordHasher
+        except ImportError:
+            raise RuntimeError('The argon2 hash method requires the argon2-cffi package')
+        time_cost, memory_cost, parallelism = (int(x) for x in method.split(':')[1:])
+        return PasswordHasher(time_cost=time_cost, memory_cost=memory_cost, parallelism=parallelism)
+
+
+class LegacyHasher(Hasher):
+    """
+    Salted hashes of werkzeug (e.g. sha512$salt$hash), can only be verified
+    """
+    def generate(self, password: str, method: str) -> str:
+        raise ValueError(f'Unsupported hash method: {method}')
+
+    def verify(self, pwhash: str, password: str) -> bool:
+        return security.check_password_hash(pwhash, password)
+
+
+HASHERS = {hasher.name: hasher for hasher in [PBKDF2Hasher(), ScryptHasher(), Argon2Hasher()]}
+
+
+def get_hasher(method: str) -> Hasher:
+    return HASHERS.get(method.split(':')[0]) or LegacyHasher()
+
+
+def generate_password_hash(password: str, method: str) -> str:
+    return get_hasher(method).generate(password, method)
+
+
+def check_password_hash(pwhash: str, password: str) -> bool:
+    if not pwhash or '$' not in pwhash:
+        return False
+    return get_hasher(pwhash.split('$', 1)[0]).verify(pwhash, password)
+
+
+def needs_rehash(pwhash: str, method: str) -> bool:
+    """
+    Check if a hash has been generated with other parameters than the given method
+    """
+    return not pwhash or pwhash.split('$', 1)[0] != get_hasher(method).normalize(method)
+
+
+def calibrate(method: str, target: float, password: str = 'calibration-password') -> (str, float):
+    """
+    Find the parameters of a hash method, so that a single hash takes about `target` seconds on this host
+    """
+    hasher = get_hasher(method)
+    method = hasher.normalize(method)
+    for _ in range(20):
+        start = time.perf_counter()
+        hasher.generate(password, method)
+        duration = time.perf_counter() - start
+        scaled = hasher.with_cost(method, target / max(duration, 1e-4))
+        if abs(duration - target) / target < 0.1 or scaled == method:
+            break
+        method = scaled
+    return method, duration
+
+
+class HashingUnavailable(Exception):
+    """
+    Raised if a hash could not be computed within the configured deadline,
+    the client should retry after `retry_after` seconds
+    """
+    def __init__(self, retry_after: int):
+        super().__init__(f'Password hashing is overloaded, retry after {retry_after}s')
+        self.retry_after = retry_after
+
+
+# the pool is busy or a worker has died, hashes which are not required (e.g. the renewal on a login) can be skipped
+POOL_ERRORS = (HashingUnavailable, BrokenExecutor)
+
+
+def _timed(func: callable, *args: list):
+    # executed inside of the worker process
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+class HashingPool:
+    """
+    Runs password hashing in a dedicated process pool, so slow key derivation
+    does not block the web worker for other requests.
+    With HASH_WORKERS = 0 all hashes are calculated inline.
+    """
+    def __init__(self, app=None) -> "HashingPool":
+        self.workers = 0
+        self.queue_size = 0
+        self.bulk_workers = 0
+        self.deadline = None
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        # exponentially weighted moving average of the time a single hash takes
+        self._service_time = 0.0
+        self._completed = 0
+        self._rejected = 0
+        self._timeouts = 0
+        self._restarts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        workers = app.config.get('HASH_WORKERS', 0)
+        queue_size = app.config.get('HASH_QUEUE_SIZE', 0) or workers * 8
+        with self._lock:
+            if (workers, queue_size) != (self.workers, self.queue_size):
+                self._shutdown()
+            self.workers = workers
+            self.queue_size = queue_size
+            self.bulk_workers = min(workers, app.config.get('HASH_BULK_WORKERS') or max(1, workers // 2))
+            self.deadline = app.config.get('HASH_DEADLINE')
+
+    def generate(self, password: str, method: str) -> str:
+        with timed('hash'):
+            return self.submit(generate_password_hash, password, method)
+
+    def verify(self, pwhash: str, password: str) -> bool:
+        with timed('hash'):
+            return self.submit(check_password_hash, pwhash, password)
+
+    def generate_many(self, passwords: List[str], method: str) -> List[str]:
+        """
+        Hash a batch of passwords (e.g. for imports). At most `bulk_workers` hashes of the batch run at once,
+        so the other workers are left to the logins. They are counted as pending, but they are not
+        rejected if the pool is busy, the batch waits instead.
+        """
+        with timed('hash'):
+            return self._generate_many(passwords, method)
+
+    def _generate_many(self, passwords: List[str], method: str) -> List[str]:
+        if not self.workers:
+            results = [_timed(generate_password_hash, password, method) for password in passwords]
+        else:
+            results, running = [], deque()
+            for password in passwords:
+                if len(running) >= self.bulk_workers:
+                    results.append(self._result(running.popleft()))
+                running.append(self._submit(self._reserve(), generate_password_hash, password, method))
+            results.extend(self._result(future) for future in running)
+        for _, service_time in results:
+            self._record(0.0, service_time)
+        return [result for result, _ in results]
+
+    def submit(self, func: callable, *args: list):
+        if not self.workers:
+            result, service_time = _timed(func, *args)
+            self._record(0.0, service_time)
+            return result
+
+        enqueued = time.perf_counter()
+        future = self._submit(self._admit(), func, *args)
+        try:
+            result, service_time = self._result(future, timeout=self.deadline)
+        except FutureTimeoutError:
+            future.cancel()
+            raise self._timeout()
+        self._record(time.perf_counter() - enqueued - service_time, service_time)
+        return result
+
+    async def generate_async(self, password: str, method: str) -> str:
+        return await self.submit_async(generate_password_hash, password, method)
+
+    async def verify_async(self, pwhash: str, password: str) -> bool:
+        return await self.submit_async(check_password_hash, pwhash, password)
+
+    async def submit_async(self, func: callable, *args: list):
+        """
+        Like submit, but the event loop keeps serving other requests while the hash is calculated
+        """
+        loop = asyncio.get_event_loop()
+        if not self.workers:
+            # don't block the event loop, even if there are no hashing processes
+            result, service_time = await loop.run_in_executor(None, _timed, func, *args)
+            self._record(0.0, service_time)
+            return result
+
+        enqueued = time.perf_counter()
+        future = self._submit(self._admit(), func, *args)
+        try:
+            result, service_time = await asyncio.wait_for(asyncio.wrap_future(future), self.deadline)
+        except asyncio.TimeoutError:
+            raise self._timeout()
+        except BrokenProcessPool:
+            raise self._broken(future)
+        self._record(time.perf_counter() - enqueued - service_time, service_time)
+        return result
+
+    def _admit(self) -> ProcessPoolExecutor:
+        """
+        Reserve a place in the queue, requests which would wait longer than the deadline are rejected
+        """
+        with self._lock:
+            # requests only wait if all workers are busy
+            expected_wait = self._pending / self.workers * self._service_time if self._pending >= self.workers else 0.0
+            if self._pending >= self.queue_size or (self.deadline and expected_wait > self.deadline):
+                self._rejected += 1
+                raise HashingUnavailable(retry_after=max(1, math.ceil(expected_wait)))
+            self._pending += 1
+            return self._get_executor()
+
+    def _submit(self, executor: ProcessPoolExecutor, func: callable, *args: list) -> Future:
+        """
+        Run a hash, which has a place in the queue, the place is released when it's done.
+        If a hashing process has died (e.g. killed by the oom killer), the pool is rebuilt once.
+        """
+        try:
+            try:
+                future = executor.submit(_timed, func, *args)
+            except BrokenProcessPool:
+                executor = self._rebuild(executor)
+                future = executor.submit(_timed, func, *args)
+        except BaseException:
+            self._release()
+            raise
+        # a pool, which breaks while the hash is running, is only replaced if it's still in use
+        future._executor = executor
+        future.add_done_callback(self._release)
+        return future
+
+    def _result(self, future: Future, timeout: float = None):
+        try:
+            return future.result(timeout=timeout)
+        except BrokenProcessPool:
+            raise self._broken(future)
+
+    def _broken(self, future: Future) -> HashingUnavailable:
+        # the hash was running when its process died, the next request is hashed in a new pool
+        self._rebuild(future._executor)
+        return HashingUnavailable(retry_after=1)
+
+    def _rebuild(self, executor: ProcessPoolExecutor) -> ProcessPoolExecutor:
+        """
+        Replace a broken pool, unless another thread has replaced it already
+        """
+        with self._lock:
+            if self._executor is executor:
+                # a broken pool has already terminated its processes, shutting it down again can fail
+                self._executor = None
+                self._restarts += 1
+            return self._get_executor()
+
+    def _release(self, future: Future = None):
+        # a hash which is already running can't be cancelled, its worker is busy until it's done
+        with self._lock:
+            self._pending -= 1
+
+    def _reserve(self) -> ProcessPoolExecutor:
+        """
+        Reserve a place in the queue without admission control
+        """
+        with self._lock:
+            self._pending += 1
+            return self._get_executor()
+
+    def _timeout(self) -> HashingUnavailable:
+        with self._lock:
+            self._timeouts += 1
+        return HashingUnavailable(retry_after=max(1, math.ceil(self._service_time * self.queue_size / self.workers)))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queueSize': self.queue_size,
+                'queueDepth': max(0, self._pending - self.workers) if self.workers else 0,
+                'pending': self._pending,
+                'completed': self._completed,
+                'rejected': self._rejected,
+                'timeouts': self._timeouts,
+                'restarts': self._restarts,
+                'serviceTime': self._service_time,
+                'waitTimeAvg': self._wait_total / self._completed if self._completed else 0.0,
+                'waitTimeMax': self._wait_max
+            }
+
+    def _record(self, wait: float, service_time: float):
+        with self._lock:
+            self._completed += 1
+            self._wait_total += max(0.0, wait)
+            self._wait_max = max(self._wait_max, wait)
+            if self._service_time:
+                self._service_time = 0.8 * self._service_time + 0.2 * service_time
+            else:
+                self._service_time = service_time
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # the pool has to be created in the process that is using it (e.g. after the gunicorn fork)
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            self._pid = os.getpid()
+        return self._executor
+
+    def _shutdown(self):
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=False)
+        self._executor = None
+
+
+hashing = HashingPool()
@@ -0,0 +1,349 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from flask import g, request, _app_ctx_stack
+from typing import Dict, Iterator, List, Tuple
+import fcntl
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+# upper bounds of the latency histograms in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# parts of a request which are timed separately
+STAGES = ('db', 'hash', 'jwt', 'serialize')
+
+
+class LocalValues:
+    """
+    Values of this worker
+    """
+    def __init__(self) -> "LocalValues":
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, key: str, amount: float):
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def collect(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(self._values)
+
+
+class SharedValues:
+    """
+    Values of each worker in its own memory mapped file in `path`, which are summed up when they are collected.
+    Only the worker writes its file, so the workers don't need to lock each other on updates.
+    The values of stopped workers are merged into a single file when a new worker starts.
+    """
+    magic = b'PFLM'
+    header = struct.Struct('<4sQ')  # magic, used bytes
+    length = struct.Struct('<I')  # length of the key of an entry, followed by the key and the value
+    value = struct.Struct('<d')
+    initial_size = 64 * 1024
+
+    def __init__(self, path: str = None) -> "SharedValues":
+        self.path = path or os.path.join(
+            '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), 'pythonflasklogin-metrics'
+        )
+        self._lock = threading.Lock()
+        self._pid = None
+        self._file = None
+        self._mmap = None
+        self._used = 0
+        self._positions = {}
+
+    def inc(self, key: str, amount: float):
+        with self._lock:
+            self._open()
+            position = self._positions.get(key)
+            if position is None:
+                position = self._append(key)
+            self.value.pack_into(self._mmap, position, self.value.unpack_from(self._mmap, position)[0] + amount)
+
+    def collect(self) -> Dict[str, float]:
+        values = {}
+        with self._locked(fcntl.LOCK_SH):
+            for name in os.listdir(self.path):
+                if name.endswith('.db'):
+                    for key, value in self.read(os.path.join(self.path, name)):
+                        values[key] = values.get(key, 0.0) + value
+        return values
+
+    @classmethod
+    def read(cls, filename: str) -> Iterator[Tuple[str, float]]:
+        try:
+            with open(filename, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return
+        if len(data) < cls.header.size:
+            return
+        magic, used = cls.header.unpack_from(data)
+        position = cls.header.size
+        # entries are complete up to `used`, it's updated after an entry has been written
+        while magic == cls.magic and position < min(used, len(data)):
+            size, = cls.length.unpack_from(data, position)
+            key = data[position + cls.length.size:position + cls.length.size + size].decode()
+            position = cls._value_offset(position, size)
+            yield key, cls.value.unpack_from(data, position)[0]
+            position += cls.value.size
+
+    @classmethod
+    def _value_offset(cls, position: int, size: int) -> int:
+        # the values are aligned to 8 bytes
+        offset = position + cls.length.size + size
+        return offset + (-offset % 8)
+
+    @contextmanager
+    def _locked(self, operation: int):
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, 'lock'), 'a+b') as lock:
+            fcntl.flock(lock, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _open(self):
+        # forked workers inherit the file of the parent, each of them needs its own
+        if self._pid == os.getpid():
+            return
+        pid = os.getpid()
+        with self._locked(fcntl.LOCK_EX):
+            self._merge_stopped(pid)
+            self._file = os.fdopen(os.open(self._filename(pid), os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600), 'r+b')
+            self._file.truncate(self.initial_size)
+            self._mmap = mmap.mmap(self._file.fileno(), self.initial_size)
+            self._used = self.header.size
+            self.header.pack_into(self._mmap, 0, self.magic, self._used)
+        self._positions = {}
+        self._pid = pid
+
+    def _filename(self, pid) -> str:
+        return os.path.join(self.path, f'worker-{pid}.db')
+
+    def _merge_stopped(self, pid: int):
+        """
+        Add the values of the stopped workers to stopped.db, so the counters don't decrease
+        """
+        stopped = []
+        for name in os.listdir(self.path):
+            if name.startswith('worker-') and name.endswith('.db'):
+                worker = int(name[7:-3])
+                # a file with the pid of this process has been left by a stopped worker, the pid has been reused
+                if worker == pid or not _alive(worker):
+                    stopped.append(os.path.join(self.path, name))
+        if not stopped:
+            return
+        values = {}
+        for filename in [os.path.join(self.path, 'stopped.db')] + stopped:
+            for key, value in self.read(filename):
+                values[key] = values.get(key, 0.0) + value
+        data = bytearray(self.header.size)
+        for key, value in values.items():
+            encoded = key.encode()
+            start = len(data)
+            data += self.length.pack(len(encoded)) + encoded
+            data += bytes(self._value_offset(start, len(encoded)) - len(data)) + self.value.pack(value)
+        self.header.pack_into(data, 0, self.magic, len(data))
+        temporary = os.path.join(self.path, 'stopped.tmp')
+        with open(temporary, 'wb') as f:
+            f.write(data)
+        os.replace(temporary, os.path.join(self.path, 'stopped.db'))
+        for filename in stopped:
+            os.remove(filename)
+
+    def _append(self, key: str) -> int:
+        encoded = key.encode()
+        position = self._value_offset(self._used, len(encoded))
+        end = position + self.value.size
+        if end > len(self._mmap):
+            size = len(self._mmap)
+            while size < end:
+                size *= 2
+            self._file.truncate(size)
+            self._mmap.close()
+            self._mmap = mmap.mmap(self._file.fileno(), size)
+        self.length.pack_into(self._mmap, self._used, len(encoded))
+        self._mmap[self._used + self.length.size:self._used + self.length.size + len(encoded)] = encoded
+        self.value.pack_into(self._mmap, position, 0.0)
+        self._used = end
+        self.header.pack_into(self._mmap, 0, self.magic, self._used)
+        self._positions[key] = position
+        return position
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, metrics: "Metrics", name: str, description: str, labels: Tuple[str, ...] = ()) -> "Metric":
+        self.metrics = metrics
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._keys = {}
+
+    def key(self, suffix: str, values: tuple) -> str:
+        return json.dumps([self.name, suffix, list(values)])
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *values: str, amount: float = 1.0):
+        key = self._keys.get(values)
+        if key is None:
+            key = self._keys[values] = self.key('total', values)
+        self.metrics.values.inc(key, amount)
+
+
+class Histogram(Metric):
+    """
+    The observations are counted in the bucket of their upper bound, the buckets are cumulated when exposed
+    """
+    kind = 'histogram'
+
+    def __init__(self, *args: list, buckets: Tuple[float, ...] = BUCKETS, **kwargs: dict) -> "Histogram":
+        super().__init__(*args, **kwargs)
+        self.buckets = buckets
+
+    def observe(self, value: float, *values: str):
+        keys = self._keys.get(values)
+        if keys is None:
+            keys = self._keys[values] = (
+                [self.key('bucket', values + (repr(bound),)) for bound in self.buckets],
+                self.key('sum', values),
+                self.key('count', values)
+            )
+        buckets, total, count = keys
+        index = bisect_left(self.buckets, value)
+        if index < len(buckets):
+            self.metrics.values.inc(buckets[index], 1.0)
+        self.metrics.values.inc(total, value)
+        self.metrics.values.inc(count, 1.0)
+
+
+class Metrics:
+    """
+    Request latencies broken down into stages and counters of events in the prometheus text format.
+    With METRICS_SHARED the values of all workers of a host are aggregated.
+    """
+    def __init__(self) -> "Metrics":
+        self.values = LocalValues()
+        self.families: List[Metric] = []
+        self.requests = self.histogram(
+            'http_request_duration_seconds', 'Duration of the requests', ('endpoint', 'method'))
+        self.stages = self.histogram(
+            'http_request_stage_seconds', 'Time of the requests spent in db queries, password hashing, '
+            'jwt signing and verification and json serialization', ('endpoint', 'stage'))
+        self.responses = self.counter('http_responses_total', 'Responses by status code', ('endpoint', 'status'))
+        self.logins = self.counter('login_attempts_total', 'Logins by outcome', ('outcome',))
+        self.blacklist_hits = self.counter('blacklist_hits_total', 'Blacklisted refresh tokens which have been used')
+
+    def counter(self, name: str, description: str, labels: Tuple[str, ...] = ()) -> Counter:
+        metric = Counter(self, name, description, labels)
+        self.families.append(metric)
+        return metric
+
+    def histogram(self, name: str, description: str, labels: Tuple[str, ...] = ()) -> Histogram:
+        metric = Histogram(self, name, description, labels)
+        self.families.append(metric)
+        return metric
+
+    def init_app(self, app):
+        self.values = SharedValues(app.config.get('METRICS_PATH')) if app.config.get('METRICS_SHARED') \
+            else LocalValues()
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+    def _before_request(self):
+        g.request_started = time.perf_counter()
+        g.request_stages = dict.fromkeys(STAGES, 0.0)
+
+    def _after_request(self, response):
+        started = g.get('request_started')
+        if started is not None:
+            endpoint = request.endpoint or 'none'
+            self.requests.observe(time.perf_counter() - started, endpoint, request.method)
+            for stage, seconds in g.request_stages.items():
+                self.stages.observe(seconds, endpoint, stage)
+            self.responses.inc(endpoint, str(response.status_code))
+        return response
+
+    def render(self) -> str:
+        """
+        The values of all workers in the prometheus text format
+        """
+        samples = {}
+        for key, value in self.values.collect().items():
+            name, suffix, values = json.loads(key)
+            samples.setdefault(name, {})[(suffix, tuple(values))] = value
+        lines = []
+        for metric in self.families:
+            lines.append(f'# HELP {metric.name} {metric.description}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            values = samples.get(metric.name, {})
+            if metric.kind == 'counter':
+                for (_, labels), value in sorted(values.items()):
+                    lines.append(_sample(metric.name, metric.labels, labels, value))
+                continue
+            for labels in sorted({labels for suffix, labels in values if suffix == 'count'}):
+                cumulative = 0.0
+                for bound in metric.buckets:
+                    cumulative += values.get(('bucket', labels + (repr(bound),)), 0.0)
+                    lines.append(_sample(f'{metric.name}_bucket', metric.labels + ('le',),
+                                         labels + (repr(bound),), cumulative))
+                lines.append(_sample(f'{metric.name}_bucket', metric.labels + ('le',), labels + ('+Inf',),
+                                     values[('count', labels)]))
+                lines.append(_sample(f'{metric.name}_sum', metric.labels, labels, values.get(('sum', labels), 0.0)))
+                lines.append(_sample(f'{metric.name}_count', metric.labels, labels, values[('count', labels)]))
+        return '\n'.join(lines) + '\n'
+
+
+def _sample(name: str, labels: Tuple[str, ...], values: tuple, value: float) -> str:
+    if labels:
+        escaped = (str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for v in values)
+        name += '{' + ','.join(f'{label}="{v}"' for label, v in zip(labels, escaped)) + '}'
+    return f'{name} {value!r}'
+
+
+class timed:
+    """
+    Context manager, which adds the time spent in the block to a stage of the current request
+    """
+    __slots__ = ['stage', 'started']
+
+    def __init__(self, stage: str) -> "timed":
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        add_stage_time(self.stage, time.perf_counter() - self.started)
+
+
+def add_stage_time(stage: str, seconds: float):
+    # the stack instead of flask.g, the proxy would cost more than most of the timed blocks
+    context = _app_ctx_stack.top
+    stages = getattr(context.g, 'request_stages', None) if context is not None else None
+    if stages is not None:
+        stages[stage] += seconds
+
+
+metrics = Metrics()
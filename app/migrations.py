@@ -0,0 +1,122 @@
+from datetime import datetime
+import click
+from sqlalchemy import MetaData, Table, Column, Integer, String, DateTime, inspect, select, func
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import DBAPIError
+from typing import Callable, List, NamedTuple
+
+from app.utils import db
+
+# the applied migrations, kept out of the metadata of the models so create_all doesn't depend on it
+metadata = MetaData()
+schema_version = Table(
+    'schema_version', metadata,
+    Column('version', Integer, primary_key=True, autoincrement=False),
+    Column('description', String(128), nullable=False),
+    Column('applied', DateTime, nullable=False),
+    mysql_character_set='utf8mb4'
+)
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    upgrade: Callable[[Connection], None]
+
+
+MIGRATIONS: List[Migration] = []
+
+
+def migration(version: int, description: str) -> Callable:
+    def decorator(upgrade: Callable) -> Callable:
+        MIGRATIONS.append(Migration(version, description, upgrade))
+        return upgrade
+    return decorator
+
+
+@migration(1, 'Password policy, token generation and user count columns')
+def add_counter_columns(connection: Connection):
+    """
+    The columns added since the first release, databases created by create_all may already have them
+    """
+    inspector = inspect(connection)
+    quote = connection.dialect.identifier_preparer.quote
+    user, role = db.Model.metadata.tables['user'], db.Model.metadata.tables['role']
+    for table, column, definition in [(user, 'passwordPolicy', 'INTEGER NULL'),
+                                      (user, 'tokenGeneration', 'INTEGER NOT NULL DEFAULT 0'),
+                                      (role, 'userCount', 'INTEGER NOT NULL DEFAULT 0')]:
+        if column not in {c['name'] for c in inspector.get_columns(table.name)}:
+            connection.execute(f'ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column)} {definition}')
+    if 'ix_user_role' not in {index['name'] for index in inspector.get_indexes('user')}:
+        next(index for index in user.indexes if index.name == 'ix_user_role').create(connection)
+    count = select([func.count(user.c.id)]).where(user.c.role == role.c.id).as_scalar()
+    connection.execute(role.update().values(userCount=count))
+
+
+LATEST_VERSION = max(m.version for m in MIGRATIONS)
+
+
+def current_version(connection: Connection) -> int:
+    """
+    The version of the schema, a single query if the database is up to date
+    """
+    try:
+        return connection.execute(select([func.max(schema_version.c.version)])).scalar() or 0
+    except DBAPIError:
+        # databases created before the migrations have no version table
+        if connection.dialect.has_table(connection, schema_version.name):
+            raise
+        return 0
+
+
+def pending_migrations(engine: Engine) -> List[Migration]:
+    with engine.connect() as connection:
+        version = current_version(connection)
+    return [m for m in sorted(MIGRATIONS) if m.version > version]
+
+
+def upgrade(engine: Engine) -> List[Migration]:
+    """
+    Apply the pending migrations, each in its own transaction. An empty database gets the
+    tables of the models and is stamped with the latest version.
+    """
+    with engine.begin() as connection:
+        if not connection.dialect.has_table(connection, 'user'):
+            db.Model.metadata.create_all(connection)
+            metadata.create_all(connection)
+            connection.execute(schema_version.insert(), [
+                {'version': m.version, 'description': m.description, 'applied': datetime.utcnow()}
+                for m in MIGRATIONS
+            ])
+            return sorted(MIGRATIONS)
+        metadata.create_all(connection)
+    applied = []
+    for m in pending_migrations(engine):
+        # mysql commits ddl statements implicitly, so each migration has to be repeatable
+        with engine.begin() as connection:
+            m.upgrade(connection)
+            connection.execute(schema_version.insert(), version=m.version,
+                               description=m.description, applied=datetime.utcnow())
+        applied.append(m)
+    return applied
+
+
+def check_schema(app) -> int:
+    """
+    Compare the schema with the migrations when a worker starts. Pending migrations are applied
+    if SCHEMA_AUTO_MIGRATE is set, otherwise the worker refuses to start until `flask db upgrade` is run.
+    """
+    engine = db.get_engine(app)
+    with engine.connect() as connection:
+        version = current_version(connection)
+    if version >= LATEST_VERSION:
+        return version
+    if app.config.get('SCHEMA_AUTO_MIGRATE'):
+        upgrade(engine)
+        return LATEST_VERSION
+    message = f'The database schema is at version {version} of {LATEST_VERSION}, run `flask db upgrade`'
+    # the cli has to load the app to run the migrations
+    if click.get_current_context(silent=True) is not None:
+        app.logger.warning(message)
+        return version
+    raise RuntimeError(message)
@@ -0,0 +1,129 @@
+from contextlib import contextmanager
+from flask import current_app, g, request
+from sqlalchemy import event
+from typing import Dict, Iterator, List
+import re
+import threading
+import time
+
+from app.metrics import add_stage_time
+from app.utils import db
+
+PLACEHOLDER = r'(?:\?|%s|%\(\w+\)s|:\w+)'
+# expanded in lists of parameters have another length for each number of values
+PLACEHOLDER_LIST = re.compile(rf'\(\s*{PLACEHOLDER}(?:\s*,\s*{PLACEHOLDER})*\s*\)')
+
+
+def statement_shape(statement: str) -> str:
+    """
+    The statement without the differences of queries which are issued in a loop
+    """
+    return PLACEHOLDER_LIST.sub('(...)', ' '.join(statement.split()))
+
+
+class QueryRecorder:
+    """
+    Statements executed in this thread while the recorder is active,
+    without `statements` only their number and duration are recorded
+    """
+    def __init__(self, statements: bool = True) -> "QueryRecorder":
+        self.count = 0
+        self.duration = 0.0
+        self.statements: Dict[str, int] = {} if statements else None
+
+    def record(self, statement: str, duration: float):
+        self.count += 1
+        self.duration += duration
+        if self.statements is not None:
+            self.statements[statement] = self.statements.get(statement, 0) + 1
+
+    def repeated(self, threshold: int) -> Dict[str, int]:
+        """
+        The shapes of the statements which have been executed more than `threshold` times
+        """
+        shapes = {}
+        for statement, count in (self.statements or {}).items():
+            shape = statement_shape(statement)
+            shapes[shape] = shapes.get(shape, 0) + count
+        return {shape: count for shape, count in shapes.items() if count > threshold}
+
+
+_local = threading.local()
+
+
+def _recorders() -> List[QueryRecorder]:
+    recorders = getattr(_local, 'recorders', None)
+    if recorders is None:
+        recorders = _local.recorders = []
+    return recorders
+
+
+@contextmanager
+def record_queries() -> Iterator[QueryRecorder]:
+    """
+    Record the statements of the block, e.g. to check the number of queries of a request in a test
+    """
+    recorder = QueryRecorder()
+    _recorders().append(recorder)
+    try:
+        yield recorder
+    finally:
+        _recorders().remove(recorder)
+
+
+class QueryCounter:
+    """
+    Counts the statements and the database time of each request. The numbers are sent as X-Query-Count
+    and X-Query-Time (ms) headers with QUERY_HEADERS, statements which are repeated more than
+    QUERY_REPEAT_THRESHOLD times in a request (e.g. lazy loading in a loop) are logged.
+    """
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        with app.app_context():
+            engine = db.get_engine(app)
+        if not event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+            event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+    def _before_request(self):
+        # the statements of bulk imports and exports aren't kept, unless repeated statements are logged
+        g.queries = QueryRecorder(statements=bool(current_app.config.get('QUERY_REPEAT_THRESHOLD')))
+        _recorders().append(g.queries)
+
+    def _after_request(self, response):
+        recorder = g.get('queries')
+        if recorder is None:
+            return response
+        if current_app.config.get('QUERY_HEADERS'):
+            response.headers['X-Query-Count'] = str(recorder.count)
+            response.headers['X-Query-Time'] = f'{recorder.duration * 1000:.3f}'
+        threshold = current_app.config.get('QUERY_REPEAT_THRESHOLD')
+        if threshold:
+            for shape, count in recorder.repeated(threshold).items():
+                current_app.logger.warning(
+                    f'{request.method} {request.path} executed a statement {count} times, '
+                    f'load the rows with one query instead: {shape}'
+                )
+        return response
+
+    def _teardown_request(self, exception):
+        recorder = g.pop('queries', None)
+        if recorder is not None and recorder in _recorders():
+            _recorders().remove(recorder)
+
+
+def _before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    # kept with the statement, after_cursor_execute isn't called if the statement fails
+    context._query_started = time.perf_counter()
+
+
+def _after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - context._query_started
+    add_stage_time('db', duration)
+    for recorder in _recorders():
+        recorder.record(statement, duration)
+
+
+query_counter = QueryCounter()
@@ -0,0 +1,127 @@
+from typing import Iterable, List, Tuple
+import threading
+import time
+
+
+class RedisClient:
+    """
+    Redis connection with an explicit connection pool and timeouts,
+    which records the latency and the errors of all commands.
+    The redis package is only imported if redis is used.
+    """
+    def __init__(self, client=None) -> "RedisClient":
+        self.client = client
+        self.batch_size = 1000
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def init_app(self, app):
+        import redis
+        pool = redis.BlockingConnectionPool.from_url(
+            app.config.get('REDIS_URL'),
+            max_connections=app.config.get('REDIS_MAX_CONNECTIONS', 16),
+            timeout=app.config.get('REDIS_POOL_TIMEOUT', 1),
+            socket_timeout=app.config.get('REDIS_SOCKET_TIMEOUT', 0.5),
+            socket_connect_timeout=app.config.get('REDIS_CONNECT_TIMEOUT', 0.5),
+            health_check_interval=app.config.get('REDIS_HEALTH_CHECK_INTERVAL', 30)
+        )
+        self.client = redis.Redis(connection_pool=pool)
+        self.batch_size = app.config.get('REDIS_BATCH_SIZE', 1000)
+
+    def reset_stats(self):
+        self.calls = 0  # round trips
+        self.commands = 0
+        self.batches = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def _record(self, latency: float, commands: int = 1, batch: bool = False, error: Exception = None):
+        with self._lock:
+            self.calls += 1
+            self.commands += commands
+            self.batches += batch
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+            if error is not None:
+                import redis
+                if isinstance(error, redis.exceptions.TimeoutError):
+                    self.timeouts += 1
+                else:
+                    self.errors += 1
+
+    def execute(self, command: str, *args: list, **kwargs: dict):
+        """
+        Execute a single command, e.g. execute('exists', key)
+        """
+        start = time.perf_counter()
+        try:
+            result = getattr(self.client, command)(*args, **kwargs)
+        except Exception as e:
+            self._record(time.perf_counter() - start, error=e)
+            raise
+        self._record(time.perf_counter() - start)
+        return result
+
+    def batch(self, commands: Iterable[Tuple]) -> List:
+        """
+        Execute (command, *args) tuples in pipelines of at most `batch_size` commands,
+        the results are returned in the same order
+        """
+        results = []
+        pipeline = self.client.pipeline(transaction=False)
+        queued = 0
+        for command, *args in commands:
+            getattr(pipeline, command)(*args)
+            queued += 1
+            if queued >= self.batch_size:
+                results.extend(self._execute_pipeline(pipeline, queued))
+                queued = 0
+        if queued:
+            results.extend(self._execute_pipeline(pipeline, queued))
+        return results
+
+    def _execute_pipeline(self, pipeline, commands: int) -> List:
+        start = time.perf_counter()
+        try:
+            results = pipeline.execute()
+        except Exception as e:
+            self._record(time.perf_counter() - start, commands, batch=True, error=e)
+            raise
+        finally:
+            pipeline.reset()
+        self._record(time.perf_counter() - start, commands, batch=True)
+        return results
+
+    def scan_iter(self, match: str, count: int = 1000) -> Iterable:
+        cursor = 0
+        while True:
+            cursor, keys = self.execute('scan', cursor, match=match, count=count)
+            yield from keys
+            if not cursor:
+                break
+
+    def __getattr__(self, name: str):
+        # every other redis command is executed and measured by execute
+        if name.startswith('_') or self.__dict__.get('client') is None:
+            raise AttributeError(name)
+        return lambda *args, **kwargs: self.execute(name, *args, **kwargs)
+
+    def stats(self) -> dict:
+        stats = {
+            'calls': self.calls,
+            'commands': self.commands,
+            'batches': self.batches,
+            'errors': self.errors,
+            'timeouts': self.timeouts,
+            'latencyAvg': self.latency_total / self.calls if self.calls else 0.0,
+            'latencyMax': self.latency_max
+        }
+        max_connections = getattr(getattr(self.client, 'connection_pool', None), 'max_connections', None)
+        if isinstance(max_connections, int):
+            stats['maxConnections'] = max_connections
+        return stats
+
+
+redis_client = RedisClient()
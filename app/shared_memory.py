@@ -0,0 +1,55 @@
+from contextlib import contextmanager
+import fcntl
+import mmap
+import os
+import tempfile
+import threading
+
+
+class SharedMemoryFile:
+    """
+    Memory mapped file, which is shared by all workers on this host (e.g. the hash table of a blacklist).
+    The file lock excludes the other workers, the thread lock the other threads of this worker.
+    """
+    def __init__(self, name: str) -> "SharedMemoryFile":
+        # file in /dev/shm (or the temporary directory) if no path is configured
+        self.name = name
+        self.mmap = None
+        self._lock = threading.Lock()
+        self._pid = None
+        self._file = None
+
+    @contextmanager
+    def locked(self, path: str, size: int, header: bytes, identity: bytes = None, operation: int = fcntl.LOCK_EX):
+        """
+        Lock the file, which is created with `size` bytes starting with `header` if it doesn't
+        start with `identity` (by default the header), e.g. after the capacity has been changed
+        """
+        with self._lock:
+            self._open(path, size, header, header if identity is None else identity)
+            fcntl.flock(self._file, operation)
+            try:
+                yield self.mmap
+            finally:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+
+    def _open(self, path: str, size: int, header: bytes, identity: bytes):
+        # each process needs its own file description, otherwise flock doesn't exclude the other workers
+        if self._pid == os.getpid():
+            return
+        path = path or os.path.join('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), self.name)
+        self._file = os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT, 0o600), 'r+b')
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+        try:
+            self._file.seek(0)
+            if self._file.read(len(identity)) != identity:
+                # create a new (empty) file
+                self._file.truncate(0)
+                self._file.truncate(size)
+                self._file.seek(0)
+                self._file.write(header)
+                self._file.flush()
+            self.mmap = mmap.mmap(self._file.fileno(), size)
+        finally:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._pid = os.getpid()
@@ -0,0 +1,95 @@
+from typing import List, Tuple
+import json
+import os
+import re
+import sys
+import time
+
+# the app package imports this module first, so the import of all other modules is measured
+STARTED = time.perf_counter()
+_import_time = None
+
+
+def imported():
+    """
+    Called by the app package once all of its modules are imported
+    """
+    global _import_time
+    if _import_time is None:
+        _import_time = time.perf_counter() - STARTED
+
+
+class StartupReport:
+    """
+    Durations of the phases of a worker start, from the import of the app until it can serve requests
+    """
+    def __init__(self) -> "StartupReport":
+        self.phases: List[Tuple[str, float]] = [('import', _import_time or 0.0)]
+        self._last = time.perf_counter()
+
+    def mark(self, phase: str):
+        """
+        End the current phase, it started with the previous mark
+        """
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    @property
+    def total(self) -> float:
+        return sum(duration for _, duration in self.phases)
+
+    def log(self, app):
+        summary = ', '.join(f'{phase} {duration * 1000:.0f} ms' for phase, duration in self.phases)
+        app.logger.info(f'Started in {self.total * 1000:.0f} ms ({summary})')
+        budget = app.config.get('STARTUP_BUDGET')
+        if budget and self.total > budget:
+            app.logger.warning(f'Start took {self.total * 1000:.0f} ms, the budget is {budget * 1000:.0f} ms')
+
+    def stats(self) -> dict:
+        return {
+            'total': self.total,
+            'phases': dict(self.phases),
+            'modules': len(sys.modules)
+        }
+
+
+# creates the app like a worker in a fresh interpreter, the report is written to stdout
+MEASURE_SCRIPT = """
+import json, time
+started = time.perf_counter()
+from app import create_app
+app = create_app()
+print(json.dumps(dict(app.extensions['startup'].stats(), process=time.perf_counter() - started)))
+"""
+
+IMPORT_TIME = re.compile(r'^import time:\s+(\d+) \|\s+\d+ \|\s+(\S+)$')
+
+
+def measure(python: str = sys.executable, imports: bool = False) -> dict:
+    """
+    Cold start of the app in a new process, `wall` includes the start of the interpreter.
+    If `imports` is set, the import time of each top level package is reported (python -X importtime).
+    """
+    import subprocess
+    start = time.perf_counter()
+    args = [python] + (['-X', 'importtime'] if imports else []) + ['-c', MEASURE_SCRIPT]
+    result = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        # the exception of the traceback, sqlalchemy appends a line with a link
+        errors = [line for line in result.stderr.splitlines() if line and not line.startswith((' ', '('))]
+        raise RuntimeError(errors[-1] if errors else 'Start failed')
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    report['wall'] = wall
+    if imports:
+        packages = {}
+        for line in result.stderr.splitlines():
+            match = IMPORT_TIME.match(line)
+            if match:
+                # self time, so nested imports are counted for their own package
+                package = match.group(2).split('.')[0]
+                packages[package] = packages.get(package, 0.0) + int(match.group(1)) / 1e6
+        report['imports'] = dict(sorted(packages.items(), key=lambda item: item[1], reverse=True))
+    return report
@@ -0,0 +1,269 @@
+from collections import OrderedDict
+from hashlib import sha1, sha256
+from typing import List, Tuple
+import asyncio
+import mmap
+import struct
+import threading
+import time
+
+from .redis_client import RedisClient, redis_client
+from .shared_memory import SharedMemoryFile
+
+# key, capacity of the bucket, tokens added per second
+Limit = Tuple[str, int, float]
+
+
+def key_digest(key: str) -> bytes:
+    return sha256(key.encode('utf-8')).digest()[:16]
+
+
+def refill(tokens: float, updated: float, capacity: int, rate: float, now: float) -> float:
+    return min(capacity, tokens + max(0.0, now - updated) * rate)
+
+
+class Throttle:
+    """
+    Token buckets, a request takes one token of each of its buckets and is rejected
+    if one of them is empty. Rejected requests don't take any token.
+    """
+    def __init__(self) -> "Throttle":
+        self.allowed = 0
+        self.throttled = 0
+        self.errors = 0
+        self._counter_lock = threading.Lock()
+
+    def init_app(self, app):
+        pass
+
+    def acquire(self, limits: List[Limit]) -> float:
+        """
+        Take a token of each bucket, returns 0 if the request is allowed,
+        otherwise the seconds until it would be allowed
+        """
+        if not limits:
+            return 0.0
+        retry_after = self._acquire(limits, time.time())
+        self._count(retry_after)
+        return retry_after
+
+    async def acquire_async(self, limits: List[Limit]) -> float:
+        return self.acquire(limits)
+
+    def init_async(self, client):
+        """
+        Use an asyncio redis client in acquire_async, throttles in memory don't need one
+        """
+
+    def _acquire(self, limits: List[Limit], now: float) -> float:
+        raise NotImplementedError()
+
+    def _count(self, retry_after: float):
+        with self._counter_lock:
+            if retry_after > 0:
+                self.throttled += 1
+            else:
+                self.allowed += 1
+
+    def stats(self) -> dict:
+        return {
+            'allowed': self.allowed,
+            'throttled': self.throttled,
+            'errors': self.errors
+        }
+
+
+class LocalThrottle(Throttle):
+    """
+    Buckets of this worker, the least recently used buckets are dropped if there are more than `maxsize`
+    """
+    def __init__(self, maxsize: int = 65536) -> "LocalThrottle":
+        super().__init__()
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.maxsize = app.config.get('THROTTLE_CAPACITY') or self.maxsize
+        with self._lock:
+            self._buckets.clear()
+
+    def _acquire(self, limits: List[Limit], now: float) -> float:
+        with self._lock:
+            tokens = [
+                refill(*self._buckets.get(key, (capacity, now)), capacity, rate, now)
+                for key, capacity, rate in limits
+            ]
+            retry_after = max((1 - available) / rate for available, (_, _, rate) in zip(tokens, limits))
+            if retry_after > 0:
+                return retry_after
+            for available, (key, _, _) in zip(tokens, limits):
+                self._buckets[key] = (available - 1, now)
+                self._buckets.move_to_end(key)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return 0.0
+
+
+class RedisThrottle(Throttle):
+    """
+    Buckets shared by all hosts, checked and updated atomically by a lua script.
+    If redis is not available, requests are allowed.
+    """
+    prefix = 'throttle:'
+    script = """
+        local now = tonumber(ARGV[1])
+        local retry_after = 0
+        local tokens = {}
+        for i, key in ipairs(KEYS) do
+            local capacity, rate = tonumber(ARGV[i * 2]), tonumber(ARGV[i * 2 + 1])
+            local bucket = redis.call('HMGET', key, 'tokens', 'updated')
+            local available = tonumber(bucket[1]) or capacity
+            local updated = tonumber(bucket[2]) or now
+            tokens[i] = math.min(capacity, available + math.max(0, now - updated) * rate)
+            retry_after = math.max(retry_after, (1 - tokens[i]) / rate)
+        end
+        if retry_after > 0 then
+            return tostring(retry_after)
+        end
+        for i, key in ipairs(KEYS) do
+            local capacity, rate = tonumber(ARGV[i * 2]), tonumber(ARGV[i * 2 + 1])
+            redis.call('HMSET', key, 'tokens', tostring(tokens[i] - 1), 'updated', ARGV[1])
+            -- a bucket which is full again is the same as no bucket
+            redis.call('EXPIRE', key, math.ceil(capacity / rate))
+        end
+        return '0'
+    """
+    sha = sha1(script.encode()).hexdigest()
+
+    def __init__(self, client=None) -> "RedisThrottle":
+        super().__init__()
+        # the shared client of the application is used by default
+        if client is None:
+            client = redis_client
+        self.client = client if isinstance(client, RedisClient) else RedisClient(client)
+        self.async_client = None
+
+    def key(self, key: str) -> str:
+        return self.prefix + key_digest(key).hex()
+
+    def _arguments(self, limits: List[Limit], now: float) -> list:
+        args = [len(limits)] + [self.key(key) for key, _, _ in limits] + [repr(now)]
+        for _, capacity, rate in limits:
+            args += [capacity, repr(float(rate))]
+        return args
+
+    def _acquire(self, limits: List[Limit], now: float) -> float:
+        import redis
+        args = self._arguments(limits, now)
+        try:
+            try:
+                result = self.client.execute('evalsha', self.sha, *args)
+            except redis.exceptions.NoScriptError:
+                result = self.client.execute('eval', self.script, *args)
+        except redis.exceptions.RedisError:
+            with self._counter_lock:
+                self.errors += 1
+            return 0.0
+        return float(result)
+
+    def init_async(self, client):
+        self.async_client = client
+
+    async def acquire_async(self, limits: List[Limit]) -> float:
+        if not limits:
+            return 0.0
+        if self.async_client is None:
+            # without redis.asyncio the synchronous client mustn't block the event loop
+            return await asyncio.get_event_loop().run_in_executor(None, self.acquire, limits)
+        import redis
+        args = self._arguments(limits, time.time())
+        try:
+            try:
+                result = await self.async_client.evalsha(self.sha, *args)
+            except redis.exceptions.NoScriptError:
+                result = await self.async_client.eval(self.script, *args)
+        except redis.exceptions.RedisError:
+            with self._counter_lock:
+                self.errors += 1
+            return 0.0
+        retry_after = float(result)
+        self._count(retry_after)
+        return retry_after
+
+
+class SharedMemoryThrottle(Throttle):
+    """
+    Buckets in a memory mapped file, which is shared by all workers on this host.
+    Each key has a few slots it may be stored in, if all of them are taken the bucket
+    which has been updated first is replaced.
+    """
+    magic = b'PFLT'
+    header = struct.Struct('<4sI')  # magic, number of slots
+    slot = struct.Struct('<16sdd')  # digest, tokens, last update (0 = empty)
+    probes = 8
+
+    def __init__(self, path: str = None, capacity: int = 65536) -> "SharedMemoryThrottle":
+        super().__init__()
+        self.path = path
+        self.capacity = capacity
+        self.evicted = 0
+        self._memory = SharedMemoryFile('pythonflasklogin-throttle')
+
+    def init_app(self, app):
+        self.path = app.config.get('THROTTLE_PATH') or self.path
+        self.capacity = app.config.get('THROTTLE_CAPACITY') or self.capacity
+
+    @property
+    def slots(self) -> int:
+        return 1 << (self.capacity - 1).bit_length()
+
+    def _acquire(self, limits: List[Limit], now: float) -> float:
+        digests = [key_digest(key) for key, _, _ in limits]
+        with self._locked():
+            indices = [self._find(digest) for digest in digests]
+            tokens = []
+            for index, digest, (_, capacity, rate) in zip(indices, digests, limits):
+                stored, available, updated = self.slot.unpack_from(self._mmap, self._slot_offset(index))
+                if stored != digest or not updated:
+                    available, updated = capacity, now
+                tokens.append(refill(available, updated, capacity, rate, now))
+            retry_after = max((1 - available) / rate for available, (_, _, rate) in zip(tokens, limits))
+            if retry_after > 0:
+                return retry_after
+            for index, digest, available in zip(indices, digests, tokens):
+                stored, _, updated = self.slot.unpack_from(self._mmap, self._slot_offset(index))
+                if stored != digest and updated:
+                    self.evicted += 1
+                self.slot.pack_into(self._mmap, self._slot_offset(index), digest, available - 1, now)
+        return 0.0
+
+    def _find(self, digest: bytes) -> int:
+        """
+        The slot of the digest, an empty slot or the slot updated first
+        """
+        mask = self.slots - 1
+        start = int.from_bytes(digest[:8], 'little')
+        candidate, oldest = None, None
+        for i in range(self.probes):
+            index = (start + i) & mask
+            stored, _, updated = self.slot.unpack_from(self._mmap, self._slot_offset(index))
+            if stored == digest and updated:
+                return index
+            if oldest is None or updated < oldest:
+                candidate, oldest = index, updated
+        return candidate
+
+    def stats(self) -> dict:
+        return dict(super().stats(), capacity=self.slots, evicted=self.evicted)
+
+    def _locked(self):
+        size = self.header.size + self.slots * self.slot.size
+        return self._memory.locked(self.path, size, self.header.pack(self.magic, self.slots))
+
+    @property
+    def _mmap(self) -> mmap.mmap:
+        return self._memory.mmap
+
+    def _slot_offset(self, index: int) -> int:
+        return self.header.size + index * self.slot.size
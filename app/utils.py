@@ -1,27 +1,100 @@
-from flask_redis import FlaskRedis
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+import os
+import threading
+import time
+import weakref
 
-db = SQLAlchemy()
 
+class TimedQueuePool(QueuePool):
+    """
+    QueuePool, which records how long requests waited for a connection
+    and how often the pool had to overflow
+    """
+    def __init__(self, *args: list, **kwargs: dict) -> "TimedQueuePool":
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.overflows = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
 
-class RedisBlacklist:
-    def __init__(self) -> "RedisBlacklist":
-        self.blacklist = FlaskRedis()
+    def _do_get(self):
+        overflow = self.overflow()
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self._record(time.perf_counter() - start, timeout=True)
+            raise
+        self._record(time.perf_counter() - start, overflow=self.overflow() > max(0, overflow))
+        return connection
 
-    def add(self, token: str):
-        self.blacklist.sadd('blacklist', token)
-        pass
+    def _record(self, wait: float, overflow: bool = False, timeout: bool = False):
+        with self._stats_lock:
+            if timeout:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.overflows += overflow
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
 
-    def check(self, token: str) -> bool:
-        return self.blacklist.smembers(token)
+    def stats(self) -> dict:
+        requests = self.checkouts + self.timeouts
+        return {
+            'size': self.size(),
+            'checkedIn': self.checkedin(),
+            'checkedOut': self.checkedout(),
+            'overflow': max(0, self.overflow()),
+            'maxOverflow': self._max_overflow,
+            'checkouts': self.checkouts,
+            'overflows': self.overflows,
+            'timeouts': self.timeouts,
+            'waitTimeAvg': self.wait_total / requests if requests else 0.0,
+            'waitTimeMax': self.wait_max
+        }
 
 
-class SetBlacklist:
-    def __init__(self):
-        self.blacklist = set()
+class PooledSQLAlchemy(SQLAlchemy):
+    """
+    Adds SQLALCHEMY_POOL_WARMUP and pool statistics to flask_sqlalchemy,
+    the pool is configured by SQLALCHEMY_ENGINE_OPTIONS
+    """
+    def __init__(self, *args: list, **kwargs: dict) -> "PooledSQLAlchemy":
+        super().__init__(*args, **kwargs)
+        self._apps = weakref.WeakSet()
+        # connections must not be shared with the parent process (e.g. gunicorn --preload)
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self.dispose_engines)
 
-    def add(self, token: str):
-        self.blacklist.add(token)
+    def init_app(self, app):
+        super().init_app(app)
+        self._apps.add(app)
 
-    def check(self, token: str) -> bool:
-        return token in self.blacklist
+    def dispose_engines(self):
+        for app in list(self._apps):
+            for connector in app.extensions['sqlalchemy'].connectors.values():
+                if connector._engine is not None:
+                    connector._engine.dispose()
+
+    def warmup(self, app):
+        """
+        Open SQLALCHEMY_POOL_WARMUP connections, so the first requests don't have to connect
+        """
+        with app.app_context():
+            engine = self.get_engine(app)
+            connections = [engine.connect() for _ in range(app.config.get('SQLALCHEMY_POOL_WARMUP') or 0)]
+            for connection in connections:
+                connection.close()
+
+    def pool_stats(self, app) -> dict:
+        pool = self.get_engine(app).pool
+        if isinstance(pool, TimedQueuePool):
+            return pool.stats()
+        return {'status': pool.status()}
+
+
+db = PooledSQLAlchemy()
@@ -0,0 +1,4 @@
+"""
+Load tests of a running deployment, e.g. python -m benchmarks.asgi --help,
+and offline benchmarks of the hot path with a baseline, e.g. python -m benchmarks.suite --help
+"""
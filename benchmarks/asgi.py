@@ -0,0 +1,105 @@
+"""
+Compare the gunicorn sync workers with the asgi mode, both deployments are started with the same
+number of worker processes, so the requests per second are comparable per core:
+
+    gunicorn --workers 2 --bind 127.0.0.1:8000 wsgi:application
+    uvicorn --workers 2 --port 8001 asgi:application
+
+    python -m benchmarks.asgi --token $TOKEN --workers 2 http://127.0.0.1:8000 http://127.0.0.1:8001
+"""
+from urllib.parse import urlsplit
+from typing import List
+import argparse
+import asyncio
+import json
+import time
+
+
+async def request(host: str, port: int, method: str, path: str, headers: dict, body: bytes = b'') -> int:
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        head = f'{method} {path} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\nContent-Length: {len(body)}\r\n'
+        head += ''.join(f'{key}: {value}\r\n' for key, value in headers.items())
+        writer.write(head.encode() + b'\r\n' + body)
+        await writer.drain()
+        status = int((await reader.readline()).split()[1])
+        await reader.read()
+        return status
+    finally:
+        writer.close()
+
+
+async def run(url: str, method: str, headers: dict, body: bytes, concurrency: int, duration: float) -> dict:
+    """
+    Send requests from `concurrency` connections for `duration` seconds
+    """
+    parts = urlsplit(url)
+    path = parts.path + ('?' + parts.query if parts.query else '')
+    latencies = []
+    errors = 0
+    end = time.perf_counter() + duration
+
+    async def client():
+        nonlocal errors
+        while time.perf_counter() < end:
+            start = time.perf_counter()
+            try:
+                status = await request(parts.hostname, parts.port or 80, method, path, headers, body)
+            except OSError:
+                status = None
+            if status is None or status >= 500:
+                errors += 1
+            else:
+                latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': errors,
+        'requestsPerSecond': len(latencies) / elapsed,
+        'p50': percentile(latencies, 0.5),
+        'p99': percentile(latencies, 0.99)
+    }
+
+
+def percentile(values: List[float], q: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+
+def main(args: List[str] = None):
+    parser = argparse.ArgumentParser(description='Requests per second and latency of deployments')
+    parser.add_argument('urls', nargs='+', help='base urls of the deployments, e.g. http://127.0.0.1:8000')
+    parser.add_argument('--path', default='/api/users?limit=20')
+    parser.add_argument('--token', help='access token sent as bearer token')
+    parser.add_argument('--login', help='username:password, benchmark POST /api/auth instead')
+    parser.add_argument('--concurrency', default='1,8,32,128')
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--workers', type=int, default=1, help='worker processes of each deployment')
+    args = parser.parse_args(args)
+
+    method, path, body, headers = 'GET', args.path, b'', {}
+    if args.token:
+        headers['Authorization'] = f'Bearer {args.token}'
+    if args.login:
+        username, password = args.login.split(':', 1)
+        method, path = 'POST', '/api/auth'
+        body = json.dumps({'username': username, 'password': password}).encode()
+        headers['Content-Type'] = 'application/json'
+
+    print(f'{"url":40} {"conc":>5} {"req/s":>9} {"req/s/worker":>13} {"p50 ms":>8} {"p99 ms":>8} {"errors":>7}')
+    for url in args.urls:
+        for concurrency in map(int, args.concurrency.split(',')):
+            result = asyncio.get_event_loop().run_until_complete(
+                run(url.rstrip('/') + path, method, headers, body, concurrency, args.duration)
+            )
+            print(f'{url:40} {concurrency:5d} {result["requestsPerSecond"]:9.1f} '
+                  f'{result["requestsPerSecond"] / args.workers:13.1f} {result["p50"] * 1000:8.1f} '
+                  f'{result["p99"] * 1000:8.1f} {result["errors"]:7d}')
+
+
+if __name__ == '__main__':
+    main()
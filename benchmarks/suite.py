@@ -0,0 +1,233 @@
+"""
+Micro benchmarks of the authentication hot path, the components (password hashing, jwt, validation,
+serialization, qr codes) and the endpoints through the test client. Runs offline with an in-memory
+sqlite database and the production hash policy:
+
+    python -m benchmarks.suite --output baseline.json
+    python -m benchmarks.suite --baseline baseline.json --output current.json
+
+With a baseline, benchmarks which got slower by more than --threshold are reported and the exit code is 1.
+"""
+from base64 import b32encode
+from datetime import datetime
+from typing import Callable, Dict, List, Tuple
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import timeit
+
+from app import create_app
+from app.api import Role, User
+from app.api.authentication.schemas import AuthSchema, auth_schema
+from app.api.authentication.tokens import create_access_token, create_refresh_token, decode_token, _decode
+from app.api.schemas import ResultSchema
+from app.api.totp.qr import render
+from app.api.user.schemas import create_user_schema
+from app.config import Config, TestingConfig
+from app.encoder import fast_json
+from app.utils import db
+
+PASSWORD = 'password_for_benchmarks'
+
+
+class BenchmarkConfig(TestingConfig):
+    HASH_METHOD = Config.HASH_METHOD  # the cost of the production policy
+    HASH_WORKERS = 0  # hashed inline, the pool would only add the overhead of the processes
+    LOGIN_THROTTLE_USERNAME = None
+    LOGIN_THROTTLE_CLIENT = None
+    REFRESH_THROTTLE_CLIENT = None
+
+
+class Fixture:
+    """
+    An app with an admin, a user in the 2fa setup and `users` further users
+    """
+    def __init__(self, users: int = 100) -> "Fixture":
+        self.app = create_app(BenchmarkConfig)
+        self.client = self.app.test_client()
+        with self.app.app_context():
+            admin, user = Role(name='admin', description='Admin'), Role(name='user', description='User')
+            self.admin = User(username='admin', email='admin@example.com', password=PASSWORD, role=admin)
+            # the others share the hash, there is no need to hash the same password a hundred times
+            pwhash = self.admin._password
+            self.user = User(username='test', email='test@example.com', role=user,
+                             totp_secret=b32encode(os.urandom(10)).decode())
+            self.user._password = pwhash
+            db.session.add_all([admin, user, self.admin, self.user])
+            for i in range(users):
+                other = User(username=f'user{i}', email=f'user{i}@example.com', role=user)
+                other._password = pwhash
+                db.session.add(other)
+            db.session.commit()
+            self.user_guid = self.user.guid
+            self.admin_token = create_access_token(self.admin)
+            self.access_token = create_access_token(self.user)
+            self.refresh_token = create_refresh_token(self.user)
+
+    def headers(self, admin: bool = False) -> dict:
+        return {'Authorization': f'Bearer {self.admin_token if admin else self.access_token}'}
+
+
+def components(fixture: Fixture) -> Dict[str, Callable]:
+    """
+    Functions which are timed inside a request context of the app
+    """
+    user = User.query.filter_by(username='test').first()
+    users = User.query.order_by(User.id).limit(100).all()
+    uri = user.get_totp_uri()
+    login = {'username': 'test', 'password': PASSWORD}
+    create = {'username': 'new', 'email': 'new@example.com', 'password': PASSWORD, 'role': 'user'}
+    return {
+        'password verify': lambda: user.verify_password(PASSWORD),
+        'jwt encode': lambda: create_access_token(user),
+        'jwt decode': lambda: _decode(fixture.access_token),
+        'jwt decode cached': lambda: decode_token(fixture.access_token),
+        'validate login marshmallow': lambda: AuthSchema().load(login),
+        'validate login': lambda: auth_schema.load(login),
+        'validate create user': lambda: create_user_schema.load(create),
+        'user jsonify': user.jsonify,
+        'result jsonify 100 users': lambda: ResultSchema(data=[u.jsonify() for u in users]).jsonify(),
+        'json dumps 100 users': lambda: fast_json.dumps({'data': [u.jsonify() for u in users]}),
+        'qr code render': lambda: render(uri)
+    }
+
+
+def endpoints(fixture: Fixture) -> Dict[str, Callable]:
+    """
+    Requests through the test client, each of them has to succeed
+    """
+    client = fixture.client
+
+    def call(method: str, url: str, status: int = 200, **kwargs: dict) -> Callable:
+        def request():
+            resp = client.open(url, method=method, **kwargs)
+            assert resp.status_code == status, f'{method} {url}: {resp.status_code}'
+        return request
+
+    return {
+        'POST /api/auth': call('POST', '/api/auth', json={'username': 'test', 'password': PASSWORD}),
+        'POST /api/auth invalid payload': call('POST', '/api/auth', 400, json={'username': 'test'}),
+        'POST /api/auth/refresh': call('POST', '/api/auth/refresh', json={'refreshToken': fixture.refresh_token}),
+        'GET /api/auth': call('GET', '/api/auth', headers=fixture.headers()),
+        'GET /api/users': call('GET', '/api/users', headers=fixture.headers(admin=True)),
+        'GET /api/users/<guid>': call('GET', f'/api/users/{fixture.user_guid}', headers=fixture.headers(admin=True)),
+        'GET /api/roles': call('GET', '/api/roles', headers=fixture.headers(admin=True)),
+        'GET /api/users/2fa': call('GET', '/api/users/2fa', headers=fixture.headers()),
+        'GET /api/users/2fa png': call('GET', '/api/users/2fa?format=png', headers=fixture.headers())
+    }
+
+
+def measure(func: Callable, min_time: float, repeat: int) -> dict:
+    """
+    Seconds per call, the number of calls per run is chosen so a run takes at least `min_time`
+    """
+    timer = timeit.Timer(func)
+    # warm up caches and connections
+    timer.timeit(1)
+    number, elapsed = 1, timer.timeit(1)
+    while elapsed < min_time:
+        number = min(number * 10, max(number + 1, int(number * min_time / max(elapsed, 1e-9) * 1.2)))
+        elapsed = timer.timeit(number)
+    times = [elapsed / number for elapsed in timer.repeat(repeat, number)]
+    return {
+        'median': statistics.median(times),
+        'min': min(times),
+        'stdev': statistics.stdev(times) if len(times) > 1 else 0.0,
+        'number': number,
+        'repeat': repeat
+    }
+
+
+def environment(app) -> dict:
+    return {
+        'date': datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'hashMethod': app.config['HASH_METHOD'],
+        'jsonBackend': fast_json.name
+    }
+
+
+def run(selected: Callable[[str], bool], min_time: float, repeat: int, report: Callable = None) -> dict:
+    fixture = Fixture()
+    results = {}
+
+    def run_all(benchmarks: Dict[str, Callable]):
+        for name, func in benchmarks.items():
+            if selected(name):
+                results[name] = measure(func, min_time, repeat)
+                if report is not None:
+                    report(name, results[name])
+
+    with fixture.app.test_request_context():
+        run_all(components(fixture))
+    run_all(endpoints(fixture))
+    return {'environment': environment(fixture.app), 'benchmarks': results}
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> List[Tuple[str, float, float, str]]:
+    """
+    Name, baseline and current median and the verdict of the benchmarks in both results
+    """
+    rows = []
+    for name, result in results['benchmarks'].items():
+        before = baseline['benchmarks'].get(name)
+        if before is None:
+            continue
+        change = result['median'] / before['median'] - 1
+        verdict = 'regression' if change > threshold else 'improved' if change < -threshold else ''
+        rows.append((name, before['median'], result['median'], verdict))
+    return rows
+
+
+def duration(seconds: float) -> str:
+    if seconds >= 1e-3:
+        return f'{seconds * 1e3:.2f} ms'
+    return f'{seconds * 1e6:.2f} us'
+
+
+def main(args: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmarks of the authentication hot path')
+    parser.add_argument('--output', help='write the results to this json file')
+    parser.add_argument('--baseline', help='compare with the results in this json file')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='relative slowdown of the median reported as regression (default: 0.2)')
+    parser.add_argument('--filter', action='append', default=[], help='only run benchmarks containing this text')
+    parser.add_argument('--min-time', type=float, default=0.2, help='min. seconds of a run (default: 0.2)')
+    parser.add_argument('--repeat', type=int, default=5, help='runs of each benchmark (default: 5)')
+    args = parser.parse_args(args)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    def report(name: str, result: dict):
+        print(f'{name:34} {duration(result["median"]):>12} {duration(result["min"]):>12}  x{result["number"]}')
+
+    print(f'{"benchmark":34} {"median":>12} {"min":>12}')
+    results = run(lambda name: not args.filter or any(text in name for text in args.filter),
+                  args.min_time, args.repeat, report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if baseline is None:
+        return 0
+    for key in ['python', 'hashMethod', 'jsonBackend']:
+        if baseline['environment'].get(key) != results['environment'][key]:
+            print(f'Note: the baseline has been measured with {key} {baseline["environment"].get(key)}')
+    print(f'\n{"benchmark":34} {"baseline":>12} {"current":>12} {"change":>8}')
+    regressions = 0
+    for name, before, after, verdict in compare(results, baseline, args.threshold):
+        regressions += verdict == 'regression'
+        print(f'{name:34} {duration(before):>12} {duration(after):>12} {after / before - 1:+8.1%}  {verdict}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,49 @@
+"""
+Validation cost per request of the marshmallow schemas, instantiated per request as the
+resources used to do, compared with the compiled schemas:
+
+    python -m benchmarks.validation
+"""
+from marshmallow.exceptions import ValidationError
+from typing import List
+import argparse
+import timeit
+
+from app.api.validation import CompiledSchema
+from app.api.authentication.schemas import AuthSchema, TokenRefreshSchema
+from app.api.totp.schemas import DaoTokenSchema
+from app.api.user.schemas import DaoCreateUserSchema, DaoUpdateUserSchema
+
+CASES = [
+    ('login', AuthSchema, {'username': 'test', 'password': 'password_for_test'}),
+    ('login invalid', AuthSchema, {'username': 'with space', 'password': '', 'unknown': 1}),
+    ('refresh', TokenRefreshSchema, {'refreshToken': 'x' * 200}),
+    ('2fa', DaoTokenSchema, {'token': '123456'}),
+    ('create user', DaoCreateUserSchema,
+     {'username': 'test', 'email': 'test@example.com', 'password': 'password_for_test', 'role': 'user'}),
+    ('update user', DaoUpdateUserSchema, {'displayName': 'Test', 'totp_enabled': True})
+]
+
+
+def load(load: callable, data: dict):
+    try:
+        load(data)
+    except ValidationError:
+        pass
+
+
+def main(args: List[str] = None):
+    parser = argparse.ArgumentParser(description='Validation cost per request')
+    parser.add_argument('--number', type=int, default=20000)
+    args = parser.parse_args(args)
+
+    print(f'{"payload":16} {"marshmallow us":>15} {"compiled us":>12} {"speedup":>8}')
+    for name, schema_class, data in CASES:
+        compiled = CompiledSchema(schema_class)
+        before = timeit.timeit(lambda: load(schema_class().load, data), number=args.number) / args.number
+        after = timeit.timeit(lambda: load(compiled.load, data), number=args.number) / args.number
+        print(f'{name:16} {before * 1e6:15.2f} {after * 1e6:12.2f} {before / after:7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
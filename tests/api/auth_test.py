@@ -1,9 +1,11 @@
 from flask import Flask
 import json
+import jwt
 from dateutil import parser
 
 from tests.utils import Utils
 from app.api import require_admin
+from app.blacklist import SetBlacklist
 
 
 def test_authentication(app, client):
@@ -201,3 +203,163 @@ def test_require_admin_without_require_token():
     client = app.test_client()
     resp = client.get('/')
     assert resp.status_code == 500
+
+
+def test_principal_cache(app, client):
+    utils = Utils(app, client)
+    headers = {'Authorization': f'Bearer {utils.generate_access_token()}'}
+
+    for _ in range(3):
+        resp = client.get('/api/auth', headers=headers)
+        assert resp.status_code == 200
+    stats = app.extensions['principals'].stats()
+    assert stats.get('misses') == 1
+    assert stats.get('hits') == 2
+
+
+def test_principal_cache_invalidation(app, client):
+    utils = Utils(app, client)
+    headers = {'Authorization': f'Bearer {utils.generate_access_token()}'}
+
+    resp = client.get('/api/auth', headers=headers)
+    assert json.loads(resp.data.decode()).get('data').get('displayName') == 'test'
+
+    resp = client.put('/api/users/me', headers=headers, json={'displayName': 'changed'})
+    assert resp.status_code == 200
+
+    resp = client.get('/api/auth', headers=headers)
+    assert json.loads(resp.data.decode()).get('data').get('displayName') == 'changed'
+
+    # the role is part of the cached user
+    admin_headers = {'Authorization': f'Bearer {utils.generate_admin_access_token()}'}
+    resp = client.put('/api/roles/user', headers=admin_headers, json={'description': 'changed'})
+    assert resp.status_code == 200
+
+    resp = client.get('/api/auth', headers=headers)
+    assert json.loads(resp.data.decode()).get('data').get('role').get('description') == 'changed'
+
+
+def test_token_claims(app, client):
+    app.config['ACCESS_TOKEN_CLAIMS'] = True
+    utils = Utils(app, client)
+    access_token = utils.generate_admin_access_token()
+
+    claims = jwt.decode(access_token, verify=False)
+    assert claims.get('guid') == utils.get_guid('administrator')
+    assert claims.get('role') == 'admin'
+    assert claims.get('gen') == 0
+
+    # @require_admin decides using the claims, the user is not loaded
+    headers = {'Authorization': f'Bearer {access_token}'}
+    resp = client.get('/api/roles', headers=headers)
+    assert resp.status_code == 200
+    assert app.extensions['principals'].stats().get('misses') == 0
+
+    # views that need the user object load it on demand
+    resp = client.get('/api/auth', headers=headers)
+    assert resp.status_code == 200
+    assert json.loads(resp.data.decode()).get('data').get('username') == 'administrator'
+
+
+def test_token_claims_revoked_after_role_change(app, client):
+    app.config['ACCESS_TOKEN_CLAIMS'] = True
+    utils = Utils(app, client)
+    access_token, refresh_token = utils.generate_access_token(refresh=True)
+    headers = {'Authorization': f'Bearer {access_token}'}
+
+    resp = client.get('/api/auth', headers=headers)
+    assert resp.status_code == 200
+
+    admin_headers = {'Authorization': f'Bearer {utils.generate_admin_access_token()}'}
+    resp = client.put(f'/api/users/{utils.get_guid()}', headers=admin_headers, json={'role': 'admin'})
+    assert resp.status_code == 200
+
+    resp = client.get('/api/auth', headers=headers)
+    assert resp.status_code == 401
+    assert json.loads(resp.data.decode()).get('message') == 'Invalid access token'
+
+    resp = client.post('/api/auth/refresh', json={'refreshToken': refresh_token})
+    assert resp.status_code == 401
+
+    # a new login contains the new role
+    access_token = utils.generate_access_token()
+    assert jwt.decode(access_token, verify=False).get('role') == 'admin'
+
+
+def test_token_cache(app, client):
+    utils = Utils(app, client)
+    access_token = utils.generate_access_token()
+    headers = {'Authorization': f'Bearer {access_token}'}
+    cache = app.extensions['tokens']
+    for _ in range(3):
+        resp = client.get('/api/auth', headers=headers)
+        assert resp.status_code == 200
+    stats = cache.stats()
+    assert stats.get('misses') == 1
+    assert stats.get('hits') == 2
+
+    # tokens signed with a previous key are verified again and rejected
+    app.config['SECRET_KEY'] = 'changed'
+    resp = client.get('/api/auth', headers=headers)
+    assert resp.status_code == 401
+
+
+def test_token_cache_blacklisted_refresh_token(app, client):
+    # tokens created within the same second are equal, don't share the blacklist with other tests
+    app.config['BLACKLIST'] = SetBlacklist()
+    utils = Utils(app, client)
+    _, refresh_token = utils.generate_access_token(refresh=True)
+    resp = client.post('/api/auth/refresh', json={'refreshToken': refresh_token})
+    assert resp.status_code == 200
+    assert len(app.extensions['tokens']) == 1
+
+    resp = client.delete(f'/api/auth/refresh/{refresh_token}')
+    assert resp.status_code == 200
+    assert len(app.extensions['tokens']) == 0
+
+    resp = client.post('/api/auth/refresh', json={'refreshToken': refresh_token})
+    assert resp.status_code == 401
+
+
+def test_login_throttle(app, client):
+    app.config['LOGIN_THROTTLE_USERNAME'] = (3, 0.01)
+    throttled = app.config['THROTTLE'].stats().get('throttled')
+    for _ in range(3):
+        resp = client.post('/api/auth', json={'username': 'Test', 'password': 'invalid'})
+        assert resp.status_code == 401
+    # the password is not verified anymore, even if it's correct
+    resp = client.post('/api/auth', json={'username': 'test', 'password': 'password_for_test'})
+    assert resp.status_code == 429
+    assert int(resp.headers['Retry-After']) == 100
+    # other users are not affected
+    resp = client.post('/api/auth', json={'username': 'other', 'password': 'invalid'})
+    assert resp.status_code == 401
+
+    app.config['LOGIN_THROTTLE_CLIENT'] = (0, 0.01)
+    resp = client.post('/api/auth', json={'username': 'other', 'password': 'invalid'})
+    assert resp.status_code == 429
+
+    assert app.config['THROTTLE'].stats().get('throttled') == throttled + 2
+
+
+def test_refresh_throttle(app, client):
+    app.config['REFRESH_THROTTLE_CLIENT'] = (1, 0.01)
+    resp = client.post('/api/auth/refresh', json={'refreshToken': 'invalid'})
+    assert resp.status_code == 401
+    resp = client.post('/api/auth/refresh', json={'refreshToken': 'invalid'})
+    assert resp.status_code == 429
+
+
+def test_client_throttle_behind_proxy(app, client):
+    app.config['REFRESH_THROTTLE_CLIENT'] = (1, 0.01)
+    app.config['TRUSTED_PROXIES'] = 1
+
+    def refresh(forwarded: str) -> int:
+        return client.post('/api/auth/refresh', json={'refreshToken': 'invalid'},
+                           headers={'X-Forwarded-For': forwarded}).status_code
+    assert refresh('10.0.0.1') == 401
+    assert refresh('10.0.0.1') == 429
+    # other clients behind the same proxy are not affected
+    assert refresh('10.0.0.2') == 401
+    # only the address added by the proxy is trusted
+    assert refresh('10.0.0.3, 10.0.0.1') == 429
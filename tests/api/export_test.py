@@ -0,0 +1,95 @@
+from tests.utils import Utils
+
+from datetime import datetime, timedelta, timezone
+import csv
+import gzip
+import io
+import json
+
+
+def test_export_users_ndjson(app, client):
+    utils = Utils(app, client)
+    app.config['STREAM_BATCH_SIZE'] = 1
+    headers = {'Authorization': f'Bearer {utils.generate_admin_access_token()}'}
+    resp = client.get('/api/export/users', headers=headers)
+    assert resp.status_code == 200
+    assert resp.mimetype == 'application/x-ndjson'
+    assert 'filename=users.ndjson' in resp.headers.get('Content-Disposition')
+    rows = [json.loads(line) for line in resp.data.decode().splitlines()]
+    assert [row.get('username') for row in rows] == ['administrator', 'test']
+    assert rows[0].get('role') == 'admin'
+    assert rows[0].get('2fa') is False
+    assert rows[0].get('lastLogin') is not None
+
+
+def test_export_users_csv(app, client):
+    utils = Utils(app, client)
+    headers = {
+        'Authorization': f'Bearer {utils.generate_admin_access_token()}',
+        'Accept': 'text/csv'
+    }
+    resp = client.get('/api/export/users?role=user', headers=headers)
+    assert resp.status_code == 200
+    assert resp.mimetype == 'text/csv'
+    rows = list(csv.DictReader(io.StringIO(resp.data.decode())))
+    assert [row.get('username') for row in rows] == ['test']
+    assert rows[0].get('role') == 'user'
+    assert rows[0].get('lastLogin') == ''
+
+
+def test_export_users_filtered_by_dates(app, client):
+    utils = Utils(app, client)
+    headers = {'Authorization': f'Bearer {utils.generate_admin_access_token()}'}
+    # only the administrator has been logged in
+    resp = client.get('/api/export/users?lastLoginAfter=2000-01-01', headers=headers)
+    assert [json.loads(line).get('username') for line in resp.data.decode().splitlines()] == ['administrator']
+
+    resp = client.get('/api/export/users?createdBefore=2000-01-01T00:00:00', headers=headers)
+    assert resp.status_code == 200
+    assert resp.data == b''
+
+    resp = client.get('/api/export/users?createdBefore=invalid', headers=headers)
+    assert resp.status_code == 400
+
+
+def test_export_users_filtered_by_dates_with_offset(app, client):
+    utils = Utils(app, client)
+    headers = {'Authorization': f'Bearer {utils.generate_admin_access_token()}'}
+    # an hour after the users have been created, the local time of the offset is before
+    after = (datetime.now(timezone.utc) + timedelta(hours=1)).astimezone(timezone(timedelta(hours=-5)))
+    resp = client.get('/api/export/users', query_string={'createdAfter': after.isoformat()}, headers=headers)
+    assert resp.status_code == 200
+    assert resp.data == b''
+
+    resp = client.get('/api/export/users', query_string={'createdBefore': after.isoformat()}, headers=headers)
+    assert len(resp.data.decode().splitlines()) == 2
+
+
+def test_export_roles_gzip(app, client):
+    utils = Utils(app, client)
+    headers = {
+        'Authorization': f'Bearer {utils.generate_admin_access_token()}',
+        'Accept-Encoding': 'gzip'
+    }
+    resp = client.get('/api/export/roles?format=csv', headers=headers)
+    assert resp.status_code == 200
+    assert resp.headers.get('Content-Encoding') == 'gzip'
+    rows = list(csv.DictReader(io.StringIO(gzip.decompress(resp.data).decode())))
+    assert [(row.get('name'), row.get('userCount')) for row in rows] == [('admin', '1'), ('user', '1')]
+
+
+def test_export_invalid(app, client):
+    utils = Utils(app, client)
+    headers = {'Authorization': f'Bearer {utils.generate_admin_access_token()}'}
+    resp = client.get('/api/export/invalid', headers=headers)
+    assert resp.status_code == 404
+
+    resp = client.get('/api/export/users?format=xml', headers=headers)
+    assert resp.status_code == 400
+
+
+def test_export_without_permissions(app, client):
+    utils = Utils(app, client)
+    headers = {'Authorization': f'Bearer {utils.generate_access_token()}'}
+    resp = client.get('/api/export/users', headers=headers)
+    assert resp.status_code == 403
@@ -1,4 +1,5 @@
 from tests.utils import Utils
+from app.api import Role
 
 import json
 
@@ -168,3 +169,82 @@ def test_get_all(app, client):
     resp = client.get(f'/api/roles', headers=headers)
     assert resp.status_code == 200
     assert len(json.loads(resp.data.decode()).get('data')) == 2
+
+
+def test_get_all_paginated(app, client):
+    utils = Utils(app, client)
+    headers = {'Authorization': f'Bearer {utils.generate_admin_access_token()}'}
+    resp = client.get(f'/api/roles?limit=1', headers=headers)
+    assert resp.status_code == 200
+    assert json.loads(resp.data.decode()).get('data')[0].get('name') == 'admin'
+    cursor = json.loads(resp.data.decode()).get('next')
+
+    resp = client.get(f'/api/roles?limit=1&after={cursor}', headers=headers)
+    assert resp.status_code == 200
+    assert json.loads(resp.data.decode()).get('data')[0].get('name') == 'user'
+    assert json.loads(resp.data.decode()).get('next') is None
+
+
+def test_get_all_streamed(app, client):
+    utils = Utils(app, client)
+    headers = {'Authorization': f'Bearer {utils.generate_admin_access_token()}'}
+    resp = client.get(f'/api/roles?stream=true', headers=headers)
+    assert resp.status_code == 200
+    assert len(json.loads(resp.data.decode()).get('data')) == 2
+
+
+def test_user_count(app, client):
+    utils = Utils(app, client)
+    headers = {'Authorization': f'Bearer {utils.generate_admin_access_token()}'}
+
+    def user_count(name):
+        resp = client.get(f'/api/roles/{name}', headers=headers)
+        return json.loads(resp.data.decode()).get('data').get('userCount')
+    assert user_count('user') == 1
+    assert user_count('admin') == 1
+
+    data = {
+        'username': 'new_user',
+        'password': 'password_for_new_user',
+        'email': 'new_user@test.test',
+        'role': 'user'
+    }
+    resp = client.post('/api/users', headers=headers, json=data)
+    assert resp.status_code == 201
+    assert user_count('user') == 2
+
+    guid = utils.get_guid('new_user')
+    resp = client.put(f'/api/users/{guid}', headers=headers, json={'role': 'admin'})
+    assert resp.status_code == 200
+    assert user_count('user') == 1
+    assert user_count('admin') == 2
+
+    resp = client.delete(f'/api/users/{guid}', headers=headers)
+    assert resp.status_code == 200
+    assert user_count('admin') == 1
+
+    resp = client.get('/api/roles', headers=headers)
+    assert [role.get('userCount') for role in json.loads(resp.data.decode()).get('data')] == [1, 1]
+
+
+def test_recount_command(app, client):
+    Utils(app, client)
+    with app.app_context():
+        client.db.session.query(Role).update({Role.user_count: 0})
+        client.db.session.commit()
+    result = app.test_cli_runner().invoke(args=['roles', 'recount'])
+    assert result.exit_code == 0
+    assert 'admin: 1' in result.output
+    assert 'user: 1' in result.output
+
+
+def test_user_count_of_changed_role_id(app, client):
+    from app.api import User
+    from app.utils import db
+    Utils(app, client)
+    with app.app_context():
+        admin, user = Role.query.filter_by(name='admin').first(), Role.query.filter_by(name='user').first()
+        # the foreign key is assigned directly, without the relationship
+        User.query.filter_by(role_id=user.id).first().role_id = admin.id
+        db.session.commit()
+        assert (admin.user_count, user.user_count) == (2, 0)
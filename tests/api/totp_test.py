@@ -1,3 +1,90 @@
 from tests.utils import Utils
+from io import BytesIO
+import json
+import struct
+import zlib
+import pyqrcode
 
-# TODO
+from app.api.totp.qr import render_svg, render_png
+
+URI = 'otpauth://totp/PythonFlaskLogin:test?secret=JBSWY3DPEHPK3PXP&issuer=PythonFlaskLogin'
+
+
+def test_qr_code_is_rendered_when_the_secret_is_created(app, client):
+    utils = Utils(app, client)
+    cache = app.extensions['qr_codes']
+    headers = {'Authorization': f'Bearer {utils.generate_access_token()}'}
+
+    resp = client.put('/api/users/me', headers=headers, json={'totp_enabled': True})
+    assert resp.status_code == 200
+    assert len(cache) == 1
+
+    resp = client.get('/api/users/2fa', headers=headers)
+    assert resp.status_code == 200
+    assert resp.headers['Content-Type'] == 'image/svg+xml'
+    assert resp.data.startswith(b'<svg')
+    hits = cache.hits
+
+    resp = client.get('/api/users/2fa?format=png', headers=headers)
+    assert resp.status_code == 200
+    assert resp.headers['Content-Type'] == 'image/png'
+    assert resp.data.startswith(b'\x89PNG')
+    resp = client.get('/api/users/2fa', headers=dict(headers, Accept='image/png'))
+    assert resp.headers['Content-Type'] == 'image/png'
+    assert cache.hits == hits + 2
+
+    resp = client.get('/api/users/2fa?format=gif', headers=headers)
+    assert resp.status_code == 400
+
+
+def test_qr_code_is_evicted_with_the_secret(app, client):
+    utils = Utils(app, client)
+    cache = app.extensions['qr_codes']
+    headers = {'Authorization': f'Bearer {utils.generate_access_token()}'}
+
+    client.put('/api/users/me', headers=headers, json={'totp_enabled': True})
+    first = client.get('/api/users/2fa', headers=headers).data
+    # a new secret replaces the qr code of the previous one
+    client.delete('/api/users/2fa', headers=headers)
+    assert len(cache) == 0
+    client.put('/api/users/me', headers=headers, json={'totp_enabled': True})
+    assert len(cache) == 1
+    assert client.get('/api/users/2fa', headers=headers).data != first
+
+    resp = client.delete('/api/users/2fa', headers=headers)
+    assert resp.status_code == 200
+    assert len(cache) == 0
+    resp = client.get('/api/users/2fa', headers=headers)
+    assert json.loads(resp.data.decode()).get('message') == 'Unable to generate QR Code'
+
+
+def test_svg_is_smaller_than_pyqrcode():
+    code = pyqrcode.create(URI, error='M')
+    stream = BytesIO()
+    code.svg(stream, scale=5)
+    svg = render_svg(code.code, 5)
+    assert len(svg) < len(stream.getvalue())
+    # every row is drawn as one absolute move followed by relative moves
+    assert svg.count(b'M') == sum(1 for row in code.code if any(row))
+
+
+def test_png():
+    code = pyqrcode.create(URI, error='M').code
+    png = render_png(code, 2)
+    width, height, depth = struct.unpack('>IIB', png[16:25])
+    assert width == height == (len(code) + 8) * 2
+    assert depth == 1
+
+    idat = png.index(b'IDAT')
+    length, = struct.unpack('>I', png[idat - 4:idat])
+    rows = zlib.decompress(png[idat + 4:idat + 4 + length])
+    stride = 1 + (width + 7) // 8
+    assert len(rows) == stride * height
+
+    def pixel(x: int, y: int) -> int:
+        return rows[y * stride + 1 + x // 8] >> (7 - x % 8) & 1
+
+    # quiet zone is white, the corner of the finder pattern is black
+    assert pixel(0, 0) == 1
+    assert pixel(8, 8) == 0
+    assert pixel(8 + 2 * len(code), 8) == 1
@@ -432,3 +432,127 @@ def test_get_all_without_permissions(app, client):
     resp = client.get(f'/api/users', headers=headers)
     assert resp.status_code == 403
     assert json.loads(resp.data.decode()).get('message') == 'Access Denied!'
+
+
+def test_get_all_paginated(app, client):
+    utils = Utils(app, client)
+    for i in range(5):
+        utils.create_user(username=f'user{i}')
+    headers = {'Authorization': f'Bearer {utils.generate_admin_access_token()}'}
+
+    usernames = []
+    resp = client.get('/api/users?limit=3&count=true', headers=headers)
+    assert resp.status_code == 200
+    assert json.loads(resp.data.decode()).get('total') == 7
+    while True:
+        data = json.loads(resp.data.decode())
+        assert len(data.get('data')) <= 3
+        usernames += [user.get('username') for user in data.get('data')]
+        if not data.get('next'):
+            break
+        resp = client.get(f'/api/users?limit=3&after={data.get("next")}', headers=headers)
+        assert resp.status_code == 200
+    assert usernames == ['administrator', 'test'] + [f'user{i}' for i in range(5)]
+
+
+def test_get_all_invalid_cursor(app, client):
+    utils = Utils(app, client)
+    headers = {'Authorization': f'Bearer {utils.generate_admin_access_token()}'}
+    resp = client.get('/api/users?after=invalid', headers=headers)
+    assert resp.status_code == 400
+    assert json.loads(resp.data.decode()).get('message') == 'Invalid pagination parameters'
+
+
+def test_get_all_streamed(app, client):
+    utils = Utils(app, client)
+    for i in range(5):
+        utils.create_user(username=f'user{i}')
+    app.config['STREAM_BATCH_SIZE'] = 2
+    headers = {'Authorization': f'Bearer {utils.generate_admin_access_token()}'}
+
+    resp = client.get('/api/users?stream=true', headers=headers)
+    assert resp.status_code == 200
+    assert resp.mimetype == 'application/json'
+    data = json.loads(resp.data.decode()).get('data')
+    assert [user.get('username') for user in data] == ['administrator', 'test'] + [f'user{i}' for i in range(5)]
+    assert data[0].get('role').get('name') == 'admin'
+
+
+def test_get_all_ndjson(app, client):
+    utils = Utils(app, client)
+    app.config['STREAM_BATCH_SIZE'] = 1
+    headers = {
+        'Authorization': f'Bearer {utils.generate_admin_access_token()}',
+        'Accept': 'application/x-ndjson'
+    }
+    resp = client.get('/api/users', headers=headers)
+    assert resp.status_code == 200
+    assert resp.mimetype == 'application/x-ndjson'
+    lines = resp.data.decode().splitlines()
+    assert [json.loads(line).get('username') for line in lines] == ['administrator', 'test']
+
+    # any other accept header results in the paginated json response
+    headers['Accept'] = '*/*'
+    resp = client.get('/api/users', headers=headers)
+    assert resp.mimetype == 'application/json'
+    assert 'next' in json.loads(resp.data.decode())
+
+
+def test_bulk_create_ndjson(app, client):
+    utils = Utils(app, client)
+    app.config['BULK_BATCH_SIZE'] = 2
+    headers = {'Authorization': f'Bearer {utils.generate_admin_access_token()}'}
+    rows = [
+        {'username': 'bulk0', 'password': 'password_for_bulk', 'email': 'bulk0@test.test', 'role': 'user'},
+        {'username': 'bulk1', 'password': 'password_for_bulk', 'email': 'bulk1@test.test', 'role': 'admin'},
+        {'username': 'bulk2', 'password': 'short', 'email': 'bulk2@test.test', 'role': 'user'},
+        {'username': 'bulk3', 'password': 'password_for_bulk', 'email': 'bulk3@test.test', 'role': 'invalid'},
+        {'username': 'test', 'password': 'password_for_bulk', 'email': 'test@test.test', 'role': 'user'},
+        {'username': 'bulk0', 'password': 'password_for_bulk', 'email': 'bulk0@test.test', 'role': 'user'},
+        {'username': 'bulk4', 'password': 'password_for_bulk', 'email': 'bulk4@test.test', 'role': 'user'}
+    ]
+    body = '\n'.join(json.dumps(row) for row in rows) + '\n{invalid\n'
+    resp = client.post('/api/users/bulk', data=body, content_type='application/x-ndjson', headers=headers)
+    assert resp.status_code == 200
+    assert resp.mimetype == 'application/x-ndjson'
+    results = {result.get('line'): result for result in map(json.loads, resp.data.decode().splitlines())}
+    assert {line: result.get('status') for line, result in results.items()} == {
+        1: 201, 2: 201, 3: 400, 4: 404, 5: 422, 6: 422, 7: 201, 8: 400
+    }
+    assert 'password' in results[3].get('errors')
+
+    resp = client.post('/api/auth', json={'username': 'bulk1', 'password': 'password_for_bulk'})
+    assert resp.status_code == 200
+
+    # the user count of the roles is maintained
+    headers = {'Authorization': f'Bearer {utils.generate_admin_access_token()}'}
+    resp = client.get('/api/roles/user', headers=headers)
+    assert json.loads(resp.data.decode()).get('data').get('userCount') == 3
+
+
+def test_bulk_create_csv(app, client):
+    utils = Utils(app, client)
+    headers = {'Authorization': f'Bearer {utils.generate_admin_access_token()}'}
+    body = 'username,email,password,role\n' \
+           'csv0,csv0@test.test,password_for_csv,user\n' \
+           'csv1,csv1@test.test,password_for_csv\n'
+    resp = client.post('/api/users/bulk', data=body, content_type='text/csv', headers=headers)
+    # rejected rows are reported before the batch has been inserted
+    results = {result.get('line'): result for result in map(json.loads, resp.data.decode().splitlines())}
+    assert {line: result.get('status') for line, result in results.items()} == {2: 201, 3: 400}
+    assert results[2].get('username') == 'csv0'
+
+    resp = client.get(f'/api/users/{results[2].get("guid")}', headers=headers)
+    assert resp.status_code == 200
+    assert json.loads(resp.data.decode()).get('data').get('role').get('name') == 'user'
+
+
+def test_bulk_create_invalid_content_type(app, client):
+    utils = Utils(app, client)
+    headers = {'Authorization': f'Bearer {utils.generate_admin_access_token()}'}
+    resp = client.post('/api/users/bulk', json=[], headers=headers)
+    assert resp.status_code == 415
+
+    headers = {'Authorization': f'Bearer {utils.generate_access_token()}'}
+    resp = client.post('/api/users/bulk', data='', content_type='text/csv', headers=headers)
+    assert resp.status_code == 403
@@ -0,0 +1,187 @@
+from tests.utils import Utils
+import asyncio
+import json
+import pytest
+
+from app.asgi import create_asgi_app
+from app.config import TestingConfig
+
+pytest.importorskip('aiosqlite')
+
+
+class AsyncClient:
+    """
+    Calls the asgi application like a server would do
+    """
+    def __init__(self, application):
+        self.application = application
+        self.loop = asyncio.new_event_loop()
+
+    def request(self, method: str, path: str, json_data=None, headers: dict = None, query: str = ''):
+        body = json.dumps(json_data).encode() if json_data is not None else b''
+        headers = dict(headers or {})
+        if json_data is not None:
+            headers['Content-Type'] = 'application/json'
+        scope = {
+            'type': 'http',
+            'method': method,
+            'path': path,
+            'query_string': query.encode(),
+            'headers': [(key.lower().encode(), value.encode()) for key, value in headers.items()],
+            'http_version': '1.1',
+            'scheme': 'http',
+            'server': ('localhost', 80),
+            'client': ('127.0.0.1', 50000)
+        }
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        self.loop.run_until_complete(self.application(scope, receive, send))
+        status = messages[0]['status']
+        data = b''.join(message.get('body', b'') for message in messages[1:])
+        return status, dict((key.decode(), value.decode()) for key, value in messages[0]['headers']), data
+
+    def close(self):
+        self.loop.run_until_complete(self.application.shutdown())
+        self.loop.close()
+
+
+@pytest.fixture
+def asgi(tmp_path):
+    class AsyncConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{tmp_path / "asgi.db"}'
+
+    application = create_asgi_app(AsyncConfig)
+    client = application.app.test_client()
+    setattr(client, 'db', application.app.extensions['sqlalchemy'].db)
+    utils = Utils(application.app, client)
+    async_client = AsyncClient(application)
+    yield utils, client, async_client
+    async_client.close()
+
+
+def test_same_responses(asgi):
+    utils, client, async_client = asgi
+    admin = {'Authorization': f'Bearer {utils.generate_admin_access_token()}'}
+    user = {'Authorization': f'Bearer {utils.generate_access_token()}'}
+    for method, path, query, headers in [
+        ('GET', '/api/auth', '', user),
+        ('GET', '/api/auth', '', {}),
+        ('GET', '/api/auth', '', {'Authorization': 'Bearer invalid'}),
+        ('GET', '/api/users', 'limit=1&count=true', admin),
+        ('GET', '/api/users', 'after=invalid', admin),
+        ('GET', '/api/users', '', user),
+        ('GET', f'/api/users/{utils.get_guid()}', '', admin),
+        ('GET', '/api/users/invalid', '', admin),
+        ('GET', '/api/roles', '', user),
+        ('GET', '/api/roles/user', '', user),
+        ('GET', '/api/roles/invalid', '', user)
+    ]:
+        resp = client.open(path, method=method, query_string=query, headers=headers)
+        status, _, data = async_client.request(method, path, headers=headers, query=query)
+        assert status == resp.status_code, path
+        assert json.loads(data.decode()) == json.loads(resp.data.decode()), path
+
+
+def test_fixed_user_paths_are_passed_to_flask(asgi):
+    utils, client, async_client = asgi
+    user = {'Authorization': f'Bearer {utils.generate_access_token()}'}
+    client.put('/api/users/me', headers=user, json={'totp_enabled': True})
+    resp = client.get('/api/users/2fa', headers=user)
+    assert resp.status_code == 200
+    status, headers, data = async_client.request('GET', '/api/users/2fa', headers=user)
+    assert status == 200
+    assert headers.get('content-type') == resp.headers['Content-Type']
+    assert data == resp.data
+
+
+def test_login_and_refresh(asgi):
+    utils, _, async_client = asgi
+    status, headers, data = async_client.request(
+        'POST', '/api/auth', {'username': 'test', 'password': 'password_for_test'}
+    )
+    assert status == 200
+    assert headers.get('content-type') == 'application/json'
+    tokens = json.loads(data.decode())
+    assert tokens.get('message') == 'Authentication was successfully'
+
+    status, _, _ = async_client.request('GET', '/api/auth', headers={
+        'Authorization': f'Bearer {tokens.get("accessToken")}'
+    })
+    assert status == 200
+
+    status, _, data = async_client.request('POST', '/api/auth', {'username': 'test', 'password': 'invalid'})
+    assert status == 401
+    assert json.loads(data.decode()).get('message') == 'Invalid credentials'
+
+    status, _, data = async_client.request('POST', '/api/auth', {'username': 'test'})
+    assert status == 400
+
+    status, _, data = async_client.request('POST', '/api/auth/refresh', {'refreshToken': tokens.get('refreshToken')})
+    assert status == 200
+    assert json.loads(data.decode()).get('accessToken')
+
+    status, _, _ = async_client.request('DELETE', f'/api/auth/refresh/{tokens.get("refreshToken")}')
+    assert status == 200
+    status, _, _ = async_client.request('POST', '/api/auth/refresh', {'refreshToken': tokens.get('refreshToken')})
+    assert status == 401
+
+
+def test_login_updates_last_login(asgi):
+    utils, client, async_client = asgi
+    status, _, _ = async_client.request('POST', '/api/auth', {'username': 'test', 'password': 'password_for_test'})
+    assert status == 200
+    admin = {'Authorization': f'Bearer {utils.generate_admin_access_token()}'}
+    resp = client.get(f'/api/users/{utils.get_guid()}', headers=admin)
+    assert json.loads(resp.data.decode()).get('data').get('lastLogin') is not None
+
+
+def test_other_requests_are_passed_to_flask(asgi):
+    utils, _, async_client = asgi
+    admin = {'Authorization': f'Bearer {utils.generate_admin_access_token()}'}
+    status, _, data = async_client.request('POST', '/api/roles', {'name': 'new', 'description': 'New'}, admin)
+    assert status == 201
+    assert json.loads(data.decode()).get('data').get('name') == 'new'
+
+    status, headers, data = async_client.request('GET', '/api/users', headers=admin, query='stream=true')
+    assert status == 200
+    assert [user.get('username') for user in json.loads(data.decode()).get('data')] == ['administrator', 'test']
+
+    status, _, _ = async_client.request('GET', '/invalid')
+    assert status == 404
+
+
+def test_async_redis_blacklist(asgi):
+    fakeredis = pytest.importorskip('fakeredis')
+    aioredis = pytest.importorskip('fakeredis.aioredis')
+    from app.blacklist import RedisBlacklist
+    utils, client, async_client = asgi
+    server = fakeredis.FakeServer()
+    blacklist = RedisBlacklist(fakeredis.FakeStrictRedis(server=server))
+    blacklist.init_async(aioredis.FakeRedis(server=server))
+    utils.app.config['BLACKLIST'] = blacklist
+
+    status, _, data = async_client.request('POST', '/api/auth', {'username': 'test', 'password': 'password_for_test'})
+    refresh_token = json.loads(data.decode()).get('refreshToken')
+    status, _, _ = async_client.request('DELETE', f'/api/auth/refresh/{refresh_token}')
+    assert status == 200
+    # the synchronous client of flask sees the token blacklisted by the asyncio client
+    assert blacklist.check(refresh_token)
+    resp = client.post('/api/auth/refresh', data=json.dumps({'refreshToken': refresh_token}),
+                       content_type='application/json')
+    assert resp.status_code == 401
+
+
+def test_login_throttle(asgi):
+    utils, _, async_client = asgi
+    utils.app.config['LOGIN_THROTTLE_USERNAME'] = (1, 0.01)
+    status, _, _ = async_client.request('POST', '/api/auth', {'username': 'test', 'password': 'invalid'})
+    assert status == 401
+    status, headers, _ = async_client.request('POST', '/api/auth', {'username': 'test', 'password': 'password_for_test'})
+    assert status == 429
+    assert headers.get('retry-after') == '100'
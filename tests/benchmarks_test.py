@@ -0,0 +1,26 @@
+import json
+
+from benchmarks import suite
+
+
+def test_suite_results_and_baseline(tmp_path):
+    baseline = tmp_path / 'baseline.json'
+    args = ['--min-time', '0', '--repeat', '2', '--filter', 'jwt', '--filter', 'GET /api/auth']
+    assert suite.main(args + ['--output', str(baseline)]) == 0
+    results = json.loads(baseline.read_text())
+    assert set(results['benchmarks']) == {'jwt encode', 'jwt decode', 'jwt decode cached', 'GET /api/auth'}
+    assert all(result['median'] > 0 for result in results['benchmarks'].values())
+    assert results['environment']['hashMethod'] == suite.Config.HASH_METHOD
+
+    # a baseline which was ten times faster
+    for result in results['benchmarks'].values():
+        result['median'] /= 10
+    baseline.write_text(json.dumps(results))
+    assert suite.main(args + ['--baseline', str(baseline)]) == 1
+
+
+def test_compare():
+    baseline = {'benchmarks': {'a': {'median': 1.0}, 'b': {'median': 1.0}, 'c': {'median': 1.0}}}
+    results = {'benchmarks': {'a': {'median': 1.5}, 'b': {'median': 1.1}, 'c': {'median': 0.5}, 'd': {'median': 1}}}
+    assert suite.compare(results, baseline, 0.2) == [('a', 1.0, 1.5, 'regression'), ('b', 1.0, 1.1, ''),
+                                                     ('c', 1.0, 0.5, 'improved')]
@@ -0,0 +1,271 @@
+from flask import Flask
+from datetime import datetime, timedelta
+import jwt
+import multiprocessing
+import pytest
+import threading
+import time
+
+from tests.utils import Utils
+from app.blacklist import (
+    BlacklistFull, RedisBlacklist, SetBlacklist, SharedMemoryBlacklist, BloomFilter, BloomFilteredBlacklist, token_digest
+)
+
+
+def create_token(minutes=10, username='test'):
+    data = {'exp': datetime.utcnow() + timedelta(minutes=minutes), 'username': username}
+    return jwt.encode(data, 'secret').decode()
+
+
+@pytest.fixture
+def redis_blacklist():
+    fakeredis = pytest.importorskip('fakeredis')
+    blacklist = RedisBlacklist(client=fakeredis.FakeStrictRedis())
+    app = Flask(__name__)
+    app.config['REFRESH_TOKEN_VALIDITY'] = 360
+    blacklist.init_app(app)
+    return blacklist
+
+
+def test_set_blacklist():
+    blacklist = SetBlacklist()
+    token = create_token()
+    assert not blacklist.check(token)
+    blacklist.add(token)
+    assert blacklist.check(token)
+    assert blacklist.check_many([token, create_token(username='other')]) == [True, False]
+
+
+def test_redis_blacklist(redis_blacklist):
+    token = create_token()
+    assert not redis_blacklist.check(token)
+    redis_blacklist.add(token)
+    assert redis_blacklist.check(token)
+    assert not redis_blacklist.check(create_token(username='other'))
+
+    # the entry expires together with the token
+    ttl = redis_blacklist.blacklist.ttl(redis_blacklist.key(token))
+    assert 590 <= ttl <= 600
+
+
+def test_redis_blacklist_expired_token(redis_blacklist):
+    token = create_token(minutes=-1)
+    redis_blacklist.add(token)
+    assert not redis_blacklist.blacklist.keys('blacklist:*')
+
+
+def test_redis_blacklist_batch(redis_blacklist):
+    tokens = [create_token(username=f'user{i}') for i in range(5)]
+    redis_blacklist.add_many(tokens[:3])
+    assert redis_blacklist.check_many(tokens) == [True, True, True, False, False]
+
+
+def test_redis_blacklist_migrate_legacy(redis_blacklist):
+    tokens = [create_token(username=f'user{i}') for i in range(5)]
+    redis_blacklist.blacklist.sadd('blacklist', *tokens)
+    assert redis_blacklist.migrate_legacy(batch_size=2) == 5
+    assert not redis_blacklist.blacklist.exists('blacklist')
+    assert all(redis_blacklist.check_many(tokens))
+
+
+def test_shared_memory_blacklist(tmp_path):
+    blacklist = SharedMemoryBlacklist(path=str(tmp_path / 'blacklist'), capacity=16)
+    token = create_token()
+    assert not blacklist.check(token)
+    blacklist.add(token)
+    assert blacklist.check(token)
+    assert blacklist.check_many([token, create_token(username='other')]) == [True, False]
+
+    # expired tokens are not added
+    blacklist.add(create_token(minutes=-1))
+    assert blacklist.stats().get('size') == 1
+
+
+def test_shared_memory_blacklist_full(tmp_path):
+    blacklist = SharedMemoryBlacklist(path=str(tmp_path / 'blacklist'), capacity=4)
+    tokens = [create_token(minutes=60 - i, username=f'user{i}') for i in range(6)]
+    for token in tokens[:4]:
+        blacklist.add(token)
+    # valid tokens are never evicted, the blacklist refuses further tokens instead
+    with pytest.raises(BlacklistFull) as error:
+        blacklist.add(tokens[4])
+    assert 55 * 60 <= error.value.retry_after <= 57 * 60
+    assert blacklist.check_many(tokens) == [True] * 4 + [False] * 2
+    assert blacklist.stats().get('size') == 4
+    assert blacklist.stats().get('rejected') == 1
+
+
+def test_shared_memory_blacklist_evicts_expired(tmp_path, monkeypatch):
+    blacklist = SharedMemoryBlacklist(path=str(tmp_path / 'blacklist'), capacity=4)
+    tokens = [create_token(minutes=i + 1, username=f'user{i}') for i in range(6)]
+    for token in tokens[:4]:
+        blacklist.add(token)
+    # the first two tokens have expired, their entries are reused
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 150)
+    blacklist.add_many(tokens[4:])
+    assert blacklist.check_many(tokens) == [False] * 2 + [True] * 4
+    assert blacklist.stats().get('rejected') == 0
+
+
+def test_logout_with_full_blacklist(app, client, monkeypatch):
+    _, refresh_token = Utils(app, client).generate_access_token(refresh=True)
+
+    def full(*_):
+        raise BlacklistFull(retry_after=60)
+    # the blacklist of the testing config is shared by all tests, which may have blacklisted the same token
+    monkeypatch.setitem(app.config, 'BLACKLIST', SetBlacklist())
+    monkeypatch.setattr(app.config['BLACKLIST'], 'add', full)
+
+    resp = client.delete(f'/api/auth/refresh/{refresh_token}')
+    assert resp.status_code == 503
+    assert resp.headers.get('Retry-After') == '60'
+
+
+def test_shared_memory_blacklist_between_processes(tmp_path):
+    path = str(tmp_path / 'blacklist')
+    token = create_token()
+
+    def add():
+        SharedMemoryBlacklist(path=path, capacity=16).add(token)
+
+    blacklist = SharedMemoryBlacklist(path=path, capacity=16)
+    assert not blacklist.check(token)
+    process = multiprocessing.get_context('fork').Process(target=add)
+    process.start()
+    process.join()
+    assert process.exitcode == 0
+    assert blacklist.check(token)
+
+
+def test_bloom_filter():
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    digests = [token_digest(f'token{i}') for i in range(2000)]
+    for digest in digests[:1000]:
+        bloom.add(digest)
+    assert all(digest in bloom for digest in digests[:1000])
+    false_positives = sum(digest in bloom for digest in digests[1000:])
+    assert false_positives < 50
+
+
+def test_bloom_filtered_blacklist():
+    backend = SetBlacklist()
+    blacklist = BloomFilteredBlacklist(backend, capacity=100, error_rate=0.001, sync_interval=60)
+    tokens = [create_token(username=f'user{i}') for i in range(10)]
+    blacklist.add(tokens[0])
+    assert blacklist.check_many(tokens) == [True] + [False] * 9
+    stats = blacklist.stats()
+    assert stats.get('forwarded') >= 1
+    assert stats.get('skipped') + stats.get('forwarded') == 10
+
+
+def test_bloom_filtered_blacklist_sync():
+    backend = SetBlacklist()
+    blacklist = BloomFilteredBlacklist(backend, capacity=100, error_rate=0.001, sync_interval=60)
+    token = create_token()
+    assert not blacklist.check(token)
+
+    # blacklisted by another worker, detected after the next sync
+    backend.add(token)
+    assert not blacklist.check(token)
+    blacklist.sync()
+    assert blacklist.check(token)
+
+
+def test_bloom_filtered_blacklist_background_sync():
+    scanning, release = threading.Event(), threading.Event()
+
+    class SlowBackend(SetBlacklist):
+        def digests(self):
+            digests = super().digests()
+            scanning.set()
+            release.wait(5)
+            return digests
+
+    backend = SlowBackend()
+    blacklist = BloomFilteredBlacklist(backend, capacity=100, error_rate=0.001, sync_interval=60)
+    release.set()
+    token, other = create_token(), create_token(username='other')
+    assert not blacklist.check(token)
+
+    # the filter is outdated, the requests don't wait for the sync and there is only one of them
+    scanning.clear()
+    release.clear()
+    backend.add(token)
+    blacklist._synced -= 61
+    assert not blacklist.check(token)
+    assert scanning.wait(5)
+    assert not blacklist.check(token)
+    # added after the backend has been read
+    blacklist.add(other)
+    sync = next(thread for thread in threading.enumerate() if thread.name == 'blacklist-sync')
+    release.set()
+    sync.join()
+    assert blacklist.stats().get('syncs') == 2
+    assert blacklist.check_many([token, other]) == [True, True]
+
+
+def test_bloom_filter_shared_by_workers():
+    fakeredis = pytest.importorskip('fakeredis')
+    server = fakeredis.FakeServer()
+    app = Flask(__name__)
+    app.config['REFRESH_TOKEN_VALIDITY'] = 360
+
+    def worker():
+        backend = RedisBlacklist(client=fakeredis.FakeStrictRedis(server=server))
+        blacklist = BloomFilteredBlacklist(backend, capacity=100, error_rate=0.001, sync_interval=60)
+        blacklist.init_app(app)
+        return blacklist
+
+    first, second = worker(), worker()
+    token, other = create_token(), create_token(username='other')
+    first.add(token)
+    # the first worker has published the filter, the second one only reads it
+    assert second.check_many([token, other]) == [True, False]
+    second.add(other)
+    first.sync()
+    assert first.check(other)
+    assert (first.rebuilds, second.rebuilds) == (1, 0)
+
+    # the filter is full of expired tokens, it's rebuilt by one worker after the rebuild interval
+    name = first._filter.name
+    first.backend.publish_filter(name, b'\xff' * len(first._filter.bits))
+    second.sync()
+    assert second.rebuilds == 0
+    first.backend.blacklist.delete(first.backend.filter_prefix + name + ':lock')
+    second.sync()
+    first.sync()
+    assert (first.rebuilds, second.rebuilds) == (1, 1)
+    assert first.check_many([token, other, create_token(username='third')]) == [True, True, False]
+    assert first._filter.estimated_error_rate() < first.error_rate
+
+
+def test_tokens_blacklisted_during_rebuild_are_published():
+    fakeredis = pytest.importorskip('fakeredis')
+    server = fakeredis.FakeServer()
+
+    def worker(backend_class=RedisBlacklist):
+        backend = backend_class(client=fakeredis.FakeStrictRedis(server=server))
+        return BloomFilteredBlacklist(backend, capacity=100, error_rate=0.001, sync_interval=60)
+
+    class ScannedBackend(RedisBlacklist):
+        def digests(self):
+            digests = list(super().digests())
+            # blacklisted by another worker after the keys have been scanned
+            other.add(late)
+            return digests
+
+    token, late = create_token(), create_token(username='late')
+    rebuilding, other = worker(ScannedBackend), worker()
+    rebuilding.backend.add(token)
+    rebuilding.sync()
+    assert worker().check_many([token, late]) == [True, True]
+    assert rebuilding.rebuilds == 1
+
+
+def test_bloom_filtered_redis_blacklist(redis_blacklist):
+    blacklist = BloomFilteredBlacklist(redis_blacklist, capacity=100, error_rate=0.001, sync_interval=60)
+    token = create_token()
+    redis_blacklist.add(token)
+    assert blacklist.check(token)
+    assert not blacklist.check(create_token(username='other'))
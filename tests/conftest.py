@@ -1,3 +1,4 @@
+from contextlib import contextmanager
 import pytest
 import requests
 import json
@@ -5,6 +6,7 @@ import werkzeug.wrappers
 
 from app.config import TestingConfig
 from app.utils import db as database
+from app.queries import record_queries
 from app import create_app
 
 
@@ -26,3 +28,17 @@ def client(app):
     requests.post = c.post
     werkzeug.wrappers.BaseResponse.json = lambda self, **kwargs: json.loads(self.data.decode())
     return c
+
+
+@pytest.fixture
+def max_queries():
+    """
+    Fail if the block executes more statements, e.g. `with max_queries(2): client.get('/api/users')`
+    """
+    @contextmanager
+    def check(limit: int):
+        with record_queries() as recorder:
+            yield recorder
+        assert recorder.count <= limit, f'{recorder.count} statements instead of max. {limit}:\n' + \
+            '\n'.join(f'{count}x {statement}' for statement, count in recorder.statements.items())
+    return check
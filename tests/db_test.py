@@ -1,5 +1,7 @@
 from app.api import User, Role
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from uuid import UUID
+import pytest
 
 
 def test_create_models(client):
@@ -41,3 +43,64 @@ def test_create_user(app, client):
         assert queried_user.displayName == 'Testine Test'
         assert queried_user.email == 'test@test.test'
         assert queried_user.verify_password('password_for_test')
+
+
+def test_pool_stats(tmp_path):
+    from app import create_app
+    from app.config import TestingConfig
+    from app.utils import db, TimedQueuePool
+
+    class PoolConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{tmp_path / "pool.db"}'
+        SQLALCHEMY_ENGINE_OPTIONS = {
+            'poolclass': TimedQueuePool,
+            'pool_size': 1,
+            'max_overflow': 1,
+            'pool_timeout': 0.1,
+            'pool_pre_ping': True
+        }
+        SQLALCHEMY_POOL_WARMUP = 1
+
+    app = create_app(PoolConfig)
+    with app.app_context():
+        engine = db.get_engine(app)
+        assert isinstance(engine.pool, TimedQueuePool)
+        assert engine.pool._pre_ping
+
+        first, second = engine.connect(), engine.connect()
+        stats = db.pool_stats(app)
+        assert stats.get('checkedOut') == 2
+        assert stats.get('overflows') == 1
+        with pytest.raises(PoolTimeoutError):
+            engine.connect()
+        first.close()
+        second.close()
+
+        stats = db.pool_stats(app)
+        assert stats.get('checkedOut') == 0
+        assert stats.get('timeouts') == 1
+        assert stats.get('waitTimeMax') >= 0.1
+
+
+def test_sqlite_keeps_its_pool(tmp_path):
+    from app import create_app
+    from app.config import TestingConfig
+    from app.utils import db, TimedQueuePool
+
+    class FileConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{tmp_path / "file.db"}'
+
+    app = create_app(FileConfig)
+    with app.app_context():
+        assert not isinstance(db.get_engine(app).pool, TimedQueuePool)
+        assert 'status' in db.pool_stats(app)
+
+
+def test_pool_stats_resource(app, client):
+    import json
+    from tests.utils import Utils
+    utils = Utils(app, client)
+    headers = {'Authorization': f'Bearer {utils.generate_admin_access_token()}'}
+    resp = client.get('/api/stats/database', headers=headers)
+    assert resp.status_code == 200
+    assert 'status' in json.loads(resp.data.decode()).get('data')
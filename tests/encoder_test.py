@@ -0,0 +1,62 @@
+from datetime import datetime, date
+from uuid import UUID
+import json
+import pytest
+
+from app.encoder import BACKENDS, select_backend, fast_json, message_body
+
+DATA = {
+    'data': {
+        'username': 'test',
+        'displayName': 'Tëst "quoted" / slash',
+        'created': datetime(2020, 1, 2, 3, 4, 5, 123456),
+        'lastLogin': None,
+        'birthday': date(2000, 1, 2),
+        'guid': UUID('12345678-1234-5678-1234-567812345678'),
+        'values': [1, 2.5, True],
+        'role': {'name': 'user', 'userCount': 3}
+    }
+}
+EXPECTED = {
+    'data': {
+        'username': 'test',
+        'displayName': 'Tëst "quoted" / slash',
+        'created': '2020-01-02T03:04:05.123456',
+        'lastLogin': None,
+        'birthday': '2000-01-02',
+        'guid': '12345678-1234-5678-1234-567812345678',
+        'values': [1, 2.5, True],
+        'role': {'name': 'user', 'userCount': 3}
+    }
+}
+
+
+@pytest.mark.parametrize('name', list(BACKENDS))
+def test_backends(name):
+    try:
+        _, dumps = select_backend(name)
+    except RuntimeError:
+        pytest.skip(f'{name} is not installed')
+    body = dumps(DATA)
+    assert isinstance(body, bytes)
+    assert json.loads(body.decode()) == EXPECTED
+    with pytest.raises(TypeError):
+        dumps({'data': object()})
+
+
+def test_unknown_backend():
+    with pytest.raises(RuntimeError):
+        select_backend('invalid')
+
+
+def test_message_body_is_reused(app):
+    assert message_body('Missing access token') is message_body('Missing access token')
+    assert json.loads(message_body('Missing access token').decode()) == {'message': 'Missing access token'}
+
+
+def test_responses_use_the_configured_backend(app, client):
+    assert fast_json.name == select_backend(app.config['JSON_BACKEND'])[0]
+    resp = client.get('/api/auth')
+    assert resp.status_code == 401
+    assert resp.mimetype == 'application/json'
+    assert resp.data == message_body('Missing access token')
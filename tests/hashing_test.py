@@ -0,0 +1,252 @@
+from flask import Flask
+import json
+import os
+import pytest
+import signal
+import threading
+import time
+
+from werkzeug import security
+
+from tests.utils import Utils
+from app.api import User
+from app.hashing import (
+    HashingPool, HashingUnavailable, hashing, generate_password_hash,
+    check_password_hash, needs_rehash, calibrate
+)
+
+
+def create_pool(**config):
+    app = Flask(__name__)
+    app.config.update(config)
+    return HashingPool(app)
+
+
+def test_inline_hashing():
+    pool = create_pool(HASH_WORKERS=0)
+    pwhash = pool.generate('password', 'pbkdf2:sha256:1000')
+    assert pool.verify(pwhash, 'password')
+    assert not pool.verify(pwhash, 'invalid')
+    assert pool.stats().get('completed') == 3
+
+
+def test_process_pool_hashing():
+    pool = create_pool(HASH_WORKERS=1, HASH_QUEUE_SIZE=4, HASH_DEADLINE=10)
+    pwhash = pool.generate('password', 'pbkdf2:sha256:1000')
+    assert pool.verify(pwhash, 'password')
+    stats = pool.stats()
+    assert stats.get('completed') == 2
+    assert stats.get('pending') == 0
+    assert stats.get('rejected') == 0
+
+
+def test_process_pool_batch_hashing():
+    pool = create_pool(HASH_WORKERS=2, HASH_QUEUE_SIZE=1, HASH_DEADLINE=10)
+    passwords = [f'password{i}' for i in range(10)]
+    hashes = pool.generate_many(passwords, 'pbkdf2:sha256:1000')
+    assert all(check_password_hash(pwhash, password) for pwhash, password in zip(hashes, passwords))
+    assert pool.stats().get('completed') == 10
+
+
+def test_batch_hashing_leaves_workers_to_logins(monkeypatch):
+    pool = create_pool(HASH_WORKERS=4, HASH_QUEUE_SIZE=8, HASH_DEADLINE=10)
+    reserve, pending = pool._reserve, []
+
+    def counted_reserve():
+        executor = reserve()
+        pending.append(pool.stats().get('pending'))
+        return executor
+    monkeypatch.setattr(pool, '_reserve', counted_reserve)
+
+    pool.generate_many([f'password{i}' for i in range(10)], 'pbkdf2:sha256:1000')
+    # the hashes of the batch are counted by the admission control, two of them at a time
+    # (the slot of a finished hash may not have been released yet)
+    assert len(pending) == 10
+    assert min(pending) >= 1
+    assert max(pending) <= pool.bulk_workers + 1
+    assert pool.stats().get('pending') == 0
+
+
+def test_timed_out_hash_keeps_its_worker():
+    pool = create_pool(HASH_WORKERS=1, HASH_QUEUE_SIZE=4, HASH_DEADLINE=0.5)
+    pool.submit(time.sleep, 0)
+    with pytest.raises(HashingUnavailable):
+        pool.submit(time.sleep, 1.5)
+    # the worker keeps running the hash after the request has given up
+    assert pool.stats().get('pending') == 1
+    time.sleep(1.5)
+    assert pool.stats().get('pending') == 0
+    assert pool.stats().get('timeouts') == 1
+
+
+def test_full_queue_is_rejected():
+    pool = create_pool(HASH_WORKERS=1, HASH_QUEUE_SIZE=1, HASH_DEADLINE=10)
+    # simulate a hash that is still running
+    pool._pending = 1
+    with pytest.raises(HashingUnavailable) as error:
+        pool.generate('password', 'pbkdf2:sha256:1000')
+    assert error.value.retry_after >= 1
+    assert pool.stats().get('rejected') == 1
+
+
+def test_idle_workers_admit_slow_hashes():
+    pool = create_pool(HASH_WORKERS=2, HASH_QUEUE_SIZE=4, HASH_DEADLINE=1)
+    pool._service_time = 3
+    # a worker is idle, the hash doesn't wait
+    pool._pending = 1
+    pool._admit()
+    with pytest.raises(HashingUnavailable):
+        pool._admit()
+    assert pool.stats().get('rejected') == 1
+
+
+def kill_workers(pool: HashingPool):
+    for process in list(pool._executor._processes.values()):
+        os.kill(process.pid, signal.SIGKILL)
+
+
+def test_broken_pool_is_rebuilt():
+    pool = create_pool(HASH_WORKERS=1, HASH_QUEUE_SIZE=4, HASH_DEADLINE=10)
+    pwhash = pool.generate('password', 'pbkdf2:sha256:1000')
+    kill_workers(pool)
+    # wait until the pool has noticed the dead process
+    while not pool._executor._broken:
+        time.sleep(0.01)
+    assert pool.verify(pwhash, 'password')
+    assert pool.generate_many(['password'], 'pbkdf2:sha256:1000')
+    stats = pool.stats()
+    assert stats.get('restarts') == 1
+    assert stats.get('pending') == 0
+
+
+def test_hash_of_a_killed_worker_is_unavailable():
+    pool = create_pool(HASH_WORKERS=1, HASH_QUEUE_SIZE=4, HASH_DEADLINE=10)
+    pool.submit(time.sleep, 0)
+    threading.Timer(0.5, kill_workers, [pool]).start()
+    with pytest.raises(HashingUnavailable):
+        pool.submit(time.sleep, 5)
+    assert pool.stats().get('pending') == 0
+    # the next hash runs in a new pool
+    assert pool.submit(time.sleep, 0) is None
+    assert pool.stats().get('restarts') == 1
+
+
+def test_login_while_overloaded(app, client, monkeypatch):
+    Utils(app, client)
+
+    def overloaded(*_):
+        raise HashingUnavailable(retry_after=3)
+    monkeypatch.setattr(hashing, 'submit', overloaded)
+
+    resp = client.post('/api/auth', json={'username': 'test', 'password': 'password_for_test'})
+    assert resp.status_code == 503
+    assert resp.headers.get('Retry-After') == '3'
+    assert json.loads(resp.data.decode()).get('message') == 'Server is busy, try again later'
+
+
+def test_stats(app, client):
+    utils = Utils(app, client)
+    headers = {'Authorization': f'Bearer {utils.generate_admin_access_token()}'}
+    resp = client.get('/api/stats/hashing', headers=headers)
+    assert resp.status_code == 200
+    assert 'queueDepth' in json.loads(resp.data.decode()).get('data')
+
+    resp = client.get('/api/stats', headers=headers)
+    assert resp.status_code == 200
+    assert 'hashing' in json.loads(resp.data.decode()).get('data')
+
+    resp = client.get('/api/stats/invalid', headers=headers)
+    assert resp.status_code == 404
+
+
+def test_stats_without_permissions(app, client):
+    utils = Utils(app, client)
+    headers = {'Authorization': f'Bearer {utils.generate_access_token()}'}
+    resp = client.get('/api/stats', headers=headers)
+    assert resp.status_code == 403
+
+
+def test_pbkdf2_hash():
+    pwhash = generate_password_hash('password', 'pbkdf2:sha256:1000')
+    assert pwhash.startswith('pbkdf2:sha256:1000$')
+    assert check_password_hash(pwhash, 'password')
+    assert not check_password_hash(pwhash, 'invalid')
+
+
+def test_scrypt_hash():
+    pwhash = generate_password_hash('password', 'scrypt:1024:8:1')
+    assert pwhash.startswith('scrypt:1024:8:1$')
+    assert check_password_hash(pwhash, 'password')
+    assert not check_password_hash(pwhash, 'invalid')
+
+
+def test_legacy_hash():
+    pwhash = security.generate_password_hash('password', method='sha512')
+    assert check_password_hash(pwhash, 'password')
+    assert not check_password_hash(pwhash, 'invalid')
+    assert needs_rehash(pwhash, 'pbkdf2:sha512:20000')
+
+
+def test_needs_rehash():
+    pwhash = generate_password_hash('password', 'pbkdf2:sha512:20000')
+    assert not needs_rehash(pwhash, 'pbkdf2:sha512:20000')
+    assert needs_rehash(pwhash, 'pbkdf2:sha512:30000')
+    assert needs_rehash(pwhash, 'scrypt')
+
+
+def test_calibrate():
+    method, duration = calibrate('pbkdf2:sha256:1000', 0.01)
+    assert method.startswith('pbkdf2:sha256:')
+    assert duration > 0
+
+
+def test_calibrate_command(app):
+    result = app.test_cli_runner().invoke(args=['hash', 'calibrate', '--method', 'scrypt:1024:8:1', '--target', '5'])
+    assert result.exit_code == 0
+    assert "HASH_METHOD = 'scrypt:" in result.output
+
+
+def test_rehash_on_login(app, client):
+    Utils(app, client)
+    with app.app_context():
+        user = User.query.filter_by(username='test').first()
+        # password hash of an old policy
+        user._password = security.generate_password_hash('password_for_test', method='sha512')
+        user.password_policy = None
+        client.db.session.commit()
+
+    resp = client.post('/api/auth', json={'username': 'test', 'password': 'password_for_test'})
+    assert resp.status_code == 200
+
+    with app.app_context():
+        user = User.query.filter_by(username='test').first()
+        assert user._password.startswith(app.config['HASH_METHOD'] + '$')
+        assert user.password_policy == app.config['HASH_POLICY_VERSION']
+        assert not user.needs_rehash()
+        assert user.verify_password('password_for_test')
+
+
+def test_login_without_rehash_while_overloaded(app, client, monkeypatch):
+    Utils(app, client)
+    with app.app_context():
+        user = User.query.filter_by(username='test').first()
+        old_hash = security.generate_password_hash('password_for_test', method='sha512')
+        user._password = old_hash
+        user.password_policy = None
+        client.db.session.commit()
+
+    # the password is verified, but the pool is saturated when the hash is renewed
+    def overloaded(*_, **__):
+        raise HashingUnavailable(retry_after=3)
+    monkeypatch.setattr(hashing, 'generate', overloaded)
+
+    resp = client.post('/api/auth', json={'username': 'test', 'password': 'password_for_test'})
+    assert resp.status_code == 200
+    assert json.loads(resp.data.decode()).get('accessToken')
+
+    # the old hash is kept and renewed on a later login
+    with app.app_context():
+        user = User.query.filter_by(username='test').first()
+        assert user._password == old_hash
+        assert user.needs_rehash()
+        assert user.last_login is not None
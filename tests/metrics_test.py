@@ -0,0 +1,91 @@
+from tests.utils import Utils
+import multiprocessing
+import os
+import re
+
+from app import create_app
+from app.config import TestingConfig
+from app.metrics import SharedValues
+
+
+def sample(text: str, name: str) -> float:
+    match = re.search(rf'^{re.escape(name)} (\S+)$', text, re.MULTILINE)
+    return float(match.group(1)) if match else 0.0
+
+
+def test_login_metrics(app, client):
+    utils = Utils(app, client)
+    _, refresh_token = utils.generate_access_token(refresh=True)
+    client.post('/api/auth', json={'username': 'test', 'password': 'wrong_password'})
+    client.post('/api/auth', json={'username': 'test'})
+    utils.enable_2fa()
+    client.post('/api/auth', json={'username': 'test', 'password': 'password_for_test'})
+
+    client.delete(f'/api/auth/refresh/{refresh_token}')
+    resp = client.post('/api/auth/refresh', json={'refreshToken': refresh_token})
+    assert resp.status_code == 401
+
+    resp = client.get('/metrics')
+    assert resp.status_code == 200
+    assert resp.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+    text = resp.data.decode()
+    for outcome in ['success', 'invalid_credentials', 'invalid_payload', 'missing_2fa']:
+        assert sample(text, f'login_attempts_total{{outcome="{outcome}"}}') == 1
+    assert sample(text, 'blacklist_hits_total') == 1
+
+    # 4 logins, the first of them by the test utils
+    assert sample(text, 'http_request_duration_seconds_count{endpoint="auth_api",method="POST"}') == 4
+    assert sample(text, 'http_request_duration_seconds_bucket{endpoint="auth_api",method="POST",le="+Inf"}') == 4
+    assert sample(text, 'http_responses_total{endpoint="auth_api",status="401"}') == 2
+    assert sample(text, 'http_responses_total{endpoint="auth_api",status="400"}') == 1
+    for stage in ['db', 'hash', 'jwt', 'serialize']:
+        assert sample(text, f'http_request_stage_seconds_sum{{endpoint="auth_api",stage="{stage}"}}') > 0
+    assert sample(text, 'http_request_stage_seconds_sum{endpoint="refresh_api",stage="hash"}') == 0
+
+
+def test_metrics_token():
+    class ScrapedConfig(TestingConfig):
+        METRICS_TOKEN = 'secret'
+
+    client = create_app(ScrapedConfig).test_client()
+    assert client.get('/metrics').status_code == 403
+    assert client.get('/metrics', headers={'Authorization': 'Bearer other'}).status_code == 403
+    assert client.get('/metrics', headers={'Authorization': 'Bearer secret'}).status_code == 200
+
+
+def test_metrics_hidden_without_token():
+    class ProductionLikeConfig(TestingConfig):
+        METRICS_PUBLIC = False
+
+    client = create_app(ProductionLikeConfig).test_client()
+    assert client.get('/metrics').status_code == 404
+
+
+def test_shared_values_of_all_workers(tmp_path):
+    values = SharedValues(str(tmp_path))
+    values.inc('requests', 1)
+
+    def worker(amount: int):
+        for _ in range(amount):
+            values.inc('requests', 1)
+        # enough keys to grow the file
+        for i in range(2000):
+            values.inc(f'key {i}', 1)
+
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target=worker, args=(amount,)) for amount in (10, 20)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert values.collect()['requests'] == 31
+    assert values.collect()['key 1999'] == 2
+
+    # the files of the stopped workers are merged when a new worker starts
+    process = context.Process(target=worker, args=(5,))
+    process.start()
+    process.join()
+    files = sorted(name for name in os.listdir(tmp_path) if name.endswith('.db'))
+    assert files == ['stopped.db', f'worker-{os.getpid()}.db', f'worker-{process.pid}.db']
+    assert values.collect()['requests'] == 36
+    assert values.collect()['key 0'] == 3
@@ -0,0 +1,74 @@
+from sqlalchemy import create_engine, inspect
+import click
+import pytest
+
+from app import create_app
+from app.config import TestingConfig
+from app.migrations import LATEST_VERSION, current_version, pending_migrations, upgrade, schema_version
+from app.utils import db
+
+# tables of the first release, without the columns added later
+LEGACY_SCHEMA = [
+    'CREATE TABLE role (id INTEGER PRIMARY KEY, name VARCHAR(80) NOT NULL UNIQUE, '
+    'description VARCHAR(80) NOT NULL)',
+    'CREATE TABLE user (id INTEGER PRIMARY KEY, guid VARCHAR(36) NOT NULL UNIQUE, '
+    'username VARCHAR(64) NOT NULL UNIQUE, displayName VARCHAR(128) UNIQUE, email VARCHAR(64) NOT NULL, '
+    'password VARCHAR(512) NOT NULL, created DATETIME NOT NULL, lastLogin DATETIME, '
+    'role INTEGER NOT NULL REFERENCES role (id), "2fa_enabled" BOOLEAN NOT NULL, "2fa_secret" VARCHAR(128))',
+    "INSERT INTO role (id, name, description) VALUES (1, 'admin', 'Admin'), (2, 'user', 'User')",
+    "INSERT INTO user (guid, username, email, password, created, role, \"2fa_enabled\") VALUES "
+    "('a', 'a', 'a@test.test', 'x', '2020-01-01', 2, 0), ('b', 'b', 'b@test.test', 'x', '2020-01-01', 2, 0)"
+]
+
+
+@pytest.fixture
+def legacy_database(tmp_path) -> str:
+    url = f'sqlite:///{tmp_path / "legacy.db"}'
+    engine = create_engine(url)
+    for statement in LEGACY_SCHEMA:
+        engine.execute(statement)
+    engine.dispose()
+    return url
+
+
+def test_new_database_is_created_with_the_latest_version(app):
+    with app.app_context():
+        with db.get_engine().connect() as connection:
+            assert current_version(connection) == LATEST_VERSION
+            assert 'user' in inspect(connection).get_table_names()
+        assert pending_migrations(db.get_engine()) == []
+        # nothing left to apply
+        assert upgrade(db.get_engine()) == []
+
+
+def test_legacy_database_is_migrated(legacy_database):
+    engine = create_engine(legacy_database)
+    with engine.connect() as connection:
+        assert current_version(connection) == 0
+    assert [m.version for m in upgrade(engine)] == list(range(1, LATEST_VERSION + 1))
+
+    inspector = inspect(engine)
+    assert {'passwordPolicy', 'tokenGeneration'} <= {c['name'] for c in inspector.get_columns('user')}
+    assert 'ix_user_role' in {index['name'] for index in inspector.get_indexes('user')}
+    assert list(engine.execute('SELECT name, userCount FROM role ORDER BY id')) == [('admin', 0), ('user', 2)]
+    assert engine.execute(schema_version.select()).fetchall()[-1].version == LATEST_VERSION
+    assert upgrade(engine) == []
+
+
+def test_outdated_schema_is_not_migrated_by_the_workers(legacy_database):
+    class WorkerConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = legacy_database
+        SCHEMA_AUTO_MIGRATE = False
+
+    with pytest.raises(RuntimeError, match='flask db upgrade'):
+        create_app(WorkerConfig)
+
+    # the cli loads the app to apply the migrations
+    with click.Context(click.Command('flask')):
+        app = create_app(WorkerConfig)
+    result = app.test_cli_runner().invoke(args=['db', 'version'])
+    assert f'Version 0 of {LATEST_VERSION}' in result.output
+    result = app.test_cli_runner().invoke(args=['db', 'upgrade'])
+    assert result.exit_code == 0
+    assert 'Applied 1:' in result.output
+    create_app(WorkerConfig)
@@ -0,0 +1,90 @@
+from flask import g
+from tests.utils import Utils
+from sqlalchemy.exc import DBAPIError
+import logging
+import pytest
+
+from app.api import User
+from app.queries import record_queries, statement_shape
+
+
+def test_statement_shape():
+    assert statement_shape('SELECT *\n  FROM user WHERE id IN (?, ?, ?)') == 'SELECT * FROM user WHERE id IN (...)'
+    assert statement_shape('SELECT * FROM user WHERE id IN (%(id_1)s, %(id_2)s)') == \
+        statement_shape('SELECT * FROM user WHERE id IN (%(id_1)s)')
+
+
+def test_failed_statements(app, client):
+    with app.app_context():
+        with client.db.engine.connect() as connection:
+            info = repr(connection.info)
+            with record_queries() as recorder:
+                for _ in range(3):
+                    with pytest.raises(DBAPIError):
+                        connection.execute('SELECT * FROM missing')
+                connection.execute('SELECT 1')
+            # nothing is left on the pooled connection by the failed statements
+            assert repr(connection.info) == info
+    assert recorder.count == 1
+    assert 0 < recorder.duration < 1
+
+
+def test_query_headers(app, client):
+    utils = Utils(app, client)
+    headers = {'Authorization': f'Bearer {utils.generate_admin_access_token()}'}
+    # the first request loads the user of the token
+    assert client.get('/api/roles', headers=headers).headers['X-Query-Count'] == '2'
+    resp = client.get('/api/roles', headers=headers)
+    assert resp.headers['X-Query-Count'] == '1'
+    assert float(resp.headers['X-Query-Time']) > 0
+
+
+def test_queries_per_endpoint(app, client, max_queries):
+    utils = Utils(app, client)
+    headers = {'Authorization': f'Bearer {utils.generate_admin_access_token()}'}
+    for i in range(20):
+        utils.create_user(f'user{i}', role=f'role{i % 4}')
+    client.get('/api/auth', headers=headers)
+
+    # the number of queries doesn't depend on the number of rows
+    with max_queries(2):
+        client.get('/api/users', headers=headers)
+    with max_queries(1):
+        client.get('/api/roles', headers=headers)
+    with max_queries(2):
+        client.get(f'/api/users/{utils.get_guid("user1")}', headers=headers)
+    with max_queries(3):
+        client.post('/api/auth', json={'username': 'test', 'password': 'password_for_test'})
+    client.post('/api/roles', headers=headers, json={'name': 'unused', 'description': 'Unused'})
+    with max_queries(4):
+        client.delete('/api/roles/unused', headers=headers)
+
+
+def test_repeated_statements_are_logged(app, client, caplog):
+    Utils(app, client)
+
+    def lazy_roles():
+        # the role of each user is loaded by its own query
+        return ','.join(user.role.name for user in User.query.all())
+
+    app.add_url_rule('/lazy', 'lazy', lazy_roles)
+    app.config['QUERY_REPEAT_THRESHOLD'] = 1
+    with caplog.at_level(logging.WARNING):
+        with record_queries() as recorder:
+            client.get('/lazy')
+    assert recorder.count == 3
+    assert any('executed a statement 2 times' in record.getMessage() for record in caplog.records)
+
+    caplog.clear()
+    app.config['QUERY_REPEAT_THRESHOLD'] = 2
+    client.get('/lazy')
+    assert not caplog.records
+
+
+def test_statements_not_kept_without_threshold(app, client):
+    Utils(app, client)
+    app.add_url_rule('/recorded', 'recorded', lambda: str(len(User.query.all()) and g.queries.statements))
+    app.config['QUERY_REPEAT_THRESHOLD'] = 0
+    resp = client.get('/recorded')
+    assert resp.data == b'None'
+    assert resp.headers.get('X-Query-Count') == '1'
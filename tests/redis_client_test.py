@@ -0,0 +1,68 @@
+from flask import Flask
+import pytest
+import redis
+
+from app.redis_client import RedisClient
+
+fakeredis = pytest.importorskip('fakeredis')
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def client(server):
+    return RedisClient(fakeredis.FakeStrictRedis(server=server))
+
+
+def test_execute(client):
+    client.set('key', 'value')
+    assert client.get('key') == b'value'
+    assert client.execute('exists', 'key') == 1
+
+    stats = client.stats()
+    assert stats.get('calls') == 3
+    assert stats.get('commands') == 3
+    assert stats.get('errors') == 0
+
+
+def test_batch(client):
+    client.batch_size = 3
+    results = client.batch(('set', f'key{i}', i) for i in range(7))
+    assert results == [True] * 7
+    assert client.batch(('get', f'key{i}') for i in range(8)) == [str(i).encode() for i in range(7)] + [None]
+
+    stats = client.stats()
+    # 7 commands in 3 pipelines and 8 commands in 3 pipelines
+    assert stats.get('batches') == 6
+    assert stats.get('calls') == 6
+    assert stats.get('commands') == 15
+
+
+def test_scan_iter(client):
+    client.batch(('set', f'prefix:{i}', i) for i in range(50))
+    client.set('other', 1)
+    assert len(set(client.scan_iter(match='prefix:*', count=10))) == 50
+
+
+def test_errors(server, client):
+    server.connected = False
+    with pytest.raises(redis.exceptions.ConnectionError):
+        client.get('key')
+    with pytest.raises(redis.exceptions.ConnectionError):
+        client.batch([('get', 'key')])
+    assert client.stats().get('errors') == 2
+
+
+def test_init_app():
+    app = Flask(__name__)
+    app.config.update(REDIS_URL='redis://localhost:6379/0', REDIS_MAX_CONNECTIONS=4, REDIS_SOCKET_TIMEOUT=0.25)
+    client = RedisClient()
+    client.init_app(app)
+    pool = client.client.connection_pool
+    assert isinstance(pool, redis.BlockingConnectionPool)
+    assert pool.max_connections == 4
+    assert pool.connection_kwargs.get('socket_timeout') == 0.25
+    assert client.stats().get('maxConnections') == 4
@@ -0,0 +1,38 @@
+from tests.utils import Utils
+import json
+import logging
+import subprocess
+import sys
+
+from app import create_app
+from app.config import TestingConfig
+
+
+def test_startup_report(app, client):
+    utils = Utils(app, client)
+    report = app.extensions['startup']
+    assert list(dict(report.phases)) == ['import', 'config', 'extensions', 'database', 'routes']
+    assert report.total > 0
+
+    headers = {'Authorization': f'Bearer {utils.generate_admin_access_token()}'}
+    resp = client.get('/api/stats/startup', headers=headers)
+    assert resp.status_code == 200
+    data = json.loads(resp.data.decode()).get('data')
+    assert data['total'] == report.total
+    assert set(data['phases']) == set(dict(report.phases))
+
+
+def test_startup_budget(caplog):
+    class SlowConfig(TestingConfig):
+        STARTUP_BUDGET = 1e-9
+
+    with caplog.at_level(logging.INFO):
+        create_app(SlowConfig)
+    assert any(record.levelno == logging.WARNING and 'budget' in record.getMessage() for record in caplog.records)
+
+
+def test_rarely_used_modules_are_not_imported():
+    code = 'import sys, app; print(",".join(sorted(sys.modules)))'
+    modules = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, check=True).stdout.decode()
+    for module in ['pyqrcode', 'onetimepass', 'redis']:
+        assert module not in modules.strip().split(',')
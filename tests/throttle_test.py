@@ -0,0 +1,77 @@
+import multiprocessing
+import pytest
+
+from app.throttle import LocalThrottle, RedisThrottle, SharedMemoryThrottle
+
+
+def check_throttle(throttle):
+    limits = [('login:client:127.0.0.1', 3, 1), ('login:username:test', 2, 0.5)]
+    # both buckets are checked, the smaller one is empty after two requests
+    assert throttle._acquire(limits, 1000.0) == 0
+    assert throttle._acquire(limits, 1000.0) == 0
+    assert throttle._acquire(limits, 1000.0) == pytest.approx(2)
+    # rejected requests don't take a token of the other bucket
+    assert throttle._acquire(limits[:1], 1000.0) == 0
+    assert throttle._acquire(limits[:1], 1000.0) == pytest.approx(1)
+    # tokens are added over time
+    assert throttle._acquire(limits, 1002.0) == 0
+    assert throttle._acquire([('login:username:other', 2, 0.5)], 1002.0) == 0
+
+
+def test_local_throttle():
+    check_throttle(LocalThrottle())
+
+
+def test_local_throttle_maxsize():
+    throttle = LocalThrottle(maxsize=2)
+    for key in ['a', 'b', 'c']:
+        throttle._acquire([(key, 1, 0.1)], 1000.0)
+    # the least recently used bucket has been dropped, so it's full again
+    assert throttle._acquire([('a', 1, 0.1)], 1000.0) == 0
+    assert throttle._acquire([('c', 1, 0.1)], 1000.0) > 0
+
+
+def test_redis_throttle():
+    fakeredis = pytest.importorskip('fakeredis')
+    # fakeredis executes lua scripts using lupa
+    pytest.importorskip('lupa')
+    throttle = RedisThrottle(client=fakeredis.FakeStrictRedis())
+    check_throttle(throttle)
+    # a bucket expires once it would be full again
+    assert 0 < throttle.client.ttl(throttle.key('login:username:test')) <= 4
+
+
+def test_redis_throttle_unavailable():
+    redis = pytest.importorskip('redis')
+    throttle = RedisThrottle(client=redis.Redis(port=1, socket_connect_timeout=0.1))
+    # requests are allowed if redis is not available
+    assert throttle.acquire([('login:client:127.0.0.1', 1, 1)]) == 0
+    assert throttle.stats() == {'allowed': 1, 'throttled': 0, 'errors': 1}
+
+
+def test_shared_memory_throttle(tmp_path):
+    check_throttle(SharedMemoryThrottle(path=str(tmp_path / 'throttle'), capacity=16))
+
+
+def test_shared_memory_throttle_replaces_oldest(tmp_path):
+    throttle = SharedMemoryThrottle(path=str(tmp_path / 'throttle'), capacity=8)
+    for i in range(9):
+        throttle._acquire([(f'user{i}', 1, 0.01)], 1000.0 + i)
+    assert throttle.evicted == 1
+    # the bucket updated first has been replaced
+    assert throttle._acquire([('user0', 1, 0.01)], 1010.0) == 0
+    assert throttle._acquire([('user8', 1, 0.01)], 1010.0) > 0
+
+
+def test_shared_memory_throttle_between_processes(tmp_path):
+    path = str(tmp_path / 'throttle')
+    limits = [('login:username:test', 1, 0.01)]
+
+    def acquire():
+        SharedMemoryThrottle(path=path, capacity=16).acquire(limits)
+
+    process = multiprocessing.get_context('fork').Process(target=acquire)
+    process.start()
+    process.join()
+    assert process.exitcode == 0
+    assert SharedMemoryThrottle(path=path, capacity=16).acquire(limits) > 0
@@ -0,0 +1,61 @@
+from marshmallow import Schema, fields, validates_schema
+from marshmallow.exceptions import ValidationError
+import pytest
+
+from app.api.validation import CompiledSchema
+from app.api.authentication.schemas import AuthSchema, TokenRefreshSchema
+from app.api.role.schemas import DaoCreateRoleSchema, DaoUpdateRoleSchema
+from app.api.totp.schemas import DaoTokenSchema
+from app.api.user.schemas import DaoCreateUserSchema, DaoUpdateUserSchema, DaoRequestPasswordResetSchema
+
+VALUES = [
+    None, '', ' ', 'a', 'with space', '123456', '1234567', 'test@example.com', 'test @example.com', 'invalid@',
+    'x' * 80, 'x' * 81, 'x' * 200, 'x' * 201, 0, 1.5, True, 'true', 'off', [], {}, ['a'], {'a': 'b'}
+]
+SCHEMAS = [
+    AuthSchema, TokenRefreshSchema, DaoCreateRoleSchema, DaoUpdateRoleSchema, DaoTokenSchema,
+    DaoCreateUserSchema, DaoUpdateUserSchema, DaoRequestPasswordResetSchema
+]
+
+
+def payloads(schema: Schema):
+    yield from [None, [], 'invalid', 1, {}, {'unknown': 'value'}]
+    names = list(schema.fields)
+    for name in names:
+        for value in VALUES:
+            yield {name: value}
+            # all other fields valid
+            yield dict({other: 'test@example.com' for other in names if other != name}, **{name: value})
+    yield {name: value for name, value in zip(names, VALUES)}
+    yield dict({name: value for name, value in zip(names, reversed(VALUES))}, unknown=1)
+
+
+def load(schema, data):
+    try:
+        return 'data', schema.load(data)
+    except ValidationError as errors:
+        return 'errors', errors.messages
+
+
+@pytest.mark.parametrize('schema_class', SCHEMAS, ids=lambda schema: schema.__name__)
+def test_same_result_as_marshmallow(schema_class):
+    compiled = CompiledSchema(schema_class)
+    assert compiled.compiled
+    schema = schema_class()
+    for data in payloads(schema):
+        assert load(compiled, data) == load(schema, data), data
+
+
+def test_schema_with_hooks_is_loaded_by_marshmallow():
+    class PasswordSchema(Schema):
+        password = fields.Str(required=True)
+        repeat = fields.Str(required=True)
+
+        @validates_schema
+        def validate_repeat(self, data, **_):
+            if data.get('password') != data.get('repeat'):
+                raise ValidationError('Passwords are not equal', 'repeat')
+
+    compiled = CompiledSchema(PasswordSchema)
+    assert not compiled.compiled
+    assert load(compiled, {'password': 'a', 'repeat': 'b'}) == ('errors', {'repeat': ['Passwords are not equal']})